@@ -0,0 +1,25 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for common file system operations in the fake file system,
+with the same operations in the real file system as baseline.
+
+:Usage:
+  Run all benchmarks standalone, write the results as JSON and compare
+  them with the results of a previous run::
+
+    python -m pyfakefs.benchmarks --json results.json --baseline old.json
+
+  Run them with pytest-benchmark::
+
+    python -m pytest pyfakefs/benchmarks/pytest_benchmarks.py
+"""
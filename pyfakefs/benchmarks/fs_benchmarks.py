@@ -0,0 +1,147 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The benchmarked file system operations.
+
+Each benchmark uses the standard file system modules, so that it runs
+against the fake file system if called while these are patched, and against
+the real file system otherwise. It gets an empty directory to work in,
+which is prepared by the `setup` function of the benchmark (not measured)
+before calling the `run` function (measured).
+"""
+
+import glob
+import os
+
+from pyfakefs.fake_filesystem_unittest import Patcher
+
+SMALL_CONTENTS = b'x' * 100
+LARGE_CONTENTS = b'x' * (10 * 1024 * 1024)
+CHUNK_SIZE = 64 * 1024
+
+
+class Benchmark(object):
+    """A named benchmark consisting of an optional setup function and
+    the measured function, both called with the working directory.
+
+    Attributes:
+        name: The name of the benchmark.
+        real_fs: If `False`, there is no real file system baseline, and
+            the benchmark is run without patching the file system modules.
+    """
+
+    def __init__(self, name, run, setup=None, real_fs=True):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.real_fs = real_fs
+
+
+def _create_tree(path, dir_count=10, file_count=10):
+    """Create `dir_count` * `dir_count` directories in two levels with
+    `file_count` small files each."""
+    for i in range(dir_count):
+        for j in range(dir_count):
+            dir_path = os.path.join(path, 'dir%d' % i, 'sub%d' % j)
+            os.makedirs(dir_path)
+            for k in range(file_count):
+                file_path = os.path.join(dir_path, 'file%d.txt' % k)
+                with open(file_path, 'wb') as f:
+                    f.write(SMALL_CONTENTS)
+
+
+def _deep_path(path):
+    return os.path.join(path, *['level%d' % i for i in range(30)])
+
+
+def _setup_deep_path(path):
+    deep_path = _deep_path(path)
+    os.makedirs(deep_path)
+    with open(os.path.join(deep_path, 'file'), 'wb') as f:
+        f.write(SMALL_CONTENTS)
+
+
+def _stat_deep_path(path):
+    file_path = os.path.join(_deep_path(path), 'file')
+    for _ in range(1000):
+        os.stat(file_path)
+
+
+def _write_and_read_small_files(path):
+    for i in range(200):
+        file_path = os.path.join(path, 'file%d' % i)
+        with open(file_path, 'wb') as f:
+            f.write(SMALL_CONTENTS)
+        with open(file_path, 'rb') as f:
+            f.read()
+
+
+def _write_and_read_large_file(path):
+    file_path = os.path.join(path, 'large')
+    with open(file_path, 'wb') as f:
+        for offset in range(0, len(LARGE_CONTENTS), CHUNK_SIZE):
+            f.write(LARGE_CONTENTS[offset:offset + CHUNK_SIZE])
+    with open(file_path, 'rb') as f:
+        while f.read(CHUNK_SIZE):
+            pass
+
+
+def _setup_lines(path):
+    with open(os.path.join(path, 'lines.txt'), 'w') as f:
+        for i in range(20000):
+            f.write('line %d\n' % i)
+
+
+def _iterate_lines(path):
+    with open(os.path.join(path, 'lines.txt')) as f:
+        for _ in f:
+            pass
+
+
+def _append_lines(path):
+    file_path = os.path.join(path, 'log.txt')
+    for i in range(500):
+        with open(file_path, 'a') as f:
+            f.write('line %d\n' % i)
+
+
+def _walk_tree(path):
+    for _ in os.walk(path):
+        pass
+
+
+def _glob_tree(path):
+    glob.glob(os.path.join(path, 'dir*', 'sub*', '*.txt'))
+
+
+def _rename_tree(path):
+    os.rename(os.path.join(path, 'dir0'), os.path.join(path, 'renamed'))
+
+
+def _patcher_setup_and_teardown(path):
+    patcher = Patcher()
+    patcher.setUp()
+    patcher.tearDown()
+
+
+BENCHMARKS = [
+    Benchmark('create_tree', _create_tree),
+    Benchmark('stat_deep_path', _stat_deep_path, setup=_setup_deep_path),
+    Benchmark('small_files', _write_and_read_small_files),
+    Benchmark('large_file', _write_and_read_large_file),
+    Benchmark('line_iteration', _iterate_lines, setup=_setup_lines),
+    Benchmark('append_loop', _append_lines),
+    Benchmark('walk_tree', _walk_tree, setup=_create_tree),
+    Benchmark('glob_tree', _glob_tree, setup=_create_tree),
+    Benchmark('rename_tree', _rename_tree, setup=_create_tree),
+    Benchmark('patcher_setup', _patcher_setup_and_teardown, real_fs=False),
+]
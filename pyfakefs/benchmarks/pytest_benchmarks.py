@@ -0,0 +1,75 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The file system benchmarks as pytest-benchmark tests.
+
+Each benchmark is run in the fake and in the real file system, so that
+pytest-benchmark can group and compare them. Regressions against saved
+runs can be checked using the pytest-benchmark options, for example::
+
+    python -m pytest pyfakefs/benchmarks/pytest_benchmarks.py \
+        --benchmark-autosave --benchmark-compare \
+        --benchmark-compare-fail=min:25%
+"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from pyfakefs.benchmarks.fs_benchmarks import BENCHMARKS
+from pyfakefs.fake_filesystem_unittest import Patcher
+
+pytest.importorskip('pytest_benchmark')
+
+
+def _run_pedantic(benchmark, fs_benchmark, base_path, rounds=5):
+    paths = []
+
+    def setup():
+        path = os.path.join(base_path, 'round%d' % len(paths))
+        paths.append(path)
+        os.makedirs(path)
+        if fs_benchmark.setup is not None:
+            fs_benchmark.setup(path)
+        return (path,), {}
+
+    benchmark.pedantic(fs_benchmark.run, setup=setup, rounds=rounds)
+
+
+@pytest.mark.parametrize('fs_benchmark', BENCHMARKS,
+                         ids=[b.name for b in BENCHMARKS])
+def test_fake_fs(benchmark, fs_benchmark):
+    benchmark.group = fs_benchmark.name
+    if not fs_benchmark.real_fs:
+        # the benchmark handles the patching itself
+        base_path = tempfile.mkdtemp()
+        try:
+            _run_pedantic(benchmark, fs_benchmark, base_path)
+        finally:
+            shutil.rmtree(base_path)
+        return
+    with Patcher():
+        _run_pedantic(benchmark, fs_benchmark, tempfile.gettempdir())
+
+
+@pytest.mark.parametrize('fs_benchmark',
+                         [b for b in BENCHMARKS if b.real_fs],
+                         ids=[b.name for b in BENCHMARKS if b.real_fs])
+def test_real_fs(benchmark, fs_benchmark):
+    benchmark.group = fs_benchmark.name
+    base_path = tempfile.mkdtemp()
+    try:
+        _run_pedantic(benchmark, fs_benchmark, base_path)
+    finally:
+        shutil.rmtree(base_path)
@@ -0,0 +1,217 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Standalone runner for the file system benchmarks.
+
+Each benchmark is run for a number of rounds in the fake file system,
+and - as baseline - in a temporary directory in the real file system.
+The results can be written as JSON, and compared with the results of a
+previous run to detect performance regressions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+from pyfakefs import fake_filesystem
+from pyfakefs.benchmarks.fs_benchmarks import BENCHMARKS
+from pyfakefs.fake_filesystem_unittest import Patcher
+
+DEFAULT_ROUNDS = 5
+DEFAULT_THRESHOLD = 1.25
+
+
+def _time_rounds(benchmark, base_path, rounds):
+    """Run `benchmark` `rounds` times, each time in a new directory
+    below `base_path`, and return the measured times in seconds."""
+    times = []
+    for i in range(rounds):
+        path = os.path.join(base_path, 'round%d' % i)
+        os.makedirs(path)
+        if benchmark.setup is not None:
+            benchmark.setup(path)
+        start = timeit.default_timer()
+        benchmark.run(path)
+        times.append(timeit.default_timer() - start)
+    return times
+
+
+def time_fake(benchmark, rounds):
+    """Return the times measured for `benchmark` in the fake file system."""
+    if not benchmark.real_fs:
+        # the benchmark handles the patching itself
+        base_path = tempfile.mkdtemp()
+        try:
+            return _time_rounds(benchmark, base_path, rounds)
+        finally:
+            shutil.rmtree(base_path)
+    with Patcher():
+        return _time_rounds(benchmark, tempfile.gettempdir(), rounds)
+
+
+def time_real(benchmark, rounds):
+    """Return the times measured for `benchmark` in the real file system,
+    or `None` if the benchmark has no real file system baseline."""
+    if not benchmark.real_fs:
+        return None
+    base_path = tempfile.mkdtemp()
+    try:
+        return _time_rounds(benchmark, base_path, rounds)
+    finally:
+        shutil.rmtree(base_path)
+
+
+def _statistics(times):
+    if times is None:
+        return None
+    return {'min': min(times), 'mean': sum(times) / len(times)}
+
+
+def run_benchmarks(names=None, rounds=DEFAULT_ROUNDS, real_fs=True):
+    """Run the given benchmarks and return the results.
+
+    Args:
+        names: The names of the benchmarks to run, or `None` to run all.
+        rounds: The number of times each benchmark is run.
+        real_fs: If `True`, the benchmarks are also run in the real file
+            system as baseline.
+
+    Returns:
+        A dictionary with information about the environment under
+        `'environment'`, and the results per benchmark name under
+        `'benchmarks'`. Each result contains the minimum and mean time in
+        seconds for the fake and the real file system, and the ratio of the
+        minimum fake to real times.
+
+    Raises:
+        ValueError: if an unknown benchmark name is given.
+    """
+    benchmarks = BENCHMARKS
+    if names:
+        unknown = set(names) - set(b.name for b in BENCHMARKS)
+        if unknown:
+            raise ValueError('Unknown benchmarks: %s' %
+                             ', '.join(sorted(unknown)))
+        benchmarks = [b for b in BENCHMARKS if b.name in names]
+    results = {}
+    for benchmark in benchmarks:
+        fake = _statistics(time_fake(benchmark, rounds))
+        real = _statistics(time_real(benchmark, rounds) if real_fs else None)
+        ratio = None
+        if real is not None and real['min'] > 0:
+            ratio = fake['min'] / real['min']
+        results[benchmark.name] = {'fake': fake, 'real': real,
+                                   'ratio': ratio}
+    return {
+        'environment': {
+            'pyfakefs': fake_filesystem.__version__,
+            'python': platform.python_version(),
+            'platform': sys.platform,
+            'rounds': rounds,
+        },
+        'benchmarks': results,
+    }
+
+
+def find_regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Compare `results` with the `baseline` results of a previous run.
+
+    If both runs contain real file system baselines, the ratios of fake to
+    real times are compared, which makes the comparison mostly independent
+    of the speed of the machine. Otherwise, the minimum fake times are
+    compared.
+
+    Args:
+        results: The results returned by `run_benchmarks`.
+        baseline: Results of a previous run in the same format.
+        threshold: The factor by which a benchmark may be slower than
+            in the baseline before it counts as regression.
+
+    Returns:
+        A list of `(name, old value, new value)` tuples for all
+        regressed benchmarks.
+    """
+    regressions = []
+    old_results = baseline['benchmarks']
+    for name, result in sorted(results['benchmarks'].items()):
+        if name not in old_results:
+            continue
+        old_result = old_results[name]
+        if result['ratio'] is not None and old_result['ratio'] is not None:
+            old_value, new_value = old_result['ratio'], result['ratio']
+        else:
+            old_value = old_result['fake']['min']
+            new_value = result['fake']['min']
+        if new_value > old_value * threshold:
+            regressions.append((name, old_value, new_value))
+    return regressions
+
+
+def _format_result(name, result):
+    line = '%-16s fake: %9.4fs' % (name, result['fake']['min'])
+    if result['real'] is not None:
+        line += '  real: %9.4fs' % result['real']['min']
+    if result['ratio'] is not None:
+        line += '  ratio: %6.2f' % result['ratio']
+    return line
+
+
+def main(argv=None):
+    """Run the benchmarks from the command line.
+
+    Returns:
+        1 if regressions against the baseline have been found, 0 otherwise.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m pyfakefs.benchmarks',
+        description='Benchmarks for the pyfakefs fake file system.')
+    parser.add_argument('names', nargs='*', metavar='NAME',
+                        help='Benchmarks to run (default: all of %s)' %
+                             ', '.join(b.name for b in BENCHMARKS))
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS,
+                        help='Number of rounds per benchmark '
+                             '(default: %(default)s)')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Write the results as JSON to PATH')
+    parser.add_argument('--baseline', metavar='PATH',
+                        help='Compare the results with the JSON results '
+                             'of a previous run')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Slowdown factor against the baseline counted '
+                             'as regression (default: %(default)s)')
+    parser.add_argument('--no-real', action='store_true',
+                        help='Do not run the real file system baselines')
+    args = parser.parse_args(argv)
+
+    try:
+        results = run_benchmarks(args.names, args.rounds, not args.no_real)
+    except ValueError as exc:
+        parser.error(str(exc))
+    for name, result in sorted(results['benchmarks'].items()):
+        print(_format_result(name, result))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.threshold)
+        for name, old_value, new_value in regressions:
+            print('REGRESSION %s: %.4f -> %.4f' % (name, old_value, new_value))
+        if regressions:
+            return 1
+    return 0
@@ -22,3 +22,9 @@ except ImportError:
     except ImportError:
         use_scandir = False
         use_scandir_package = False
+
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
@@ -93,25 +93,45 @@ True
 >>> stat.S_ISDIR(os_module.stat(os_module.path.dirname(pathname)).st_mode)
 True
 """
+import base64
+import contextlib
 import errno
-import heapq
+import functools
 import io
+import json
 import locale
+import mmap
 import os
 import platform
+import struct
 import sys
+import tarfile
+import tempfile
+import threading
 import time
 import warnings
-from collections import namedtuple
+import zipfile
+import zlib
+from collections import namedtuple, OrderedDict
+from multiprocessing.pool import ThreadPool
 from stat import S_IFREG, S_IFDIR, S_ISLNK, S_IFMT, S_ISDIR, S_IFLNK, S_ISREG
 
 from pyfakefs.deprecator import Deprecator
 from pyfakefs.fake_scandir import scandir, walk
-from pyfakefs.extra_packages import use_scandir
+from pyfakefs.extra_packages import use_scandir, use_scandir_package
+from pyfakefs.extra_packages import lz4_frame
 from pyfakefs.helpers import FakeStatResult, FileBufferIO, IS_PY2, NullFileBufferIO
+from pyfakefs.helpers import ContentStore, SparseContents, SparseStream
+from pyfakefs.helpers import FD_CLOEXEC, FileDescriptorTable, synchronize
+from pyfakefs.helpers import OperationStats, RealClock
 from pyfakefs.helpers import is_int_type, is_byte_string, is_unicode_string
 from pyfakefs.helpers import make_string_path, text_type
 
+if use_scandir_package:
+    from scandir import scandir as _real_scandir
+elif use_scandir:
+    _real_scandir = os.scandir
+
 __pychecker__ = 'no-reimportself'
 
 __version__ = '3.5'
@@ -162,10 +182,34 @@ FAKE_PATH_MODULE_DEPRECATION = (
 
 NR_STD_STREAMS = 3
 
+# file system image layout: magic, format version, metadata size,
+# content section offset and size, followed by the zlib-compressed
+# JSON metadata and the raw file contents
+_IMAGE_MAGIC = b'PYFAKEFS'
+_IMAGE_VERSION = 2
+_IMAGE_HEADER = struct.Struct('<8sIQQQ')
+
+# directory for the spill files of ContentSpiller - determined at import
+# time, as the tempfile module may be patched later
+_SPILL_DIR = tempfile.gettempdir()
+
+# maximum number of threads used to scan real directories
+# in add_real_directory(lazy_read=False)
+_REAL_DIR_SCAN_THREADS = 8
+
+# minimum size of a hole created by resizing a file or by seeking past
+# its end that makes the file sparse instead of filling the hole with zeros
+_SPARSE_HOLE_SIZE = 1024 * 1024
+
+# whence values for seeking to data and holes in sparse files
+SEEK_DATA = getattr(os, 'SEEK_DATA', 3)
+SEEK_HOLE = getattr(os, 'SEEK_HOLE', 4)
+
 
 class FakeLargeFileIoException(Exception):
-    """Exception thrown on unsupported operations for fake large files.
-    Fake large files have a size with no real content.
+    """Exception formerly thrown on read and write operations for fake
+    large files. Not raised anymore, as large files are sparse files now,
+    which can be read and written.
     """
 
     def __init__(self, file_path):
@@ -174,6 +218,21 @@ class FakeLargeFileIoException(Exception):
             'fake large file: %s' % file_path)
 
 
+def _synchronized(method):
+    """Decorator for methods of fake file system objects that run under
+    the lock of the object if the file system is thread-safe
+    (see :py:meth:`FakeFilesystem.enable_thread_safety`)."""
+    @functools.wraps(method)
+    def synchronized_method(self, *args, **kwargs):
+        lock = self._lock
+        if lock is None:
+            return method(self, *args, **kwargs)
+        with lock:
+            return method(self, *args, **kwargs)
+
+    return synchronized_method
+
+
 def _copy_module(old):
     """Recompiles and creates new module object."""
     saved = sys.modules.pop(old.__name__, None)
@@ -205,6 +264,8 @@ class FakeFile(object):
         'st_size', 'st_atime', 'st_mtime', 'st_ctime',
         'st_atime_ns', 'st_mtime_ns', 'st_ctime_ns'
     )
+    # the lock of the object in a thread-safe file system
+    _lock = None
 
     def __init__(self, name, st_mode=S_IFREG | PERM_DEF_FILE,
                  contents=None, filesystem=None, encoding=None, errors=None):
@@ -225,10 +286,12 @@ class FakeFile(object):
         if filesystem is None:
             raise ValueError('filesystem shall not be None')
         self.filesystem = filesystem
+        if filesystem._thread_safe:
+            self._lock = threading.RLock()
 
         self.name = name
         self.stat_result = FakeStatResult(
-            filesystem.is_windows_fs, time.time())
+            filesystem.is_windows_fs, filesystem.clock.time())
         self.stat_result.st_mode = st_mode
         self.encoding = encoding
         self.errors = errors or 'strict'
@@ -242,8 +305,22 @@ class FakeFile(object):
 
     @property
     def byte_contents(self):
-        """Return the contents as raw byte array."""
-        return self._byte_contents
+        """Return the contents as raw byte array, or `None` for
+        a sparse file."""
+        contents = self._byte_contents
+        if contents.__class__ is SparseContents:
+            return None
+        if contents.__class__ is bytearray:
+            # shared with a writable memory map
+            return bytes(contents)
+        pager = self.filesystem.content_pager
+        if pager:
+            return self._paged_contents(pager)
+        return contents
+
+    @_synchronized
+    def _paged_contents(self, pager):
+        return pager.contents(self)
 
     @property
     def contents(self):
@@ -287,13 +364,16 @@ class FakeFile(object):
         """Set the modification time of the fake file."""
         self._st_mtime = val
 
+    @_synchronized
     def set_large_file_size(self, st_size):
-        """Sets the self.st_size attribute and replaces self.content with None.
+        """Sets the self.st_size attribute and makes the file a sparse file
+        consisting of a single hole.
 
         Provided specifically to simulate very large files without regards
         to their content (which wouldn't fit in memory).
-        Note that read/write operations with such a file raise
-            :py:class:`FakeLargeFileIoException`.
+        Reading the file returns null bytes, and only data written to the
+        file is stored. `contents` and `byte_contents` of such a file
+        are `None`.
 
         Args:
           st_size: (int) The desired file size
@@ -308,7 +388,60 @@ class FakeFile(object):
         if self.filesystem:
             self.filesystem.change_disk_usage(st_size, self.name, self.st_dev)
         self.st_size = st_size
-        self._byte_contents = None
+        self._byte_contents = SparseContents(size=st_size)
+
+    def read_at(self, offset, size):
+        """Return up to `size` bytes of the contents starting at `offset`,
+        without copying the rest of the contents."""
+        contents = self._byte_contents
+        if contents.__class__ is SparseContents:
+            return contents.read(offset, size)
+        if contents.__class__ is not bytearray:
+            contents = self.byte_contents
+        return bytes(contents[offset:offset + size])
+
+    def mutable_contents(self):
+        """Return the contents as a bytearray that is changed in place,
+        or the sparse contents of a sparse file. The contents are converted
+        into a bytearray only once, and stay mutable until they are replaced
+        as a whole."""
+        contents = self._byte_contents
+        if contents.__class__ not in (bytearray, SparseContents):
+            if self.filesystem.content_pager:
+                self.filesystem.content_pager.discard(self)
+            contents = bytearray(self.byte_contents or b'')
+            self._byte_contents = contents
+        return contents
+
+    @_synchronized
+    def write_at(self, offset, data):
+        """Write `data` in place at `offset`, extending the file if needed,
+        and update the modification time.
+
+        Raises:
+          IOError: if the new size exceeds the available file system space.
+        """
+        end = offset + len(data)
+        contents = self.mutable_contents()
+        if (contents.__class__ is bytearray and
+                offset - len(contents) >= _SPARSE_HOLE_SIZE):
+            contents = SparseContents(bytes(contents))
+            self._byte_contents = contents
+        if contents.__class__ is SparseContents:
+            contents.write(offset, data)
+            self.update_sparse_size()
+            return
+        if end > self.st_size:
+            self.filesystem.change_disk_usage(
+                end - self.st_size, self.name, self.st_dev)
+            self.st_size = end
+        if offset > len(contents):
+            contents.extend(b'\0' * (offset - len(contents)))
+        contents[offset:end] = data
+        self.epoch += 1
+        current_time = self.filesystem.clock.time()
+        self.st_ctime = current_time
+        self.st_mtime = current_time
 
     def _check_positive_int(self, size):
         # the size should be an positive integer value
@@ -316,9 +449,32 @@ class FakeFile(object):
             self.filesystem.raise_io_error(errno.ENOSPC, self.name)
 
     def is_large_file(self):
-        """Return `True` if this file was initialized with size but no contents.
+        """Return `True` if this is a sparse file, e.g. a file initialized
+        with size but no contents.
+        """
+        return self._byte_contents.__class__ is SparseContents
+
+    @_synchronized
+    def update_sparse_size(self):
+        """Adapt the size and the modification time of a sparse file after
+        its contents have been written in place.
+
+        Raises:
+          IOError: if the new size exceeds the available file system space.
         """
-        return self._byte_contents is None
+        contents = self._byte_contents
+        if contents.size != self.st_size:
+            try:
+                self.filesystem.change_disk_usage(
+                    contents.size - self.st_size, self.name, self.st_dev)
+            except IOError:
+                contents.truncate(self.st_size)
+                raise
+            self.st_size = contents.size
+        self.epoch += 1
+        current_time = self.filesystem.clock.time()
+        self.st_ctime = current_time
+        self.st_mtime = current_time
 
     def _encode_contents(self, contents):
         if is_unicode_string(contents):
@@ -355,6 +511,7 @@ class FakeFile(object):
         self.st_size = st_size
         self.epoch += 1
 
+    @_synchronized
     def set_contents(self, contents, encoding=None):
         """Sets the file contents and size and increases the modification time.
 
@@ -370,7 +527,7 @@ class FakeFile(object):
         """
         self.encoding = encoding
         self._set_initial_contents(contents)
-        current_time = time.time()
+        current_time = self.filesystem.clock.time()
         self.st_ctime = current_time
         self.st_mtime = current_time
 
@@ -411,9 +568,11 @@ class FakeFile(object):
         return self.size
 
     @size.setter
+    @_synchronized
     def size(self, st_size):
         """Resizes file content, padding with nulls if new size exceeds the
-        old size.
+        old size. If the file grows by at least 1 MB, it becomes a sparse
+        file instead.
 
         Args:
           st_size: The desired size for the file.
@@ -427,15 +586,22 @@ class FakeFile(object):
         current_size = self.st_size or 0
         self.filesystem.change_disk_usage(
             st_size - current_size, self.name, self.st_dev)
-        if self._byte_contents:
-            if st_size < current_size:
-                self._byte_contents = self._byte_contents[:st_size]
-            else:
-                if IS_PY2:
+        if self.is_large_file():
+            self._byte_contents.truncate(st_size)
+        else:
+            # the contents may be paged in here, so use them directly
+            contents = self.byte_contents
+            if st_size - current_size >= _SPARSE_HOLE_SIZE:
+                self._byte_contents = SparseContents(contents or b'', st_size)
+            elif contents:
+                if st_size < current_size:
+                    self._byte_contents = contents[:st_size]
+                elif IS_PY2:
                     self._byte_contents = '%s%s' % (
-                        self._byte_contents, '\0' * (st_size - current_size))
+                        contents, '\0' * (st_size - current_size))
                 else:
-                    self._byte_contents += b'\0' * (st_size - current_size)
+                    self._byte_contents = contents + b'\0' * (
+                        st_size - current_size)
         self.st_size = st_size
         self.epoch += 1
 
@@ -478,8 +644,35 @@ class FakeFile(object):
         """Forward some properties to stat_result."""
         if key in self.stat_types:
             return setattr(self.stat_result, key, value)
+        if key == '_byte_contents':
+            filesystem = self.filesystem
+            if filesystem.content_store:
+                value = self._interned_contents(value)
+            super(FakeFile, self).__setattr__(key, value)
+            if filesystem.content_pager and isinstance(value, bytes):
+                filesystem.content_pager.used(self)
+            return
         return super(FakeFile, self).__setattr__(key, value)
 
+    def _interned_contents(self, contents):
+        """Return the contents from the content store, and release the
+        current contents."""
+        store = self.filesystem.content_store
+        if self.__dict__.get('_interned'):
+            store.release(self.__dict__['_byte_contents'])
+        interned = isinstance(contents, bytes)
+        self.__dict__['_interned'] = interned
+        return store.intern(contents) if interned else contents
+
+    def release_contents(self):
+        """Release the contents from the content store and the content
+        pager of the file system, if used. Called if the file is removed."""
+        if self.filesystem.content_pager:
+            self.filesystem.content_pager.discard(self)
+        if self.__dict__.get('_interned'):
+            self.__dict__['_interned'] = False
+            self.filesystem.content_store.release(self._byte_contents)
+
     def __str__(self):
         return '%s(%o)' % (self.name, self.st_mode)
 
@@ -517,7 +710,9 @@ Deprecator.add(FakeFile, FakeFile.is_large_file, 'IsLargeFile')
 class FakeFileFromRealFile(FakeFile):
     """Represents a fake file copied from the real file system.
 
-    The contents of the file are read on demand only.
+    The contents of the file are read on demand only. As long as the file
+    is only opened for reading, the contents are read directly from the
+    real file, so that only the accessed bytes are read.
     """
 
     def __init__(self, file_path, filesystem):
@@ -536,17 +731,116 @@ class FakeFileFromRealFile(FakeFile):
 
     @property
     def byte_contents(self):
-        if not self.contents_read:
+        if real_fs_cache.enabled:
+            # the shared contents are replaced on change, never modified
+            if not self.contents_read:
+                self.contents_read = True
+                self._byte_contents = real_fs_cache.contents(self.file_path)
+        elif not self.contents_read:
             self.contents_read = True
             with io.open(self.file_path, 'rb') as f:
                 self._byte_contents = f.read()
-        # On MacOS and BSD, the above io.open() updates atime on the real file
+        return super(FakeFileFromRealFile, self).byte_contents
+
+    def open_stream(self):
+        """Called on opening the file for reading only.
+
+        Returns:
+            A binary stream reading the contents from the real file, or
+            `None` if the contents are already read into the fake file.
+        """
+        if real_fs_cache.enabled:
+            return None
+        stream = None
+        if not self.contents_read:
+            stream = io.open(self.file_path, 'rb')
+        # On MacOS and BSD, opening the real file updates its atime
         self.st_atime = os.stat(self.file_path).st_atime
-        return self._byte_contents
+        return stream
+
+
+class LazyFakeFile(FakeFile):
+    """Base class for fake files with contents that are read on demand
+    from some external source. Derived classes implement `_read_contents()`.
+    """
+
+    def __init__(self, name, filesystem, st_mode=S_IFREG | PERM_DEF_FILE):
+        """
+        Args:
+            name: Name of the file, without parent path information.
+            filesystem: The fake filesystem where the file is created.
+            st_mode: The stat.S_IF* constant representing the file type.
+        """
+        super(LazyFakeFile, self).__init__(name, st_mode,
+                                           filesystem=filesystem)
+        self.contents_read = False
+
+    def _read_contents(self):
+        """Return the file contents as bytes from the external source."""
+        raise NotImplementedError
+
+    @property
+    def byte_contents(self):
+        if not self.contents_read:
+            self.contents_read = True
+            self._byte_contents = self._read_contents()
+        return super(LazyFakeFile, self).byte_contents
+
+    def _set_initial_contents(self, contents):
+        self.contents_read = True
+        super(LazyFakeFile, self)._set_initial_contents(contents)
 
-    def is_large_file(self):
-        """The contents are never faked."""
-        return False
+
+class FakeFileFromImage(LazyFakeFile):
+    """Represents a fake file loaded from a file system image
+    (see :py:meth:`FakeFilesystem.load_image`).
+
+    The contents of the file are read from the memory-mapped image
+    on demand only.
+    """
+
+    def __init__(self, name, filesystem, image, offset, length):
+        """
+        Args:
+            name: Name of the file, without parent path information.
+            filesystem: The fake filesystem where the file is created.
+            image: The memory-mapped image file.
+            offset: The offset of the file contents inside the image.
+            length: The length of the file contents in bytes.
+        """
+        super(FakeFileFromImage, self).__init__(name, filesystem)
+        self._image = image
+        self._offset = offset
+        self._length = length
+
+    def _read_contents(self):
+        contents = self._image[self._offset:self._offset + self._length]
+        self._image = None
+        return contents
+
+
+class FakeFileFromArchive(LazyFakeFile):
+    """Represents a fake file added from a member of a tar or zip archive
+    in the real file system (see :py:meth:`FakeFilesystem.add_archive`).
+
+    The contents of the member are read from the archive on demand only.
+    """
+
+    def __init__(self, name, filesystem, reader, member, st_mode):
+        """
+        Args:
+            name: Name of the file, without parent path information.
+            filesystem: The fake filesystem where the file is created.
+            reader: Callable that returns the contents of `member`.
+            member: The member reference as used by `reader`.
+            st_mode: The stat.S_IF* constant representing the file type.
+        """
+        super(FakeFileFromArchive, self).__init__(name, filesystem, st_mode)
+        self._reader = reader
+        self._member = member
+
+    def _read_contents(self):
+        return self._reader(self._member)
 
 
 class FakeDirectory(FakeFile):
@@ -586,6 +880,7 @@ class FakeDirectory(FakeFile):
         return [item[0] for item in sorted(
             self.byte_contents.items(), key=lambda entry: entry[1].st_ino)]
 
+    @_synchronized
     def add_entry(self, path_object):
         """Adds a child FakeFile to this directory.
 
@@ -600,10 +895,12 @@ class FakeDirectory(FakeFile):
             exception = IOError if IS_PY2 else OSError
             raise exception(errno.EACCES, 'Permission Denied', self.path)
 
-        if path_object.name in self.contents:
+        if self._entry(path_object.name) is not None:
             self.filesystem.raise_os_error(errno.EEXIST, self.path)
+        self._add_entry(path_object)
 
-        self.contents[path_object.name] = path_object
+    def _add_entry(self, path_object):
+        self.byte_contents[path_object.name] = path_object
         path_object.parent_dir = self
         self.st_nlink += 1
         path_object.st_nlink += 1
@@ -625,17 +922,31 @@ class FakeDirectory(FakeFile):
             KeyError: if no child exists by the specified name.
         """
         pathname_name = self._normalized_entryname(pathname_name)
-        return self.contents[pathname_name]
+        entry = self._entry(pathname_name)
+        if entry is None:
+            raise KeyError(pathname_name)
+        return entry
+
+    def _entry(self, pathname_name):
+        """Return the child entry with exactly the given name,
+        or `None` if it does not exist."""
+        return self.contents.get(pathname_name)
 
     def _normalized_entryname(self, pathname_name):
         if not self.filesystem.is_case_sensitive:
-            matching_names = [name for name in self.contents
+            # in a thread-safe file system, the entries may be changed
+            # by another thread meanwhile
+            names = self.contents if self._lock is None else list(
+                self.contents)
+            matching_names = [name for name in names
                               if name.lower() == pathname_name.lower()]
             if matching_names:
                 pathname_name = matching_names[0]
         return pathname_name
 
-    def remove_entry(self, pathname_name, recursive=True):
+    @_synchronized
+    def remove_entry(self, pathname_name, recursive=True,
+                     keep_contents=False):
         """Removes the specified child file or directory.
 
         Args:
@@ -643,6 +954,9 @@ class FakeDirectory(FakeFile):
             recursive: If True (default), the entries in contained directories
                 are deleted first. Used to propagate removal errors
                 (e.g. permission problems) from contained entries.
+            keep_contents: If True, the contents of the removed entry are
+                not released even if it has no links left. Used if the entry
+                is moved to another directory.
 
         Raises:
             KeyError: if no child exists by the specified name.
@@ -661,6 +975,11 @@ class FakeDirectory(FakeFile):
                 self.filesystem.raise_os_error(errno.EACCES, pathname_name)
 
         if recursive and isinstance(entry, FakeDirectory):
+            if (isinstance(entry, FakeDirectoryFromRealDirectory) and
+                    not entry.contents_read):
+                # entries not read from the real directory yet
+                # need not be removed
+                entry.contents_read = True
             while entry.contents:
                 entry.remove_entry(list(entry.contents)[0])
         elif entry.st_nlink == 1:
@@ -670,14 +989,18 @@ class FakeDirectory(FakeFile):
         self.st_nlink -= 1
         entry.st_nlink -= 1
         assert entry.st_nlink >= 0
+        if not entry.st_nlink and not keep_contents:
+            entry.release_contents()
 
-        del self.contents[pathname_name]
+        del self.byte_contents[pathname_name]
 
     @property
     def size(self):
         """Return the total size of all files contained in this directory tree.
         """
-        return sum([item[1].size for item in self.contents.items()])
+        # copying the entries first makes this safe against concurrent
+        # changes in a thread-safe file system
+        return sum([entry.size for entry in list(self.contents.values())])
 
     @Deprecator('property size')
     def GetSize(self):
@@ -716,7 +1039,7 @@ class FakeDirectoryFromRealDirectory(FakeDirectory):
     """
 
     def __init__(self, source_path, filesystem, read_only,
-                 target_path=None):
+                 target_path=None, real_stat=None):
         """
         Args:
             source_path: Full directory path.
@@ -727,12 +1050,15 @@ class FakeDirectoryFromRealDirectory(FakeDirectory):
                 only as usually.
             target_path: If given, the target path of the directory,
                 otherwise the target is the same as `source_path`.
+            real_stat: If given, the stat result of the real directory,
+                otherwise it is retrieved from the real file system.
 
         Raises:
             OSError: if the directory does not exist in the real file system
         """
         target_path = target_path or source_path
-        real_stat = os.stat(source_path)
+        if real_stat is None:
+            real_stat = _real_stat(source_path)
         super(FakeDirectoryFromRealDirectory, self).__init__(
             name=os.path.split(target_path)[1],
             perm_bits=real_stat.st_mode,
@@ -746,33 +1072,779 @@ class FakeDirectoryFromRealDirectory(FakeDirectory):
         self.source_path = source_path
         self.read_only = read_only
         self.contents_read = False
+        # names already looked up in the real directory - these are not
+        # read again, so that removed or added fake entries are preserved
+        self._read_names = set()
 
     @property
     def contents(self):
         """Return the list of contained directory entries, loading them
         if not already loaded."""
         if not self.contents_read:
-            self.contents_read = True
-            base = self.path
-            for entry in os.listdir(self.source_path):
-                source_path = os.path.join(self.source_path, entry)
-                target_path = os.path.join(base, entry)
-                if os.path.isdir(source_path):
-                    self.filesystem.add_real_directory(
-                        source_path, self.read_only, target_path=target_path)
-                else:
-                    self.filesystem.add_real_file(
-                        source_path, self.read_only, target_path=target_path)
+            self._read_contents()
         return self.byte_contents
 
+    @_synchronized
+    def _read_contents(self):
+        if self.contents_read:
+            # already loaded by another thread
+            return
+        for name, is_dir, real_stat in _scan_real_directory(
+                self.source_path, follow_dir_links=True):
+            if (name not in self._read_names and
+                    name not in self.byte_contents):
+                self._add_real_entry(name, is_dir, real_stat)
+        self._read_names = None
+        self.contents_read = True
+
+    def _entry(self, pathname_name):
+        """Return the entry with the given name, reading only this entry
+        from the real directory if the contents are not loaded yet.
+        In a case-insensitive file system, all contents are loaded to get
+        the correct name."""
+        if self.contents_read or not self.filesystem.is_case_sensitive:
+            return self.contents.get(pathname_name)
+        return self._read_entry(pathname_name)
+
+    @_synchronized
+    def _read_entry(self, pathname_name):
+        if self.contents_read:
+            return self.byte_contents.get(pathname_name)
+        if pathname_name not in self._read_names:
+            self._read_names.add(pathname_name)
+            if pathname_name not in self.byte_contents:
+                try:
+                    real_stat = _real_stat(
+                        os.path.join(self.source_path, pathname_name))
+                except OSError:
+                    real_stat = None
+                if real_stat is not None:
+                    self._add_real_entry(
+                        pathname_name, S_ISDIR(real_stat.st_mode), real_stat)
+        return self.byte_contents.get(pathname_name)
+
+    def _add_real_entry(self, name, is_dir, real_stat):
+        source_path = os.path.join(self.source_path, name)
+        if is_dir:
+            entry = FakeDirectoryFromRealDirectory(
+                source_path, self.filesystem, self.read_only,
+                real_stat=real_stat)
+        else:
+            entry = _real_file_object(
+                source_path, self.filesystem, self.read_only, real_stat)
+        entry.st_ino = self.filesystem._new_inode()
+        # reading the real directory is not a write access,
+        # so the permissions are not checked
+        self._add_entry(entry)
+
     @property
     def size(self):
-        # we cannot get the size until the contents are loaded
+        # only the entries loaded so far are accounted for
         if not self.contents_read:
-            return 0
+            return sum([entry.size for entry in self.byte_contents.values()])
         return super(FakeDirectoryFromRealDirectory, self).size
 
 
+def _read_real_directory(source_path):
+    """Return a list of (name, is_dir_link, stat_result) tuples for the
+    entries of the real directory at `source_path`, with `is_dir_link` set
+    for symlinks to directories. Symlinks are resolved, broken symlinks are
+    ignored. Uses `scandir` where available to avoid separate `stat`
+    calls for the file type.
+    """
+    entries = []
+    if use_scandir:
+        for entry in _real_scandir(source_path):
+            try:
+                real_stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((entry.name, S_ISDIR(real_stat.st_mode) and
+                            entry.is_symlink(), real_stat))
+    else:
+        for name in os.listdir(source_path):
+            path = os.path.join(source_path, name)
+            try:
+                real_stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((name, S_ISDIR(real_stat.st_mode) and
+                            os.path.islink(path), real_stat))
+    return entries
+
+
+def _scan_real_directory(source_path, follow_dir_links=False):
+    """Return a list of (name, is_dir, stat_result) tuples for the entries
+    of the real directory at `source_path`. As with `os.walk()`, symlinks
+    to directories are not included unless `follow_dir_links` is set.
+    """
+    if real_fs_cache.enabled:
+        entries = real_fs_cache.directory_entries(source_path)
+    else:
+        entries = _read_real_directory(source_path)
+    return [(name, S_ISDIR(real_stat.st_mode), real_stat)
+            for name, is_dir_link, real_stat in entries
+            if follow_dir_links or not is_dir_link]
+
+
+def _real_stat(path):
+    """Return the stat result of the real file at `path`,
+    using the real file system cache if enabled."""
+    if real_fs_cache.enabled:
+        return real_fs_cache.stat(path)
+    return os.stat(path)
+
+
+def _real_file_object(source_path, filesystem, read_only, real_stat):
+    """Return a new FakeFileFromRealFile for the real file at
+    `source_path` with the given stat result."""
+    file_object = FakeFileFromRealFile(source_path, filesystem)
+    file_object.stat_result.set_from_stat_result(real_stat)
+    if read_only:
+        # remove the write/executable permission bits
+        file_object.st_mode &= 0o777444
+    file_object.file_path = source_path
+    return file_object
+
+
+class RealFileSystemCache(object):
+    """Process-wide read-only cache of the real file system data used by
+    `add_real_file()`, `add_real_directory()` and `add_real_paths()`.
+
+    If enabled, real directory listings, stat results and file contents
+    are read only once per process and are shared by all fake file
+    systems. Each fake file system still creates its own fake objects on
+    top of the cached data, so changes made in one fake file system
+    (including writes to files added from the real file system) are not
+    seen by the others.
+
+    The cache assumes that the real files do not change while it is
+    enabled - call `clear()` if they do. Enable it in the module-wide
+    instance `real_fs_cache`, for example in `conftest.py`:
+
+    .. code:: python
+
+        from pyfakefs import fake_filesystem
+
+        fake_filesystem.real_fs_cache.enabled = True
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._entries = {}
+        self._stats = {}
+        self._contents = {}
+
+    def clear(self):
+        """Remove all cached data."""
+        self._entries = {}
+        self._stats = {}
+        self._contents = {}
+
+    @staticmethod
+    def _key(path):
+        return path if os.path.isabs(path) else os.path.abspath(path)
+
+    def directory_entries(self, source_path):
+        """Return the cached entries of the real directory at
+        `source_path`, in the format of `_read_real_directory()`."""
+        key = self._key(source_path)
+        entries = self._entries.get(key)
+        if entries is None:
+            entries = _read_real_directory(source_path)
+            self._entries[key] = entries
+        return entries
+
+    def stat(self, path):
+        """Return the cached stat result of the real file at `path`.
+
+        Raises:
+            OSError: if the real file cannot be accessed. Only the errors
+                for non-existing files are cached.
+        """
+        key = self._key(path)
+        if key not in self._stats:
+            try:
+                self._stats[key] = os.stat(path)
+            except OSError as exc:
+                if exc.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise
+                # cache the error number of the missing file
+                self._stats[key] = exc.errno
+        real_stat = self._stats[key]
+        if is_int_type(real_stat):
+            raise OSError(real_stat, os.strerror(real_stat), path)
+        return real_stat
+
+    def contents(self, path):
+        """Return the cached contents of the real file at `path`."""
+        key = self._key(path)
+        contents = self._contents.get(key)
+        if contents is None:
+            with io.open(path, 'rb') as f:
+                contents = f.read()
+            self._contents[key] = contents
+        return contents
+
+
+real_fs_cache = RealFileSystemCache()
+
+
+class _PagedOutContents(object):
+    """Holds the data of file contents that are paged out by a
+    `ContentPager`."""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class ContentPager(object):
+    """Base class for moving the contents of unused fake files out of memory.
+    Keeps track of the recently used file contents, and pages out the least
+    recently used contents if a limit is exceeded.
+    Derived classes implement `_over_limit()`, `_page_out()`
+    and `_page_in()`.
+    """
+
+    def __init__(self, filesystem, min_size=0):
+        """
+        Args:
+            filesystem: The fake filesystem the pager is used for.
+            min_size: The minimum size in bytes of paged out contents.
+        """
+        self.filesystem = filesystem
+        self.min_size = min_size
+        # recently used files and their content sizes,
+        # least recently used first
+        self._in_memory = OrderedDict()
+        self.memory_size = 0
+
+    def contents(self, file_object):
+        """Return the contents of `file_object`, moving them back into
+        memory if they are paged out, and mark them as used."""
+        contents = file_object._byte_contents
+        stats = self.filesystem._stats
+        if contents.__class__ is _PagedOutContents:
+            if stats is not None:
+                stats.cache_misses += 1
+            return self.page_in(file_object)
+        if isinstance(contents, bytes):
+            if stats is not None:
+                stats.cache_hits += 1
+            self.used(file_object)
+        return contents
+
+    def used(self, file_object):
+        """Mark the contents of `file_object` as used, and page out the
+        contents of the least recently used other files if needed."""
+        contents = file_object._byte_contents
+        if contents.__class__ is _PagedOutContents:
+            # paged out by another thread meanwhile
+            return
+        size = len(contents)
+        if size < self.min_size:
+            return
+        key = id(file_object)
+        entry = self._in_memory.pop(key, None)
+        if entry is not None:
+            self.memory_size -= entry[1]
+        self._in_memory[key] = (file_object, size)
+        self.memory_size += size
+        if self._over_limit():
+            used_file = file_object
+            for key, (file_object, size) in list(self._in_memory.items()):
+                # the used contents are about to be accessed, and the
+                # contents of open files are used again on flush
+                if (file_object is used_file or
+                        self.filesystem.has_open_file(file_object)):
+                    continue
+                # in a thread-safe file system, files changed by another
+                # thread are skipped; waiting for them could deadlock
+                lock = file_object._lock
+                if lock is not None and not lock.acquire(False):
+                    continue
+                try:
+                    self._forget(key)
+                    file_object._byte_contents = _PagedOutContents(
+                        self._page_out(file_object._byte_contents))
+                finally:
+                    if lock is not None:
+                        lock.release()
+                if not self._over_limit():
+                    break
+
+    def _forget(self, key):
+        entry = self._in_memory.pop(key, None)
+        if entry is not None:
+            self.memory_size -= entry[1]
+
+    def page_in(self, file_object):
+        """Move the contents of `file_object` back into memory
+        and return them."""
+        contents = self._page_in(file_object._byte_contents.data)
+        file_object._byte_contents = contents
+        return contents
+
+    def discard(self, file_object):
+        """Called if `file_object` is removed from the file system."""
+        self._forget(id(file_object))
+        contents = file_object._byte_contents
+        if contents.__class__ is _PagedOutContents:
+            self._discard(contents.data)
+
+    def clear(self):
+        """Forget about all files."""
+        self._in_memory = OrderedDict()
+        self.memory_size = 0
+
+    def _over_limit(self):
+        raise NotImplementedError
+
+    def _page_out(self, contents):
+        """Return the data to be stored in place of `contents`."""
+        raise NotImplementedError
+
+    def _page_in(self, data):
+        """Return the contents restored from `data`."""
+        raise NotImplementedError
+
+    def _discard(self, data):
+        """Free the resources for paged out `data`."""
+        pass
+
+
+class ContentCompressor(ContentPager):
+    """Keeps the contents of large fake files compressed in memory, as long
+    as they are not used. Only the contents of the most recently used files
+    are kept uncompressed. Used by
+    :py:meth:`FakeFilesystem.enable_compression`.
+    """
+
+    def __init__(self, filesystem, min_size, max_uncompressed, method):
+        """
+        Args:
+            filesystem: The fake filesystem the compressor is used for.
+            min_size: The minimum size in bytes of compressed contents.
+            max_uncompressed: The number of recently used files with at
+                least `min_size` bytes that are kept uncompressed.
+            method: The compression method, `'zlib'` or `'lz4'` (needs
+                the `lz4` package).
+
+        Raises:
+            ValueError: if the compression method is not available.
+        """
+        if method == 'zlib':
+            self._page_out = zlib.compress
+            self._page_in = zlib.decompress
+        elif method == 'lz4' and lz4_frame is not None:
+            self._page_out = lz4_frame.compress
+            self._page_in = lz4_frame.decompress
+        else:
+            raise ValueError(
+                'Compression method %s is not available' % method)
+        super(ContentCompressor, self).__init__(filesystem, min_size)
+        self.max_uncompressed = max_uncompressed
+
+    def _over_limit(self):
+        return len(self._in_memory) > self.max_uncompressed
+
+
+class ContentSpiller(ContentPager):
+    """Limits the memory used by fake file contents by moving the contents
+    of the least recently used files into an anonymous temporary file in
+    the real file system. Used if `FakeFilesystem` is created with a
+    `memory_budget`.
+    """
+
+    def __init__(self, filesystem, memory_budget):
+        """
+        Args:
+            filesystem: The fake filesystem the spiller is used for.
+            memory_budget: The maximum size in bytes of the file contents
+                held in memory.
+        """
+        super(ContentSpiller, self).__init__(filesystem)
+        self.memory_budget = memory_budget
+        self._spill_fd = None
+        self._spill_size = 0
+        # unused (offset, size) extents in the spill file
+        self._free_extents = []
+
+    def __del__(self):
+        if self._spill_fd is not None:
+            os.close(self._spill_fd)
+
+    def _over_limit(self):
+        return self.memory_size > self.memory_budget
+
+    def _open_spill_file(self):
+        path = os.path.join(_SPILL_DIR, 'pyfakefs-%d-%x' % (
+            os.getpid(), id(self)))
+        self._spill_fd = os.open(
+            path, os.O_RDWR | os.O_CREAT | os.O_EXCL |
+            getattr(os, 'O_BINARY', 0) | getattr(os, 'O_TEMPORARY', 0),
+            0o600)
+        if not hasattr(os, 'O_TEMPORARY'):
+            # anonymous file - removed as soon as it is closed
+            os.unlink(path)
+
+    def _page_out(self, contents):
+        if self._spill_fd is None:
+            self._open_spill_file()
+        size = len(contents)
+        offset = self._spill_size
+        for index, (free_offset, free_size) in enumerate(self._free_extents):
+            if free_size >= size:
+                offset = free_offset
+                if free_size > size:
+                    self._free_extents[index] = (free_offset + size,
+                                                 free_size - size)
+                else:
+                    del self._free_extents[index]
+                break
+        else:
+            self._spill_size += size
+        os.lseek(self._spill_fd, offset, os.SEEK_SET)
+        written = 0
+        while written < size:
+            written += os.write(self._spill_fd, contents[written:])
+        return offset, size
+
+    def _page_in(self, data):
+        offset, size = data
+        os.lseek(self._spill_fd, offset, os.SEEK_SET)
+        chunks = []
+        remaining = size
+        while remaining:
+            chunk = os.read(self._spill_fd, remaining)
+            if not chunk:
+                raise IOError(errno.EIO, 'Spilled contents are truncated')
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        self._discard(data)
+        return b''.join(chunks)
+
+    def _discard(self, data):
+        if data[1]:
+            self._free_extents.append(data)
+
+    def clear(self):
+        super(ContentSpiller, self).clear()
+        self._free_extents = []
+        self._spill_size = 0
+        if self._spill_fd is not None:
+            os.ftruncate(self._spill_fd, 0)
+
+
+def _deep_size(obj, seen):
+    """Return the memory size in bytes of `obj` and of the containers,
+    strings and attributes it refers to, except for already `seen`
+    objects."""
+    size = 0
+    objects = [obj]
+    while objects:
+        obj = objects.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            objects.extend(obj.keys())
+            objects.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set)):
+            objects.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            objects.append(obj.__dict__)
+    return size
+
+
+class MemoryReport(object):
+    """The Python memory used by the objects of a fake file system, as
+    returned by :py:meth:`FakeFilesystem.memory_report`.
+    The sizes are determined using `sys.getsizeof()`, and are therefore
+    approximations. Shared objects (e.g. contents shared via the content
+    store, or hard-linked files) are only counted once.
+
+    Attributes:
+        totals: The total memory size in bytes per category:
+            `'contents'` (file contents), `'nodes'` (file and directory
+            objects including names and directory entries), `'stat'`
+            (stat results), `'buffers'` (stream buffers of open files) and
+            `'xattr'` (extended attributes).
+        subtrees: Maps each directory path to the total memory size in
+            bytes of its subtree, including the directory itself.
+        files: Maps each file path to the memory size in bytes of the
+            file object, including its contents and open buffers.
+    """
+
+    CATEGORIES = ('contents', 'nodes', 'stat', 'buffers', 'xattr')
+
+    def __init__(self):
+        self.totals = dict.fromkeys(self.CATEGORIES, 0)
+        self.subtrees = {}
+        self.files = {}
+
+    @property
+    def total(self):
+        """The total memory size in bytes."""
+        return sum(self.totals.values())
+
+    def largest_subtrees(self, count=10):
+        """Return the `count` directory subtrees using the most memory as
+        a list of `(path, size)` tuples, largest first."""
+        return self._largest(self.subtrees, count)
+
+    def largest_files(self, count=10):
+        """Return the `count` files using the most memory as
+        a list of `(path, size)` tuples, largest first."""
+        return self._largest(self.files, count)
+
+    @staticmethod
+    def _largest(sizes, count):
+        return sorted(sizes.items(), key=lambda item: (-item[1], item[0]))[
+            :count]
+
+    def format(self, count=10):
+        """Return a printable report with the totals per category, and the
+        `count` largest subtrees and files."""
+        lines = ['total: %d bytes (%s)' % (
+            self.total, ', '.join('%s: %d' % (category, self.totals[category])
+                                  for category in self.CATEGORIES))]
+        lines.append('largest subtrees:')
+        lines.extend('%12d  %s' % (size, path)
+                     for path, size in self.largest_subtrees(count))
+        lines.append('largest files:')
+        lines.extend('%12d  %s' % (size, path)
+                     for path, size in self.largest_files(count))
+        return '\n'.join(lines)
+
+
+class DeviceProfile(object):
+    """Performance characteristics of a simulated storage device, used to
+    account simulated time for the I/O operations on a mount point
+    (see :py:meth:`FakeFilesystem.add_mount_point` and
+    :py:meth:`FakeFilesystem.set_device_profile`).
+
+    The simulated time of all operations is added to
+    `FakeFilesystem.io_time`, so that the performance of code under test
+    can be checked deterministically. Each operation costs at least the
+    latency, or the time of one operation at the IOPS limit if that is
+    longer. Reading and writing additionally cost the time needed to
+    transfer the data at the given bandwidth, and `fsync()` costs the
+    additional fsync latency.
+
+    Attributes:
+        latency: The time in seconds needed for each operation.
+        read_bandwidth: The read bandwidth in bytes per second,
+            or `None` for unlimited bandwidth.
+        write_bandwidth: The write bandwidth in bytes per second,
+            or `None` for unlimited bandwidth.
+        iops: The maximum number of operations per second, or `None`.
+        fsync_latency: The additional time in seconds needed by `fsync()`.
+        sleep: If `True`, the simulated time is also spent in
+            `time.sleep()`, so that the device is slow in real time.
+    """
+
+    def __init__(self, latency=0.0, read_bandwidth=None,
+                 write_bandwidth=None, iops=None, fsync_latency=0.0,
+                 sleep=False):
+        self.latency = latency
+        self.read_bandwidth = read_bandwidth
+        self.write_bandwidth = write_bandwidth
+        self.iops = iops
+        self.fsync_latency = fsync_latency
+        self.sleep = sleep
+
+    def cost(self, operation, size=0):
+        """Return the simulated time in seconds for an operation.
+
+        Args:
+            operation: One of `'read'`, `'write'`, `'fsync'` and
+                `'metadata'` (any other operation, like `stat()` or
+                `rename()`).
+            size: The number of bytes read or written.
+        """
+        cost = self.latency
+        if self.iops:
+            cost = max(cost, 1.0 / self.iops)
+        if operation == 'read':
+            if self.read_bandwidth:
+                cost += float(size) / self.read_bandwidth
+        elif operation == 'write':
+            if self.write_bandwidth:
+                cost += float(size) / self.write_bandwidth
+        elif operation == 'fsync':
+            cost += self.fsync_latency
+        return cost
+
+
+SPINNING_DISK_PROFILE = DeviceProfile(
+    latency=0.004, read_bandwidth=150 * 1024 * 1024,
+    write_bandwidth=120 * 1024 * 1024, iops=150, fsync_latency=0.01)
+SLOW_NFS_PROFILE = DeviceProfile(
+    latency=0.002, read_bandwidth=20 * 1024 * 1024,
+    write_bandwidth=10 * 1024 * 1024, iops=500, fsync_latency=0.05)
+SSD_PROFILE = DeviceProfile(
+    latency=0.0001, read_bandwidth=500 * 1024 * 1024,
+    write_bandwidth=400 * 1024 * 1024, iops=50000, fsync_latency=0.001)
+
+
+class _ArchiveImporter(object):
+    """Adds the members of a tar or zip archive to a fake file system.
+    Used by :py:meth:`FakeFilesystem.add_archive`.
+    """
+
+    def __init__(self, filesystem, target_path, target_dir, lazy_read):
+        self.filesystem = filesystem
+        self.target_path = target_path
+        self.lazy_read = lazy_read
+        self.directories = {target_path: target_dir}
+        self.directory_stats = []
+
+    def fake_path(self, member_name):
+        """Return the fake path for the archive member name, or `None`
+        if the member would end up outside of the target directory."""
+        components = [component for component in member_name.split('/')
+                      if component and component != '.']
+        if (not components or '..' in components or
+                member_name.startswith('/') or ':' in components[0]):
+            return None
+        return self.filesystem.joinpaths(self.target_path, *components)
+
+    def directory(self, path):
+        """Return the fake directory at path, creating it if needed."""
+        if path not in self.directories:
+            if self.filesystem.exists(path):
+                self.directories[path] = self.filesystem.confirmdir(path)
+            else:
+                self.directories[path] = self.filesystem.create_dir(path)
+        return self.directories[path]
+
+    def add_directory(self, member_name, mode, mtime):
+        path = self.fake_path(member_name)
+        if path is not None:
+            # the directory stats are set after all entries are added,
+            # as the directory may not be writable
+            self.directory_stats.append((self.directory(path), mode, mtime))
+
+    def add_file(self, member_name, mode, mtime, size, read_contents,
+                 member):
+        path = self.fake_path(member_name)
+        if path is None:
+            return
+        filesystem = self.filesystem
+        parent_path, name = filesystem.splitpath(path)
+        parent_dir = self.directory(parent_path)
+        if filesystem._directory_content(parent_dir, name)[1] is not None:
+            filesystem.raise_os_error(errno.EEXIST, path)
+        if self.lazy_read:
+            file_object = FakeFileFromArchive(
+                name, filesystem, read_contents, member, S_IFREG | mode)
+            file_object.st_size = size
+        else:
+            file_object = FakeFile(name, S_IFREG | mode,
+                                   filesystem=filesystem)
+        file_object.st_ino = filesystem._new_inode()
+        parent_dir.add_entry(file_object)
+        if not self.lazy_read:
+            try:
+                file_object._set_initial_contents(read_contents(member))
+            except IOError:
+                parent_dir.remove_entry(name)
+                raise
+        file_object.st_mtime = mtime
+
+    def add_symlink(self, member_name, link_target, mtime):
+        path = self.fake_path(member_name)
+        if path is not None:
+            self.directory(self.filesystem.splitpath(path)[0])
+            link = self.filesystem.create_symlink(path, link_target)
+            link.st_mtime = mtime
+
+    def add_hard_link(self, member_name, link_target):
+        path = self.fake_path(member_name)
+        target_path = self.fake_path(link_target)
+        if (path is not None and target_path is not None and
+                self.filesystem.exists(target_path)):
+            self.directory(self.filesystem.splitpath(path)[0])
+            self.filesystem.link(target_path, path)
+
+    def finish(self):
+        for directory, mode, mtime in reversed(self.directory_stats):
+            directory.st_mode = S_IFDIR | mode
+            directory.st_mtime = mtime
+
+    def add_zip_members(self, archive_path):
+        archive = zipfile.ZipFile(archive_path)
+        if self.lazy_read:
+            def read_contents(member):
+                with zipfile.ZipFile(archive_path) as lazy_archive:
+                    return lazy_archive.read(member)
+        else:
+            read_contents = archive.read
+        try:
+            for info in archive.infolist():
+                mode = info.external_attr >> 16
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                if info.filename.endswith('/'):
+                    self.add_directory(info.filename,
+                                       mode & PERM_ALL or PERM_DEF, mtime)
+                elif S_ISLNK(mode):
+                    self.add_symlink(info.filename,
+                                     archive.read(info).decode('utf-8'),
+                                     mtime)
+                else:
+                    self.add_file(info.filename,
+                                  mode & PERM_ALL or PERM_DEF_FILE, mtime,
+                                  info.file_size, read_contents,
+                                  info.filename)
+        finally:
+            archive.close()
+        self.finish()
+
+    def add_tar_members(self, archive_path):
+        try:
+            archive = tarfile.open(archive_path, 'r:')
+            is_compressed = False
+        except tarfile.ReadError:
+            archive = tarfile.open(archive_path, 'r:*')
+            is_compressed = True
+        if not self.lazy_read:
+            def read_contents(member):
+                return archive.extractfile(member).read()
+        elif is_compressed:
+            def read_contents(member):
+                with tarfile.open(archive_path, 'r:*') as lazy_archive:
+                    return lazy_archive.extractfile(member).read()
+        else:
+            def read_contents(member):
+                offset, size = member
+                with io.open(archive_path, 'rb') as archive_file:
+                    archive_file.seek(offset)
+                    return archive_file.read(size)
+        try:
+            for info in archive:
+                if info.isdir():
+                    self.add_directory(info.name, info.mode, info.mtime)
+                elif info.issym():
+                    self.add_symlink(info.name, info.linkname, info.mtime)
+                elif info.islnk():
+                    self.add_hard_link(info.name, info.linkname)
+                elif info.isfile():
+                    if not self.lazy_read:
+                        member = info
+                    elif is_compressed:
+                        member = info.name
+                    else:
+                        member = (info.offset_data, info.size)
+                    self.add_file(info.name, info.mode, info.mtime,
+                                  info.size, read_contents, member)
+        finally:
+            archive.close()
+        self.finish()
+
+
 class FakeFilesystem(object):
     """Provides the appearance of a real directory tree for unit testing.
 
@@ -785,14 +1857,23 @@ class FakeFilesystem(object):
         root: The root :py:class:`FakeDirectory` entry of the file system.
         cwd: The current working directory path.
         umask: The umask used for newly created files, see `os.umask`.
+        clock: The clock used for file timestamps; an object with a
+            `time()` method returning the time in seconds since the epoch,
+            like the clocks in :py:mod:`pyfakefs.helpers`.
     """
 
-    def __init__(self, path_separator=os.path.sep, total_size=None):
+    def __init__(self, path_separator=os.path.sep, total_size=None,
+                 memory_budget=None):
         """
         Args:
             path_separator:  optional substitute for os.path.sep
             total_size: if not None, the total size in bytes of the
                 root filesystem.
+            memory_budget: if not None, the maximum size in bytes of the
+                file contents held in memory. The contents of the least
+                recently used files exceeding the budget are moved to a
+                temporary file in the real file system, and read back
+                on access.
 
         Example usage to emulate real file systems:
 
@@ -818,6 +1899,29 @@ class FakeFilesystem(object):
         # file systems on non-case-sensitive systems and vice verse
         self.is_case_sensitive = not (self.is_windows_fs or self.is_macos)
 
+        # if set, identical file contents are shared (see
+        # `enable_content_store()`)
+        self.content_store = None
+        # if set, unused file contents are compressed (see
+        # `enable_compression()`) or moved to disk (see `memory_budget`)
+        self.content_pager = None
+        if memory_budget is not None:
+            self.content_pager = ContentSpiller(self, memory_budget)
+        # the clock used for file timestamps
+        self.clock = RealClock()
+        # if set, operation statistics are collected (see `enable_stats()`)
+        self._stats = None
+        # device profiles by device number (see `set_device_profile()`)
+        self._device_profiles = {}
+        # the simulated time in seconds spent in I/O operations on
+        # devices with a profile
+        self.io_time = 0.0
+        # if set, the file system can be used by several threads
+        # (see `enable_thread_safety()`)
+        self._thread_safe = False
+        self._counter_lock = None
+        self._device_locks = {}
+
         self.root = FakeDirectory(self.path_separator, filesystem=self)
         self.cwd = self.root.name
 
@@ -825,15 +1929,16 @@ class FakeFilesystem(object):
         self.umask = os.umask(0o22)
         os.umask(self.umask)
 
-        # A list of open file objects. Their position in the list is their
-        # file descriptor number
-        self.open_files = []
-        # A heap containing all free positions in self.open_files list
-        self._free_fd_heap = []
+        # the open file objects by file descriptor
+        self.open_files = FileDescriptorTable()
         # last used numbers for inodes (st_ino) and devices (st_dev)
         self._last_ino = 0
         self._last_dev = 0
         self.mount_points = {}
+        # the mount points by device, and in a tree of path components
+        # (see `_mount_point_for_path()`)
+        self._mounts_by_device = {}
+        self._mount_tree = {}
         self.add_mount_point(self.root.name, total_size)
         self._add_standard_streams()
         self.dev_null = FakeNullFile(self)
@@ -847,13 +1952,314 @@ class FakeFilesystem(object):
         self.root = FakeDirectory(self.path_separator, filesystem=self)
         self.cwd = self.root.name
 
-        self.open_files = []
-        self._free_fd_heap = []
+        self.open_files = FileDescriptorTable()
         self._last_ino = 0
         self._last_dev = 0
         self.mount_points = {}
+        self._mounts_by_device = {}
+        self._mount_tree = {}
+        self._device_profiles = {}
+        self.io_time = 0.0
+        self._device_locks = {}
         self.add_mount_point(self.root.name, total_size)
         self._add_standard_streams()
+        if self.content_store:
+            self.content_store.clear()
+        if self.content_pager:
+            self.content_pager.clear()
+        if self._thread_safe:
+            self._synchronize_tables()
+
+    def enable_content_store(self):
+        """Share the contents of files with identical contents.
+
+        Identical file contents are stored only once, which reduces the
+        memory usage for many files with the same contents. Changing a file
+        does not affect other files with the same contents.
+        The contents of existing files are added to the store.
+
+        Returns:
+            The used :py:class:`pyfakefs.helpers.ContentStore` object.
+            Its `stats()` method returns the deduplication statistics.
+        """
+        if self.content_store is None:
+            self.content_store = ContentStore()
+            if self._thread_safe:
+                self._synchronize_tables()
+            for file_object in self._file_objects():
+                file_object._byte_contents = file_object._byte_contents
+        return self.content_store
+
+    def enable_compression(self, min_size=64 * 1024, max_uncompressed=16,
+                           method='zlib'):
+        """Keep the contents of large files compressed while they are
+        not used. The contents are decompressed on access, and compressed
+        again if other files have been used since.
+        The contents of existing files are compressed as needed.
+
+        Args:
+            min_size: The minimum size in bytes of files that are
+                compressed.
+            max_uncompressed: The number of most recently used files
+                (with at least `min_size` bytes) that are kept uncompressed.
+                The contents of the last used file are only compressed
+                after another file has been used, even if this is 0.
+            method: The compression method, either `'zlib'` (the default),
+                or `'lz4'` (if the `lz4` package is installed).
+
+        Returns:
+            The used :py:class:`ContentCompressor` object.
+
+        Raises:
+            ValueError: if the compression method is not available.
+        """
+        compressor = ContentCompressor(self, min_size, max_uncompressed,
+                                       method)
+        file_objects = list(self._file_objects())
+        if self.content_pager:
+            # move all contents back into memory before switching
+            for file_object in file_objects:
+                file_object.byte_contents
+        self.content_pager = compressor
+        if self._thread_safe:
+            self._synchronize_tables()
+        for file_object in file_objects:
+            if isinstance(file_object._byte_contents, bytes):
+                compressor.used(file_object)
+        return compressor
+
+    def enable_thread_safety(self):
+        """Allow the fake file system to be used by several threads at
+        the same time, as needed for testing multi-threaded code.
+
+        Each file and directory gets its own lock, as do the devices
+        (for the disk usage), the table of open file descriptors, the
+        content store and pager, and the inode and device counters.
+        Operations on different files or directories do not block each
+        other, and `rename()` is atomic. Thread safety cannot be
+        disabled once enabled; without it, no locks are used.
+
+        Note that a single open file object is not made thread-safe - as
+        in the real file system, threads sharing a file object have to
+        synchronize the access themselves.
+        """
+        if self._thread_safe:
+            return
+        self._thread_safe = True
+        self._counter_lock = threading.Lock()
+        for mount_point in self.mount_points.values():
+            self._device_locks[mount_point['idev']] = threading.Lock()
+        for file_object in self._all_objects():
+            file_object._lock = threading.RLock()
+        self._synchronize_tables()
+
+    # the methods of the shared tables guarded by a lock
+    # in a thread-safe file system
+    _FD_TABLE_METHODS = ('add', 'add_to_descriptor', 'get', 'close',
+                         'remove', 'dup', 'get_flags', 'set_flags',
+                         'open_files', 'is_shared')
+    _CONTENT_STORE_METHODS = ('intern', 'release', 'clear', 'stats')
+    _CONTENT_PAGER_METHODS = ('contents', 'used', 'page_in', 'discard',
+                              'clear')
+
+    def _synchronize_tables(self):
+        """Guard the shared tables of the file system by locks."""
+        synchronize(self.open_files, self._FD_TABLE_METHODS,
+                    threading.RLock())
+        if self.content_store is not None:
+            synchronize(self.content_store, self._CONTENT_STORE_METHODS,
+                        threading.RLock())
+        if self.content_pager is not None:
+            synchronize(self.content_pager, self._CONTENT_PAGER_METHODS,
+                        threading.RLock())
+
+    def _new_inode(self):
+        """Return a new unique inode number."""
+        lock = self._counter_lock
+        if lock is None:
+            self._last_ino += 1
+            return self._last_ino
+        with lock:
+            self._last_ino += 1
+            return self._last_ino
+
+    # the file system methods counted and timed as operations
+    # if statistics are enabled
+    _STATS_METHODS = ('stat', 'listdir', 'rename', 'resolve')
+
+    def enable_stats(self):
+        """Start collecting statistics about the fake file system
+        operations: the number of calls and cumulative wall time of `stat`,
+        `open`, `read`, `write`, `listdir`, `scandir`, `rename` and
+        `resolve`, the number of tree walk steps and followed symlinks
+        while resolving paths, and the hits and misses of the content
+        pager. Collecting the statistics slows down the operations
+        a little; nothing is collected by default.
+
+        Returns:
+            The :py:class:`pyfakefs.helpers.OperationStats` object
+            collecting the statistics. If statistics are already enabled,
+            the existing object is returned.
+        """
+        if self._stats is None:
+            self._set_stats(OperationStats())
+        return self._stats
+
+    def disable_stats(self):
+        """Stop collecting statistics.
+
+        Returns:
+            The :py:class:`pyfakefs.helpers.OperationStats` object with the
+            collected statistics, or `None` if statistics were not enabled.
+        """
+        stats = self._stats
+        self._set_stats(None)
+        return stats
+
+    def _set_stats(self, stats):
+        """Replace the object collecting the statistics. The timed
+        methods are installed as instance attributes, so that they do not
+        cost anything while statistics are disabled."""
+        if self._stats is not None:
+            for name in self._STATS_METHODS:
+                delattr(self, name)
+        self._stats = stats
+        if stats is not None:
+            for name in self._STATS_METHODS:
+                setattr(self, name, stats.timed(name, getattr(self, name)))
+
+    def stats(self):
+        """Return the statistics collected since `enable_stats()` as a dict
+        (see :py:meth:`pyfakefs.helpers.OperationStats.as_dict`), or `None`
+        if statistics are not enabled."""
+        if self._stats is None:
+            return None
+        return self._stats.as_dict()
+
+    @contextlib.contextmanager
+    def collect_stats(self):
+        """Context manager collecting statistics for the operations
+        inside the context. Yields a new
+        :py:class:`pyfakefs.helpers.OperationStats` object, which keeps the
+        collected statistics after the context is left.
+
+        Example usage:
+
+        >>> with filesystem.collect_stats() as stats:
+        ...     do_something()
+        >>> print(stats.report())
+        """
+        previous = self._stats
+        stats = OperationStats()
+        self._set_stats(stats)
+        try:
+            yield stats
+        finally:
+            self._set_stats(previous)
+
+    def memory_report(self, path=None):
+        """Return the Python memory used by the fake file system objects,
+        broken down by category and per directory subtree.
+        Contents of lazily loaded real files and directories are only
+        counted if they have already been loaded, and contents paged out to
+        a real file (see `memory_budget`) are not counted.
+
+        Args:
+            path: The directory whose subtree is examined; the complete
+                file system if not given.
+
+        Returns:
+            A :py:class:`MemoryReport` object.
+        """
+        report = MemoryReport()
+        totals = report.totals
+        seen = set()
+        buffers = {}
+        for open_file in self.open_files.open_files():
+            stream = getattr(open_file, '_io', None)
+            file_object = getattr(open_file, 'file_object', None)
+            if stream is not None and file_object is not None:
+                size = sys.getsizeof(stream)
+                # other streams do not hold a copy of the contents
+                if isinstance(stream._bytestream, io.BytesIO):
+                    size += sys.getsizeof(stream._bytestream)
+                buffers[id(file_object)] = (
+                    buffers.get(id(file_object), 0) + size)
+        root = self.resolve(path) if path is not None else self.root
+        if not isinstance(root, FakeDirectory):
+            self.raise_os_error(errno.ENOTDIR, path)
+        root_path = (self.absnormpath(path) if path is not None
+                     else self.root.name)
+        # directories in pre-order, so that the sizes of the subtrees can
+        # be added to their parent in reverse order
+        directories = []
+        pending = [(root, root_path, None)]
+        while pending:
+            directory, dir_path, parent_path = pending.pop()
+            directories.append((dir_path, parent_path))
+            size = self._node_size(directory, seen, totals)
+            entries = directory._byte_contents
+            size += sys.getsizeof(entries)
+            totals['nodes'] += sys.getsizeof(entries)
+            for name, entry in entries.items():
+                entry_path = self.joinpaths(dir_path, name)
+                if isinstance(entry, FakeDirectory):
+                    pending.append((entry, entry_path, dir_path))
+                elif id(entry) not in seen:
+                    file_size = self._node_size(entry, seen, totals)
+                    contents_size = _deep_size(entry._byte_contents, seen)
+                    buffer_size = buffers.get(id(entry), 0)
+                    totals['contents'] += contents_size
+                    totals['buffers'] += buffer_size
+                    file_size += contents_size + buffer_size
+                    report.files[entry_path] = file_size
+                    size += file_size
+            report.subtrees[dir_path] = size
+        for dir_path, parent_path in reversed(directories):
+            if parent_path is not None:
+                report.subtrees[parent_path] += report.subtrees[dir_path]
+        return report
+
+    @staticmethod
+    def _node_size(file_object, seen, totals):
+        """Return the size of `file_object` without its contents, and add
+        it to the category `totals`."""
+        seen.add(id(file_object))
+        node_size = (sys.getsizeof(file_object) +
+                     sys.getsizeof(file_object.__dict__) +
+                     _deep_size(file_object.name, seen))
+        stat_size = _deep_size(file_object.stat_result, seen)
+        xattr_size = _deep_size(file_object.xattr, seen)
+        totals['nodes'] += node_size
+        totals['stat'] += stat_size
+        totals['xattr'] += xattr_size
+        return node_size + stat_size + xattr_size
+
+    def _all_objects(self):
+        """Yield all file and directory objects in the file system,
+        without reading lazily loaded directories."""
+        directories = [self.root]
+        while directories:
+            directory = directories.pop()
+            yield directory
+            for entry in list(directory.byte_contents.values()):
+                if isinstance(entry, FakeDirectory):
+                    directories.append(entry)
+                else:
+                    yield entry
+
+    def _file_objects(self):
+        """Yield all file objects (except directories) in the file system
+        once, without reading lazily loaded directories."""
+        found = set()
+        directories = [self.root]
+        while directories:
+            for entry in directories.pop().byte_contents.values():
+                if isinstance(entry, FakeDirectory):
+                    directories.append(entry)
+                elif id(entry) not in found:
+                    found.add(id(entry))
+                    yield entry
 
     def line_separator(self):
         return '\r\n' if self.is_windows_fs else '\n'
@@ -921,7 +2327,7 @@ class FakeFilesystem(object):
         # Python 3.2 supports links in Windows
         return not self.is_windows_fs or sys.version_info >= (3, 2)
 
-    def add_mount_point(self, path, total_size=None):
+    def add_mount_point(self, path, total_size=None, profile=None):
         """Add a new mount point for a filesystem device.
         The mount point gets a new unique device number.
 
@@ -931,6 +2337,10 @@ class FakeFilesystem(object):
             total_size: The new total size of the added filesystem device
                 in bytes. Defaults to infinite size.
 
+            profile: A :py:class:`DeviceProfile` used to simulate the
+                performance of the device, see
+                :py:meth:`set_device_profile`.
+
         Returns:
             The newly created mount point dict.
 
@@ -940,15 +2350,134 @@ class FakeFilesystem(object):
         path = self.absnormpath(path)
         if path in self.mount_points:
             self.raise_os_error(errno.EEXIST, path)
-        self._last_dev += 1
-        self.mount_points[path] = {
-            'idev': self._last_dev, 'total_size': total_size, 'used_size': 0
-        }
+        mount_point = self._new_mount_point(path, total_size)
         # special handling for root path: has been created before
         root_dir = (self.root if path == self.root.name
                     else self.create_dir(path))
-        root_dir.st_dev = self._last_dev
-        return self.mount_points[path]
+        root_dir.st_dev = mount_point['idev']
+        if profile is not None:
+            self._device_profiles[mount_point['idev']] = profile
+        return mount_point
+
+    def set_device_profile(self, path, profile):
+        """Simulate the performance of the device at the mount point
+        of `path`. The time needed by I/O operations on the device (opening,
+        reading, writing, fsync and metadata operations like `stat()`)
+        is computed using `profile` and added to `io_time`.
+
+        Args:
+            path: A path on the device; the root device if `None`.
+            profile: A :py:class:`DeviceProfile`, or `None` to remove
+                the profile of the device.
+        """
+        mount_point = (self._mount_point_for_path(path) if path is not None
+                       else self.mount_points[self.root.name])
+        if profile is None:
+            self._device_profiles.pop(mount_point['idev'], None)
+        else:
+            self._device_profiles[mount_point['idev']] = profile
+
+    def simulate_io(self, st_dev, operation, size=0):
+        """Add the simulated time of an operation on the device `st_dev`
+        to `io_time`, if the device has a profile.
+
+        Args:
+            st_dev: The device number of the used file.
+            operation: The operation type as used in
+                :py:meth:`DeviceProfile.cost`.
+            size: The number of bytes read or written.
+        """
+        profile = self._device_profiles.get(st_dev)
+        if profile is not None:
+            cost = profile.cost(operation, size)
+            if self._counter_lock is None:
+                self.io_time += cost
+            else:
+                with self._counter_lock:
+                    self.io_time += cost
+            if profile.sleep:
+                time.sleep(cost)
+
+    def _simulate_path_io(self, path, operation='metadata'):
+        """Simulate an operation on the device of `path`."""
+        mount_point = self._mount_point_for_path(path)
+        if mount_point:
+            self.simulate_io(mount_point['idev'], operation)
+
+    def _new_mount_point(self, path, total_size):
+        if self._counter_lock is None:
+            self._last_dev += 1
+            idev = self._last_dev
+        else:
+            with self._counter_lock:
+                self._last_dev += 1
+                idev = self._last_dev
+        mount_point = {
+            'idev': idev, 'total_size': total_size, 'used_size': 0
+        }
+        self._register_mount_point(path, mount_point)
+        return mount_point
+
+    def _register_mount_point(self, path, mount_point):
+        self.mount_points[path] = mount_point
+        self._mounts_by_device[mount_point['idev']] = mount_point
+        if self._thread_safe:
+            self._device_locks[mount_point['idev']] = threading.Lock()
+        # each node maps the path components to the child nodes, and
+        # `None` to the mount point at the node path
+        node = self._mount_tree
+        for component in self._path_components(path):
+            node = node.setdefault(component, {})
+        node[None] = mount_point
+
+    def _remove_mount_point(self, path):
+        mount_point = self.mount_points.pop(path)
+        del self._mounts_by_device[mount_point['idev']]
+        node = self._mount_tree
+        for component in self._path_components(path):
+            node = node[component]
+        del node[None]
+
+    def add_overlay_mount(self, source_path, target_path=None,
+                          total_size=None):
+        """Add a new mount point that overlays a directory in the real
+        file system. Unmodified entries are read from the real directory
+        on demand, one entry at a time (in a case-sensitive file system).
+        Writes, deletions and renames only change the fake file system -
+        the real directory is never changed.
+
+        Args:
+            source_path: Path to an existing directory in the real
+                file system.
+            target_path: The path of the mount point in the fake file
+                system. Defaults to `source_path`.
+            total_size: The total size of the overlay device in bytes.
+                Defaults to infinite size. Note that only the size of
+                accessed or written files is accounted for.
+
+        Returns:
+            The newly created mount point dict.
+
+        Raises:
+            OSError: if the directory does not exist in the real file system.
+            OSError: if the target path already exists.
+        """
+        source_path = make_string_path(source_path)
+        if not os.path.isdir(source_path):
+            self.raise_os_error(errno.ENOENT, source_path)
+        target_path = self.absnormpath(
+            self.make_string_path(target_path or source_path))
+        if target_path in self.mount_points:
+            self.raise_os_error(errno.EEXIST, target_path)
+        mount_point = self._new_mount_point(target_path, total_size)
+        try:
+            overlay_dir = self.add_real_directory(
+                source_path, read_only=False, target_path=target_path)
+        except (IOError, OSError):
+            self._remove_mount_point(target_path)
+            raise
+        overlay_dir.st_dev = mount_point['idev']
+        return mount_point
 
     def _auto_mount_drive_if_needed(self, path, force=False):
         if (self.is_windows_fs and
@@ -968,27 +2497,35 @@ class FakeFilesystem(object):
             else:
                 return string.decode(locale.getpreferredencoding(False))
 
-        path = self.absnormpath(self._original_path(path))
-        if path in self.mount_points:
-            return self.mount_points[path]
-        mount_path = self._matching_string(path, '')
-        drive = self.splitdrive(path)[:1]
-        for root_path in self.mount_points:
-            root_path = self._matching_string(path, root_path)
-            if drive and not root_path.startswith(drive):
-                continue
-            if path.startswith(root_path) and len(root_path) > len(mount_path):
-                mount_path = root_path
-        if mount_path:
-            return self.mount_points[to_str(mount_path)]
+        path = to_str(self.absnormpath(self._original_path(path)))
+        mount_point = self.mount_points.get(path)
+        if mount_point is not None:
+            return mount_point
+        # find the deepest mount point on the path in the mount tree
+        node = self._mount_tree
+        # the root mount point does not contain drives and UNC paths
+        if not self.splitdrive(path)[0]:
+            mount_point = node.get(None)
+        for component in self._path_components(path):
+            child = node.get(component)
+            if child is None and not self.is_case_sensitive:
+                component = component.lower()
+                for name in node:
+                    if name is not None and name.lower() == component:
+                        child = node[name]
+                        break
+            if child is None:
+                break
+            node = child
+            mount_point = node.get(None, mount_point)
+        if mount_point is not None:
+            return mount_point
         mount_point = self._auto_mount_drive_if_needed(path, force=True)
         assert mount_point
         return mount_point
 
     def _mount_point_for_device(self, idev):
-        for mount_point in self.mount_points.values():
-            if mount_point['idev'] == idev:
-                return mount_point
+        return self._mounts_by_device.get(idev)
 
     def get_disk_usage(self, path=None):
         """Return the total, used and free disk space in bytes as named tuple,
@@ -1052,11 +2589,21 @@ class FakeFilesystem(object):
         """
         mount_point = self._mount_point_for_device(st_dev)
         if mount_point:
-            total_size = mount_point['total_size']
-            if total_size is not None:
-                if total_size - mount_point['used_size'] < usage_change:
-                    self.raise_io_error(errno.ENOSPC, file_path)
-            mount_point['used_size'] += usage_change
+            lock = self._device_locks.get(st_dev)
+            if lock is None:
+                self._change_mount_point_usage(
+                    mount_point, usage_change, file_path)
+            else:
+                with lock:
+                    self._change_mount_point_usage(
+                        mount_point, usage_change, file_path)
+
+    def _change_mount_point_usage(self, mount_point, usage_change, file_path):
+        total_size = mount_point['total_size']
+        if total_size is not None:
+            if total_size - mount_point['used_size'] < usage_change:
+                self.raise_io_error(errno.ENOSPC, file_path)
+        mount_point['used_size'] += usage_change
 
     def stat(self, entry_path, follow_symlinks=True):
         """Return the os.stat-like tuple for the FakeFile object of entry_path.
@@ -1067,7 +2614,7 @@ class FakeFilesystem(object):
                 the link itself is inspected instead of the linked object.
 
         Returns:
-            The FakeStatResult object corresponding to entry_path.
+            An `os.stat_result` object corresponding to entry_path.
 
         Raises:
             OSError: if the filesystem object doesn't exist.
@@ -1078,8 +2625,9 @@ class FakeFilesystem(object):
                 entry_path, follow_symlinks, allow_fd=True)
             self.raise_for_filepath_ending_with_separator(
                 entry_path, file_object, follow_symlinks)
-
-            return file_object.stat_result.copy()
+            if self._device_profiles:
+                self.simulate_io(file_object.st_dev, 'metadata')
+            return file_object.stat_result.snapshot()
         except IOError as io_error:
             winerror = (io_error.winerror if hasattr(io_error, 'winerror')
                         else io_error.errno)
@@ -1135,7 +2683,7 @@ class FakeFilesystem(object):
         else:
             file_object.st_mode = ((file_object.st_mode & ~PERM_ALL) |
                                    (mode & PERM_ALL))
-        file_object.st_ctime = time.time()
+        file_object.st_ctime = self.clock.time()
 
     def utime(self, path, times=None, ns=None, follow_symlinks=True):
         """Change the access and modified times of a file.
@@ -1182,7 +2730,7 @@ class FakeFilesystem(object):
             file_object.st_atime_ns = ns[0]
             file_object.st_mtime_ns = ns[1]
         else:
-            current_time = time.time()
+            current_time = self.clock.time()
             file_object.st_atime = current_time
             file_object.st_mtime = current_time
 
@@ -1209,38 +2757,29 @@ class FakeFilesystem(object):
         """
         self.get_object(path).st_ino = st_ino
 
-    def _add_open_file(self, file_obj):
-        """Add file_obj to the list of open files on the filesystem.
+    def _add_open_file(self, file_obj, flags=0):
+        """Add file_obj to the open files on the filesystem.
         Used internally to manage open files.
 
-        The position in the open_files array is the file descriptor number.
-
         Args:
-            file_obj: File object to be added to open files list.
+            file_obj: File object to be added to open files.
+            flags: The flags of the new file descriptor (`FD_CLOEXEC`).
 
         Returns:
             File descriptor number for the file object.
         """
-        if self._free_fd_heap:
-            open_fd = heapq.heappop(self._free_fd_heap)
-            self.open_files[open_fd] = [file_obj]
-            return open_fd
-
-        self.open_files.append([file_obj])
-        return len(self.open_files) - 1
+        return self.open_files.add(file_obj, flags)
 
     def _close_open_file(self, file_des):
-        """Remove file object with given descriptor from the list
-        of open files.
-
-        Sets the entry in open_files to None.
+        """Close the given file descriptor. The open file objects
+        referred to by the descriptor are closed, if no other descriptor
+        refers to them.
 
         Args:
             file_des: Descriptor of file object to be removed from
-            open files list.
+            open files.
         """
-        self.open_files[file_des] = None
-        heapq.heappush(self._free_fd_heap, file_des)
+        self.open_files.close(file_des)
 
     def get_open_file(self, file_des):
         """Return an open file.
@@ -1257,10 +2796,10 @@ class FakeFilesystem(object):
         """
         if not is_int_type(file_des):
             raise TypeError('an integer is required')
-        if (file_des >= len(self.open_files) or
-                self.open_files[file_des] is None):
+        open_file = self.open_files.get(file_des)
+        if open_file is None:
             self.raise_os_error(errno.EBADF, str(file_des))
-        return self.open_files[file_des][0]
+        return open_file
 
     def has_open_file(self, file_object):
         """Return True if the given file object is in the list of open files.
@@ -1271,8 +2810,7 @@ class FakeFilesystem(object):
         Returns:
             `True` if the file is open.
         """
-        return (file_object in [wrappers[0].get_object()
-                                for wrappers in self.open_files if wrappers])
+        return self.open_files.has_object(file_object)
 
     def _normalize_path_sep(self, path):
         if self.alternative_path_separator is None or not path:
@@ -1649,8 +3187,9 @@ class FakeFilesystem(object):
     def _directory_content(self, directory, component):
         if not isinstance(directory, FakeDirectory):
             return None, None
-        if component in directory.contents:
-            return component, directory.contents[component]
+        entry = directory._entry(component)
+        if entry is not None:
+            return component, entry
         if not self.is_case_sensitive:
             matching_content = [(subdir, directory.contents[subdir]) for
                                 subdir in directory.contents
@@ -1776,10 +3315,13 @@ class FakeFilesystem(object):
         current_dir = self.root
         link_depth = 0
         resolved_components = []
+        stats = self._stats
         while path_components:
             component = path_components.pop(0)
             resolved_components.append(component)
             current_dir = self._directory_content(current_dir, component)[1]
+            if stats is not None:
+                stats.tree_steps += 1
             if current_dir is None:
                 # The component of the path at this point does not actually
                 # exist in the folder.  We can't resolve the path any more.
@@ -1801,6 +3343,8 @@ class FakeFilesystem(object):
                     error_fct(errno.ELOOP,
                               self._components_to_path(resolved_components))
                 link_path = self._follow_link(resolved_components, current_dir)
+                if stats is not None:
+                    stats.symlink_hops += 1
 
                 # Following the link might result in the complete replacement
                 # of the current_dir, so we evaluate the entire resulting path.
@@ -1897,6 +3441,8 @@ class FakeFilesystem(object):
                 target_object = target_object.get_entry(component)
         except KeyError:
             self.raise_io_error(errno.ENOENT, file_path)
+        if self._stats is not None:
+            self._stats.tree_steps += len(path_components)
         return target_object
 
     def get_object(self, file_path):
@@ -2028,6 +3574,46 @@ class FakeFilesystem(object):
             OSError: if the file would be moved to another filesystem
                 (e.g. mount point).
         """
+        if self._thread_safe:
+            # make the rename atomic by locking both parent directories
+            with self._parent_dirs_locked(old_file_path, new_file_path):
+                return self._rename(old_file_path, new_file_path,
+                                    force_replace)
+        return self._rename(old_file_path, new_file_path, force_replace)
+
+    @contextlib.contextmanager
+    def _parent_dirs_locked(self, *paths):
+        """Context manager holding the locks of the parent directories
+        of `paths`. The locks are acquired top-down, as in nested
+        directory operations, to avoid deadlocks."""
+        locked = {}
+        for path in paths:
+            parent = self.splitpath(self.absnormpath(path))[0]
+            try:
+                dir_object = self.resolve(parent)
+            except (IOError, OSError):
+                # the error is raised by the operation itself
+                continue
+            if dir_object._lock is not None:
+                depth = 0
+                ancestor = dir_object.parent_dir
+                while ancestor is not None:
+                    depth += 1
+                    ancestor = ancestor.parent_dir
+                locked[(depth, id(dir_object))] = dir_object._lock
+        acquired = []
+        try:
+            for key in sorted(locked):
+                locked[key].acquire()
+                acquired.append(locked[key])
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    def _rename(self, old_file_path, new_file_path, force_replace):
+        if self._device_profiles:
+            self._simulate_path_io(old_file_path)
         ends_with_sep = self.ends_with_path_separator(old_file_path)
         old_file_path = self.absnormpath(old_file_path)
         new_file_path = self.absnormpath(new_file_path)
@@ -2065,7 +3651,9 @@ class FakeFilesystem(object):
             self.raise_os_error(errno.EINVAL, new_file_path)
 
         object_to_rename = old_dir_object.get_entry(old_name)
-        old_dir_object.remove_entry(old_name, recursive=False)
+        # the contents stay shared or paged out while the file is moved
+        old_dir_object.remove_entry(old_name, recursive=False,
+                                    keep_contents=True)
         object_to_rename.name = new_name
         new_name = new_dir_object._normalized_entryname(new_name)
         if new_name in new_dir_object.contents:
@@ -2188,6 +3776,8 @@ class FakeFilesystem(object):
         file_path = self.absnormpath(self._original_path(file_path))
         if self._is_root_path(file_path):
             self.raise_os_error(errno.EBUSY, file_path)
+        if self._device_profiles:
+            self._simulate_path_io(file_path)
         try:
             dirname, basename = self.splitpath(file_path)
             target_directory = self.resolve(dirname)
@@ -2227,27 +3817,37 @@ class FakeFilesystem(object):
         current_dir = self.root
 
         new_dirs = []
-        for component in path_components:
+        last_index = len(path_components) - 1
+        for index, component in enumerate(path_components):
             directory = self._directory_content(current_dir, component)[1]
             if not directory:
                 new_dir = FakeDirectory(component, filesystem=self)
-                new_dirs.append(new_dir)
-                current_dir.add_entry(new_dir)
-                current_dir = new_dir
-            else:
-                if S_ISLNK(directory.st_mode):
-                    directory = self.resolve(directory.contents)
-                current_dir = directory
-                if directory.st_mode & S_IFDIR != S_IFDIR:
-                    self.raise_os_error(errno.ENOTDIR, current_dir.path)
+                try:
+                    current_dir.add_entry(new_dir)
+                except OSError as exc:
+                    # a parent directory may have been created by another
+                    # thread meanwhile - it is used in this case
+                    if (not self._thread_safe or exc.errno != errno.EEXIST
+                            or index == last_index):
+                        raise
+                    directory = self._directory_content(
+                        current_dir, component)[1]
+                else:
+                    new_dirs.append(new_dir)
+                    current_dir = new_dir
+                    continue
+            if S_ISLNK(directory.st_mode):
+                directory = self.resolve(directory.contents)
+            current_dir = directory
+            if directory.st_mode & S_IFDIR != S_IFDIR:
+                self.raise_os_error(errno.ENOTDIR, current_dir.path)
 
         # set the permission after creating the directories
         # to allow directory creation inside a read-only directory
         for new_dir in new_dirs:
             new_dir.st_mode = S_IFDIR | perm_bits
 
-        self._last_ino += 1
-        current_dir.st_ino = self._last_ino
+        current_dir.st_ino = self._new_inode()
         return current_dir
 
     def create_file(self, file_path, st_mode=S_IFREG | PERM_DEF_FILE,
@@ -2284,6 +3884,94 @@ class FakeFilesystem(object):
             file_path, st_mode, contents, st_size, create_missing_dirs,
             apply_umask, encoding, errors)
 
+    def create_files(self, files, create_missing_dirs=True,
+                     apply_umask=False):
+        """Create many files at once, including all the parent directories
+        along the way.
+
+        This is faster than calling :py:meth:`create_file` for each file,
+        as the entries are grouped by their parent directory, and each
+        parent directory is resolved only once.
+
+        Args:
+            files: A dictionary mapping file paths to file specifications, or
+                an iterable of file paths or of (path, specification) tuples.
+                A file specification may be `None` (empty file), the file
+                contents, or a dictionary with the optional keys `contents`,
+                `st_mode`, `st_size`, `st_mtime`, `encoding` and `errors`,
+                which have the same meaning as in :py:meth:`create_file`.
+            create_missing_dirs: If `True`, auto create missing directories.
+            apply_umask: `True` if the current umask must be applied
+                on `st_mode`.
+
+        Returns:
+            The list of newly created FakeFile objects in input order.
+
+        Raises:
+            IOError: if any of the files already exists.
+            IOError: if a containing directory is required and missing.
+        """
+        if isinstance(files, dict):
+            files = files.items()
+        parents = {}
+        parent_order = []
+        count = 0
+        for entry in files:
+            if isinstance(entry, tuple):
+                file_path, spec = entry
+            else:
+                file_path, spec = entry, None
+            if not isinstance(spec, dict):
+                spec = {'contents': spec}
+            file_path = self.absnormpath(self.make_string_path(file_path))
+            parent_path, name = self.splitpath(file_path)
+            if not parent_path:
+                parent_path = self.cwd
+            if parent_path not in parents:
+                parents[parent_path] = []
+                parent_order.append(parent_path)
+            parents[parent_path].append((count, file_path, name, spec))
+            count += 1
+
+        created = [None] * count
+        for parent_path in parent_order:
+            self._auto_mount_drive_if_needed(parent_path)
+            if not self.exists(parent_path):
+                if not create_missing_dirs:
+                    self.raise_io_error(errno.ENOENT, parent_path)
+                parent_dir = self.create_dir(parent_path)
+            else:
+                parent_dir = self.resolve(parent_path)
+                if not S_ISDIR(parent_dir.st_mode):
+                    error = (errno.ENOENT if self.is_windows_fs
+                             else errno.ENOTDIR)
+                    self.raise_os_error(error, parent_path)
+            for index, file_path, name, spec in parents[parent_path]:
+                if self._directory_content(parent_dir, name)[1] is not None:
+                    self.raise_os_error(errno.EEXIST, file_path)
+                st_mode = spec.get('st_mode', S_IFREG | PERM_DEF_FILE)
+                if apply_umask:
+                    st_mode &= ~self.umask
+                file_object = FakeFile(name, st_mode, filesystem=self,
+                                       encoding=spec.get('encoding'),
+                                       errors=spec.get('errors'))
+                file_object.st_ino = self._new_inode()
+                parent_dir.add_entry(file_object)
+                contents = spec.get('contents')
+                st_size = spec.get('st_size')
+                try:
+                    if st_size is not None:
+                        file_object.set_large_file_size(st_size)
+                    else:
+                        file_object._set_initial_contents(contents or '')
+                except IOError:
+                    parent_dir.remove_entry(name)
+                    raise
+                if 'st_mtime' in spec:
+                    file_object.st_mtime = spec['st_mtime']
+                created[index] = file_object
+        return created
+
     def add_real_file(self, source_path, read_only=True, target_path=None):
         """Create `file_path`, including all the parent directories along the
         way, for an existing real file. The contents of the real file are read
@@ -2312,7 +4000,7 @@ class FakeFilesystem(object):
         target_path = target_path or source_path
         source_path = make_string_path(source_path)
         target_path = self.make_string_path(target_path)
-        real_stat = os.stat(source_path)
+        real_stat = _real_stat(source_path)
         fake_file = self.create_file_internally(target_path,
                                                 read_from_real_fs=True)
 
@@ -2366,19 +4054,61 @@ class FakeFilesystem(object):
             new_dir = FakeDirectoryFromRealDirectory(
                 source_path, self, read_only, target_path)
             parent_dir.add_entry(new_dir)
-            self._last_ino += 1
-            new_dir.st_ino = self._last_ino
+            new_dir.st_ino = self._new_inode()
         else:
             new_dir = self.create_dir(target_path)
-            for base, _, files in os.walk(source_path):
-                new_base = os.path.join(new_dir.path,
-                                        os.path.relpath(base, source_path))
-                for fileEntry in files:
-                    self.add_real_file(os.path.join(base, fileEntry),
-                                       read_only,
-                                       os.path.join(new_base, fileEntry))
+            self._add_real_directory_tree(source_path, new_dir, read_only)
         return new_dir
 
+    def _add_real_directory_tree(self, source_path, target_dir, read_only):
+        """Add the contents of the real directory tree at `source_path`
+        to the fake directory `target_dir`.
+
+        The tree is read level by level; the real directories of each level
+        are scanned concurrently, and the fake objects are created directly
+        under their already existing parent directory, using the stat
+        results of the scan.
+        """
+        directories = [(source_path, target_dir)]
+        directory_stats = []
+        pool = None
+        try:
+            while directories:
+                source_paths = [source for source, _ in directories]
+                if len(directories) == 1:
+                    scans = [_scan_real_directory(source_paths[0])]
+                else:
+                    if pool is None:
+                        pool = ThreadPool(_REAL_DIR_SCAN_THREADS)
+                    scans = pool.map(_scan_real_directory, source_paths)
+                sub_directories = []
+                for (base, fake_dir), entries in zip(directories, scans):
+                    for name, is_dir, real_stat in entries:
+                        path = os.path.join(base, name)
+                        if is_dir:
+                            fake_object = FakeDirectory(name, filesystem=self)
+                            # the real permissions are set after all
+                            # entries are added, as they may be read-only
+                            directory_stats.append((fake_object, real_stat))
+                            sub_directories.append((path, fake_object))
+                        else:
+                            fake_object = _real_file_object(
+                                path, self, read_only, real_stat)
+                        fake_object.st_ino = self._new_inode()
+                        fake_dir.add_entry(fake_object)
+                directories = sub_directories
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        for fake_dir, real_stat in directory_stats:
+            fake_dir.st_mode = real_stat.st_mode
+            fake_dir.st_uid = real_stat.st_uid
+            fake_dir.st_gid = real_stat.st_gid
+            fake_dir.st_ctime = real_stat.st_ctime
+            fake_dir.st_atime = real_stat.st_atime
+            fake_dir.st_mtime = real_stat.st_mtime
+
     def add_real_paths(self, path_list, read_only=True, lazy_dir_read=True):
         """This convenience method adds multiple files and/or directories from
         the real file system to the fake file system. See `add_real_file()` and
@@ -2406,6 +4136,51 @@ class FakeFilesystem(object):
             else:
                 self.add_real_file(path, read_only)
 
+    def add_archive(self, archive_path, target_path=None, lazy_read=False):
+        """Add the contents of a tar or zip archive in the real file system
+        to the fake file system, without writing them via fake file objects.
+
+        File modes, modification times, symlinks and hard links (tar only)
+        are preserved. Members with absolute paths or paths pointing
+        outside of `target_path` are ignored, as are special files
+        like devices.
+
+        Args:
+            archive_path: Path to an existing tar (optionally compressed)
+                or zip archive in the real file system.
+            target_path: The fake directory where the archive contents are
+                added. Defaults to the current working directory.
+            lazy_read: If set, the member contents are only read from the
+                archive when accessed. Note that this is most efficient for
+                uncompressed tar and for zip archives.
+
+        Returns:
+            The FakeDirectory object for `target_path`.
+
+        Raises:
+            OSError: if the archive does not exist in the real file system.
+            ValueError: if the archive is neither a tar nor a zip archive.
+            OSError: if an archive member already exists in the
+                fake file system.
+        """
+        archive_path = make_string_path(archive_path)
+        if not os.path.exists(archive_path):
+            self.raise_os_error(errno.ENOENT, archive_path)
+        target_path = self.absnormpath(
+            self.make_string_path(target_path or self.cwd))
+        if self.exists(target_path):
+            target_dir = self.confirmdir(target_path)
+        else:
+            target_dir = self.create_dir(target_path)
+        importer = _ArchiveImporter(self, target_path, target_dir, lazy_read)
+        if zipfile.is_zipfile(archive_path):
+            importer.add_zip_members(archive_path)
+        elif tarfile.is_tarfile(archive_path):
+            importer.add_tar_members(archive_path)
+        else:
+            raise ValueError('Unsupported archive format: %s' % archive_path)
+        return target_dir
+
     def create_file_internally(self, file_path,
                                st_mode=S_IFREG | PERM_DEF_FILE,
                                contents='', st_size=None,
@@ -2460,22 +4235,30 @@ class FakeFilesystem(object):
             file_object = FakeFile(new_file, st_mode, filesystem=self,
                                    encoding=encoding, errors=errors)
 
-        self._last_ino += 1
-        file_object.st_ino = self._last_ino
-        self.add_object(parent_directory, file_object, error_fct)
+        file_object.st_ino = self._new_inode()
+        lock = file_object._lock
+        if lock is not None:
+            # other threads shall not change the file
+            # before the contents are set
+            lock.acquire()
+        try:
+            self.add_object(parent_directory, file_object, error_fct)
 
-        if st_size is None and contents is None:
-            contents = ''
-        if (not read_from_real_fs and
-                (contents is not None or st_size is not None)):
-            try:
-                if st_size is not None:
-                    file_object.set_large_file_size(st_size)
-                else:
-                    file_object._set_initial_contents(contents)
-            except IOError:
-                self.remove_object(file_path)
-                raise
+            if st_size is None and contents is None:
+                contents = ''
+            if (not read_from_real_fs and
+                    (contents is not None or st_size is not None)):
+                try:
+                    if st_size is not None:
+                        file_object.set_large_file_size(st_size)
+                    else:
+                        file_object._set_initial_contents(contents)
+                except IOError:
+                    self.remove_object(file_path)
+                    raise
+        finally:
+            if lock is not None:
+                lock.release()
 
         return file_object
 
@@ -2680,6 +4463,8 @@ class FakeFilesystem(object):
             else:
                 self.raise_os_error(error_nr, dir_name)
         head, tail = self.splitpath(dir_name)
+        if self._device_profiles:
+            self._simulate_path_io(head)
 
         self.add_object(
             head, FakeDirectory(tail, mode & ~self.umask, filesystem=self))
@@ -2924,9 +4709,218 @@ class FakeFilesystem(object):
         """
         target_directory = self.resolve_path(target_directory, allow_fd=True)
         directory = self.confirmdir(target_directory)
+        if self._device_profiles:
+            self.simulate_io(directory.st_dev, 'metadata')
         directory_contents = directory.contents
         return list(directory_contents.keys())
 
+    def save_image(self, image_path):
+        """Save the complete fake file system into an image file in the
+        real file system.
+
+        The image contains all directories, files, symlinks and hard links
+        together with their stat values and extended attributes, and the
+        mount points with their disk usage. It can be loaded into
+        another fake file system using :py:meth:`load_image`, which is
+        usually much faster than re-creating the file system from scratch.
+
+        Args:
+            image_path: The path of the image file in the real file system.
+                An existing file is overwritten.
+
+        .. note:: Contents of lazily added real files and directories
+            (see :py:meth:`add_real_directory`) are read from the real
+            file system and stored in the image.
+        """
+        nodes = []
+        contents = []
+        content_size = [0]
+        node_indexes = {}
+
+        def add_contents(data):
+            offset = content_size[0]
+            contents.append(data)
+            content_size[0] += len(data)
+            return [offset, len(data)]
+
+        def add_node(parent_index, name, file_object):
+            if id(file_object) in node_indexes:
+                # hard link to an already saved file
+                nodes.append([parent_index, name, 'h',
+                              node_indexes[id(file_object)]])
+                return
+            node_indexes[id(file_object)] = len(nodes)
+            stat_result = file_object.stat_result
+            mode = file_object.st_mode
+            if S_ISDIR(mode):
+                kind, data = 'd', None
+            elif S_ISLNK(mode):
+                kind, data = 'l', self._to_string(file_object.contents)
+            elif file_object.is_large_file():
+                # sparse files only store their data extents
+                kind = 'f'
+                data = {'extents': [
+                    [offset] + add_contents(extent) for offset, extent
+                    in file_object._byte_contents.extents()]}
+            else:
+                byte_contents = file_object.byte_contents
+                kind = 'f'
+                data = (None if byte_contents is None
+                        else add_contents(byte_contents))
+            xattr = dict((name, base64.b64encode(value).decode('ascii'))
+                         for name, value in file_object.xattr.items())
+            index = len(nodes)
+            nodes.append([parent_index, name, kind,
+                          mode, file_object.st_ino, file_object.st_dev,
+                          stat_result.st_uid,
+                          stat_result.st_gid, stat_result._st_size,
+                          stat_result._st_atime_ns, stat_result._st_mtime_ns,
+                          stat_result._st_ctime_ns, file_object.encoding,
+                          xattr, data])
+            if kind == 'd':
+                for entry_name in sorted(file_object.contents):
+                    add_node(index, entry_name,
+                             file_object.contents[entry_name])
+
+        add_node(-1, self.root.name, self.root)
+        mount_points = [[path, mount_point['idev'],
+                         mount_point['total_size'], mount_point['used_size']]
+                        for path, mount_point in self.mount_points.items()]
+        metadata = {
+            'path_separator': self.path_separator,
+            'alternative_path_separator': self.alternative_path_separator,
+            'is_windows_fs': self.is_windows_fs,
+            'is_macos': self.is_macos,
+            'is_case_sensitive': self.is_case_sensitive,
+            'cwd': self._to_string(self.cwd),
+            'last_ino': self._last_ino,
+            'last_dev': self._last_dev,
+            'mount_points': mount_points,
+            'nodes': nodes,
+        }
+        metadata = zlib.compress(json.dumps(
+            metadata, separators=(',', ':')).encode('utf-8'))
+        content_offset = _IMAGE_HEADER.size + len(metadata)
+        with io.open(image_path, 'wb') as image_file:
+            image_file.write(_IMAGE_HEADER.pack(
+                _IMAGE_MAGIC, _IMAGE_VERSION, len(metadata),
+                content_offset, content_size[0]))
+            image_file.write(metadata)
+            for data in contents:
+                image_file.write(data)
+
+    def load_image(self, image_path, lazy_read=True):
+        """Replace the contents of the fake file system by the contents
+        of an image file created by :py:meth:`save_image`.
+
+        Args:
+            image_path: The path of the image file in the real file system.
+            lazy_read: If set (default), the image file is memory-mapped,
+                and the contents of each file are only read when accessed.
+                Otherwise, all contents are read at once.
+
+        Raises:
+            OSError: if the image file does not exist.
+            ValueError: if the file is not a valid file system image.
+        """
+        with io.open(image_path, 'rb') as image_file:
+            header = image_file.read(_IMAGE_HEADER.size)
+            if len(header) != _IMAGE_HEADER.size:
+                raise ValueError('Invalid file system image: %s' % image_path)
+            (magic, version, metadata_size,
+             content_offset, content_size) = _IMAGE_HEADER.unpack(header)
+            if magic != _IMAGE_MAGIC or not 0 < version <= _IMAGE_VERSION:
+                raise ValueError('Invalid file system image: %s' % image_path)
+            metadata = json.loads(
+                zlib.decompress(image_file.read(metadata_size)).decode(
+                    'utf-8'))
+            if lazy_read and content_size:
+                image = mmap.mmap(image_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            else:
+                image_file.seek(content_offset)
+                image = image_file.read(content_size)
+                content_offset = 0
+
+        self.path_separator = metadata['path_separator']
+        self.alternative_path_separator = (
+            metadata['alternative_path_separator'])
+        self.is_windows_fs = metadata['is_windows_fs']
+        self.is_macos = metadata['is_macos']
+        self.is_case_sensitive = metadata['is_case_sensitive']
+        self.reset()
+
+        objects = []
+        for node in metadata['nodes']:
+            parent_index, name, kind = node[:3]
+            if kind == 'h':
+                file_object = objects[node[3]]
+            else:
+                (mode, ino, dev, uid, gid, size, atime_ns, mtime_ns,
+                 ctime_ns, encoding, xattr, data) = node[3:]
+                if parent_index < 0:
+                    file_object = self.root
+                elif kind == 'd':
+                    file_object = FakeDirectory(name, filesystem=self)
+                elif kind == 'l':
+                    file_object = FakeFile(name, contents=data,
+                                           filesystem=self)
+                elif isinstance(data, list) and lazy_read:
+                    file_object = FakeFileFromImage(
+                        name, self, image, content_offset + data[0], data[1])
+                else:
+                    file_object = FakeFile(name, filesystem=self)
+                    if isinstance(data, list):
+                        offset = content_offset + data[0]
+                        file_object._byte_contents = image[
+                            offset:offset + data[1]]
+                    else:
+                        # sparse file - large files in version 1 images
+                        # have no extents
+                        sparse_contents = SparseContents(size=size)
+                        for file_offset, offset, length in (
+                                data or {}).get('extents', []):
+                            offset += content_offset
+                            sparse_contents.write(
+                                file_offset, image[offset:offset + length])
+                        sparse_contents.truncate(size)
+                        file_object._byte_contents = sparse_contents
+                stat_result = file_object.stat_result
+                stat_result.st_mode = mode
+                stat_result.st_ino = ino
+                stat_result.st_uid = uid
+                stat_result.st_gid = gid
+                stat_result._st_size = size
+                stat_result._st_atime_ns = atime_ns
+                stat_result._st_mtime_ns = mtime_ns
+                stat_result._st_ctime_ns = ctime_ns
+                file_object.encoding = encoding
+                file_object.xattr = dict(
+                    (attr_name, base64.b64decode(value.encode('ascii')))
+                    for attr_name, value in xattr.items())
+            objects.append(file_object)
+            if parent_index >= 0:
+                parent_dir = objects[parent_index]
+                file_object.name = name
+                parent_dir.contents[name] = file_object
+                file_object.parent_dir = parent_dir
+                parent_dir.st_nlink += 1
+                file_object.st_nlink += 1
+            if kind != 'h':
+                file_object.st_dev = dev
+
+        self.mount_points = {}
+        self._mounts_by_device = {}
+        self._mount_tree = {}
+        for path, idev, total_size, used_size in metadata['mount_points']:
+            self._register_mount_point(path, {
+                'idev': idev, 'total_size': total_size,
+                'used_size': used_size
+            })
+        self._last_ino = metadata['last_ino']
+        self._last_dev = metadata['last_dev']
+        self.cwd = metadata['cwd']
+
     def __str__(self):
         return str(self.root)
 
@@ -3515,6 +5509,9 @@ class FakeOsModule(object):
         if open_modes.must_not_exist and open_modes.must_exist:
             raise NotImplementedError(
                 'O_EXCL without O_CREAT mode is not supported')
+        # since Python 3.4, new descriptors are non-inheritable
+        fd_flags = (FD_CLOEXEC if sys.version_info >= (3, 4) or
+                    flags & getattr(os, 'O_CLOEXEC', 0) else 0)
 
         if (not self.filesystem.is_windows_fs and
                 self.filesystem.exists(file_path)):
@@ -3527,7 +5524,8 @@ class FakeOsModule(object):
                         or open_modes.can_write):
                     self.filesystem.raise_os_error(errno.EISDIR, file_path)
                 dir_wrapper = FakeDirWrapper(obj, file_path, self.filesystem)
-                file_des = self.filesystem._add_open_file(dir_wrapper)
+                file_des = self.filesystem._add_open_file(
+                    dir_wrapper, fd_flags)
                 dir_wrapper.filedes = file_des
                 return file_des
 
@@ -3541,6 +5539,7 @@ class FakeOsModule(object):
             file_path, str_flags, open_modes=open_modes)
         if fake_file.file_object != self.filesystem.dev_null:
             self.chmod(file_path, mode)
+        self.filesystem.open_files.set_flags(fake_file.fileno(), fd_flags)
         return fake_file.fileno()
 
     def close(self, file_des):
@@ -3554,7 +5553,89 @@ class FakeOsModule(object):
             TypeError: if file descriptor is not an integer.
         """
         file_handle = self.filesystem.get_open_file(file_des)
-        file_handle.close()
+        if self.filesystem.open_files.is_shared(file_des):
+            # the open file is still used by another descriptor
+            self.filesystem._close_open_file(file_des)
+        elif isinstance(file_handle, FakeFileWrapper):
+            # also closes a file object already closed via `close()`
+            # while the descriptor has been duplicated
+            file_handle._close(file_des)
+        else:
+            file_handle.close()
+
+    def dup(self, file_des):
+        """Duplicate a file descriptor.
+
+        Args:
+            file_des: An integer file descriptor.
+
+        Returns:
+            The lowest free file descriptor, referring to the same open
+            file as `file_des`. Under Python 3.4 and above, the new
+            descriptor is non-inheritable.
+
+        Raises:
+            OSError: bad file descriptor.
+            TypeError: if file descriptor is not an integer.
+        """
+        self.filesystem.get_open_file(file_des)
+        flags = FD_CLOEXEC if sys.version_info >= (3, 4) else 0
+        return self.filesystem.open_files.dup(file_des, flags=flags)
+
+    def dup2(self, file_des, file_des2, inheritable=True):
+        """Duplicate a file descriptor to a given descriptor number.
+        If `file_des2` is open, it is closed first.
+
+        Args:
+            file_des: An integer file descriptor.
+            file_des2: The new file descriptor.
+            inheritable: If `False`, the new descriptor is
+                non-inheritable. New in Python 3.4.
+
+        Returns:
+            `file_des2` under Python 3.7 and above, `None` otherwise.
+
+        Raises:
+            OSError: bad file descriptor.
+            TypeError: if a file descriptor is not an integer.
+        """
+        self.filesystem.get_open_file(file_des)
+        if not is_int_type(file_des2):
+            raise TypeError('an integer is required')
+        if file_des2 < 0:
+            self.filesystem.raise_os_error(errno.EBADF, str(file_des2))
+        if file_des2 != file_des:
+            if file_des2 in self.filesystem.open_files:
+                self.close(file_des2)
+            self.filesystem.open_files.dup(
+                file_des, file_des2, 0 if inheritable else FD_CLOEXEC)
+        if sys.version_info >= (3, 7):
+            return file_des2
+
+    if sys.version_info >= (3, 4):
+        def get_inheritable(self, file_des):
+            """Return `True` if the file descriptor is inheritable.
+
+            Raises:
+                OSError: bad file descriptor.
+            """
+            self.filesystem.get_open_file(file_des)
+            return not (self.filesystem.open_files.get_flags(file_des) &
+                        FD_CLOEXEC)
+
+        def set_inheritable(self, file_des, inheritable):
+            """Set the inheritable flag of the file descriptor.
+
+            Raises:
+                OSError: bad file descriptor.
+            """
+            self.filesystem.get_open_file(file_des)
+            open_files = self.filesystem.open_files
+            flags = open_files.get_flags(file_des)
+            if inheritable:
+                open_files.set_flags(file_des, flags & ~FD_CLOEXEC)
+            else:
+                open_files.set_flags(file_des, flags | FD_CLOEXEC)
 
     def read(self, file_des, num_bytes):
         """Read number of bytes from a file descriptor, returns bytes read.
@@ -3598,6 +5679,240 @@ class FakeOsModule(object):
         file_handle.flush()
         return len(contents)
 
+    def lseek(self, file_des, pos, how):
+        """Set the position of a file descriptor, returns the new position.
+
+        Args:
+            file_des: An integer file descriptor for the file object requested.
+            pos: The position relative to `how`.
+            how: One of `SEEK_SET`, `SEEK_CUR` and `SEEK_END`, or
+                `SEEK_DATA` and `SEEK_HOLE`.
+
+        Returns:
+            The new position from the start of the file.
+
+        Raises:
+            OSError: bad file descriptor, or invalid position.
+            TypeError: if file descriptor is not an integer.
+        """
+        file_handle = self.filesystem.get_open_file(file_des)
+        file_handle.raw_io = True
+        try:
+            file_handle.seek(pos, how)
+        except ValueError:
+            self.filesystem.raise_os_error(errno.EINVAL, file_handle.file_path)
+        return file_handle.tell()
+
+    def _positional_file(self, file_des, writing=False):
+        """Return the file object open as `file_des` for positional
+        reading or writing, with all writes to the descriptor flushed.
+
+        Raises:
+            OSError: bad file descriptor, or the file is not open
+                for reading or writing, respectively.
+        """
+        file_handle = self.filesystem.get_open_file(file_des)
+        if isinstance(file_handle, FakeDirWrapper):
+            self.filesystem.raise_os_error(errno.EISDIR,
+                                           file_handle.file_path)
+        if (not file_handle.allow_update if writing
+                else not file_handle._read):
+            self.filesystem.raise_os_error(errno.EBADF, file_handle.file_path)
+        if file_handle._modified:
+            file_handle.flush()
+        return file_handle.file_object
+
+    def _check_posix_only(self, name):
+        if self.filesystem.is_windows_fs:
+            raise AttributeError("module 'os' has no attribute '%s'" % name)
+
+    if sys.version_info >= (3, 3):
+        def pread(self, file_des, num_bytes, offset):
+            """Read `num_bytes` bytes at `offset` from a file descriptor,
+            without changing the file position. New in Python 3.3.
+
+            Args:
+                file_des: An integer file descriptor for the file object
+                    requested.
+                num_bytes: Number of bytes to read from file.
+                offset: The position to read from.
+
+            Returns:
+                Bytes read from file.
+
+            Raises:
+                OSError: bad file descriptor.
+                TypeError: if file descriptor is not an integer.
+            """
+            self._check_posix_only('pread')
+            file_object = self._positional_file(file_des)
+            contents = file_object.read_at(offset, num_bytes)
+            if self.filesystem._device_profiles:
+                self.filesystem.simulate_io(
+                    file_object.st_dev, 'read', len(contents))
+            return contents
+
+        def pwrite(self, file_des, contents, offset):
+            """Write `contents` at `offset` to a file descriptor, without
+            changing the file position. New in Python 3.3.
+
+            Args:
+                file_des: An integer file descriptor for the file object
+                    requested.
+                contents: Bytes to write to file.
+                offset: The position to write to.
+
+            Returns:
+                Number of bytes written.
+
+            Raises:
+                OSError: bad file descriptor.
+                TypeError: if file descriptor is not an integer.
+            """
+            self._check_posix_only('pwrite')
+            file_object = self._positional_file(file_des, writing=True)
+            file_object.write_at(offset, bytes(contents))
+            if self.filesystem._device_profiles:
+                self.filesystem.simulate_io(
+                    file_object.st_dev, 'write', len(contents))
+            return len(contents)
+
+        def readv(self, file_des, buffers):
+            """Read from a file descriptor into a sequence of mutable
+            buffers, filling each buffer before the next one.
+            New in Python 3.3.
+
+            Args:
+                file_des: An integer file descriptor for the file object
+                    requested.
+                buffers: A sequence of mutable bytes-like objects.
+
+            Returns:
+                The total number of bytes read.
+
+            Raises:
+                OSError: bad file descriptor.
+                TypeError: if file descriptor is not an integer.
+            """
+            self._check_posix_only('readv')
+            contents = self.read(file_des, sum(len(buf) for buf in buffers))
+            position = 0
+            for buf in buffers:
+                if position >= len(contents):
+                    break
+                chunk = contents[position:position + len(buf)]
+                buf[:len(chunk)] = chunk
+                position += len(chunk)
+            return len(contents)
+
+        def writev(self, file_des, buffers):
+            """Write the contents of a sequence of buffers to a file
+            descriptor. New in Python 3.3.
+
+            Args:
+                file_des: An integer file descriptor for the file object
+                    requested.
+                buffers: A sequence of bytes-like objects.
+
+            Returns:
+                The total number of bytes written.
+
+            Raises:
+                OSError: bad file descriptor.
+                TypeError: if file descriptor is not an integer.
+            """
+            self._check_posix_only('writev')
+            return self.write(file_des,
+                              b''.join(bytes(buf) for buf in buffers))
+
+        def sendfile(self, out_fd, in_fd, offset, count, *args, **kwargs):
+            """Copy `count` bytes from `in_fd` starting at `offset` to
+            `out_fd`. The bytes are copied between the file contents,
+            without using the buffers of the open files.
+            New in Python 3.3.
+
+            Args:
+                out_fd: The file descriptor to write to at its current
+                    position.
+                in_fd: The file descriptor to read from.
+                offset: The position to read from; `in_fd` is not moved.
+                    If `None`, the current position of `in_fd` is used
+                    and advanced.
+                count: The maximum number of bytes to copy.
+
+            Returns:
+                The number of bytes copied.
+
+            Raises:
+                OSError: bad file descriptor.
+                TypeError: if a file descriptor is not an integer.
+            """
+            self._check_posix_only('sendfile')
+            return self._copy_between_fds(in_fd, out_fd, count, offset, None)
+
+        def _copy_between_fds(self, in_fd, out_fd, count,
+                              in_offset, out_offset):
+            """Copy up to `count` bytes between the contents of the files
+            open as `in_fd` and `out_fd`. Each offset given as `None`
+            is replaced by the current position of the descriptor,
+            which is advanced by the number of copied bytes."""
+            in_file = self._positional_file(in_fd)
+            out_file = self._positional_file(out_fd, writing=True)
+            in_handle = self.filesystem.get_open_file(in_fd)
+            out_handle = self.filesystem.get_open_file(out_fd)
+            # the positions of the stream buffers are changed directly,
+            # the buffers are synchronized with the changed contents
+            # on the next access
+            advance_in = in_offset is None
+            if advance_in:
+                in_offset = in_handle._io.tell()
+            contents = in_file.read_at(in_offset, count)
+            if advance_in:
+                in_handle._io.seek(in_offset + len(contents))
+            if out_offset is not None:
+                out_file.write_at(out_offset, contents)
+            elif out_handle._append:
+                out_file.write_at(out_file.st_size, contents)
+            else:
+                out_offset = out_handle._io.tell()
+                out_file.write_at(out_offset, contents)
+                out_handle._io.seek(out_offset + len(contents))
+            if self.filesystem._device_profiles:
+                self.filesystem.simulate_io(
+                    in_file.st_dev, 'read', len(contents))
+                self.filesystem.simulate_io(
+                    out_file.st_dev, 'write', len(contents))
+            return len(contents)
+
+    if sys.version_info >= (3, 8):
+        def copy_file_range(self, src, dst, count,
+                            offset_src=None, offset_dst=None):
+            """Copy `count` bytes from file descriptor `src` to file
+            descriptor `dst` inside the fake file system, without using
+            the buffers of the open files. New in Python 3.8.
+
+            Args:
+                src: The file descriptor to read from.
+                dst: The file descriptor to write to.
+                count: The maximum number of bytes to copy.
+                offset_src: The position to read from; if `None`, the
+                    current position of `src` is used and advanced.
+                offset_dst: The position to write to; if `None`, the
+                    current position of `dst` is used and advanced.
+
+            Returns:
+                The number of bytes copied.
+
+            Raises:
+                OSError: bad file descriptor.
+                TypeError: if a file descriptor is not an integer.
+            """
+            if self.filesystem.is_windows_fs or self.filesystem.is_macos:
+                raise AttributeError(
+                    "module 'os' has no attribute 'copy_file_range'")
+            return self._copy_between_fds(src, dst, count,
+                                          offset_src, offset_dst)
+
     @staticmethod
     def stat_float_times(newvalue=None):
         """Determine whether a file's time stamps are reported as floats
@@ -3619,14 +5934,14 @@ class FakeOsModule(object):
             file_des: The file descriptor of filesystem object to retrieve.
 
         Returns:
-            The FakeStatResult object corresponding to entry_path.
+            An `os.stat_result` object corresponding to entry_path.
 
         Raises:
             OSError: if the filesystem object doesn't exist.
         """
         # stat should return the tuple representing return value of os.stat
         file_object = self.filesystem.get_open_file(file_des).get_object()
-        return file_object.stat_result.copy()
+        return file_object.stat_result.snapshot()
 
     def umask(self, new_mask):
         """Change the current umask.
@@ -3883,7 +6198,7 @@ class FakeOsModule(object):
                 New in Python 3.3.
 
         Returns:
-            The FakeStatResult object corresponding to entry_path.
+            An `os.stat_result` object corresponding to entry_path.
 
         Raises:
             OSError: if the filesystem object doesn't exist.
@@ -3906,7 +6221,7 @@ class FakeOsModule(object):
                 New in Python 3.3.
 
         Returns:
-            the FakeStatResult object corresponding to `entry_path`.
+            An `os.stat_result` object corresponding to `entry_path`.
 
         Raises:
             OSError: if the filesystem object doesn't exist.
@@ -4356,6 +6671,13 @@ class FakeOsModule(object):
             if (not hasattr(file_object, 'allow_update') or
                     not file_object.allow_update):
                 self.filesystem.raise_os_error(errno.EBADF, file_object.file_path)
+        self._simulate_fsync(file_object)
+
+    def _simulate_fsync(self, file_handle):
+        if (self.filesystem._device_profiles and
+                isinstance(file_handle, FakeFileWrapper)):
+            self.filesystem.simulate_io(
+                file_handle.file_object.st_dev, 'fsync')
 
     def fdatasync(self, file_des):
         """Perform fdatasync for a fake file (in other words, do nothing).
@@ -4372,7 +6694,7 @@ class FakeOsModule(object):
             raise AttributeError("module 'os' has no attribute 'fdatasync'")
         if 0 <= file_des < NR_STD_STREAMS:
             self.filesystem.raise_os_error(errno.EINVAL)
-        self.filesystem.get_open_file(file_des)
+        self._simulate_fsync(self.filesystem.get_open_file(file_des))
 
     def __getattr__(self, name):
         """Forwards any unfaked calls to the standard os module."""
@@ -4431,24 +6753,39 @@ class FakeFileWrapper(object):
         self._read = read
         self.allow_update = update
         self._closefd = closefd
+        # set if the file object has been closed while duplicated
+        # descriptors still refer to the open file
+        self._closed_as_file = False
         self._file_epoch = file_object.epoch
         self.raw_io = raw_io
         self._binary = binary
         self.is_stream = is_stream
-        contents = file_object.byte_contents
+        # sparse files are read and written in place
+        self._sparse = file_object.is_large_file()
+        stream = None
+        if self._sparse:
+            stream = SparseStream(file_object._byte_contents)
+        elif not update and isinstance(file_object, FakeFileFromRealFile):
+            stream = file_object.open_stream()
+        contents = None if stream else file_object.byte_contents
         self._encoding = encoding or locale.getpreferredencoding(False)
         errors = errors or 'strict'
         buffer_class = (NullFileBufferIO if file_object == filesystem.dev_null
                         else FileBufferIO)
         self._io = buffer_class(contents, linesep=filesystem.line_separator(),
                                 binary=binary, encoding=encoding,
-                                newline=newline, errors=errors)
+                                newline=newline, errors=errors, stream=stream)
 
         self._read_whence = 0
         self._read_seek = 0
         self._flush_pos = 0
-        if contents:
+        # set if written since the last flush
+        self._modified = False
+        if stream:
+            self._flush_pos = file_object.st_size
+        elif contents:
             self._flush_pos = len(contents)
+        if self._flush_pos:
             if update:
                 if not append:
                     self._io.seek(0)
@@ -4493,28 +6830,68 @@ class FakeFileWrapper(object):
     def close(self):
         """Close the file."""
         # ignore closing a closed file
-        if not self._is_open():
+        if not self._is_open() or self._closed_as_file:
+            return
+        open_files = self._filesystem.open_files
+        if self._closefd and not open_files.refers_to(self.filedes, self):
+            # the own descriptor has been closed via `os.close()`, while
+            # the open file is still used by a duplicated descriptor
+            self._closed_as_file = True
+            if IS_PY2:
+                self._filesystem.raise_io_error(errno.EBADF, self.file_path)
+            self._filesystem.raise_os_error(errno.EBADF, self.file_path)
+        if self._closefd and open_files.is_shared(self.filedes):
+            # the open file stays usable via the duplicated descriptors,
+            # only the own descriptor is closed
+            if self.allow_update and not self.raw_io:
+                self.flush()
+            self._filesystem._close_open_file(self.filedes)
+            self._closed_as_file = True
             return
+        self._close(self.filedes)
 
+    def _close(self, file_des):
+        """Close the file together with the open file descriptor
+        `file_des`, which refers to it."""
         # for raw io, all writes are flushed immediately
         if self.allow_update and not self.raw_io:
             self.flush()
+        self._io.close_stream()
         if self._closefd:
-            self._filesystem._close_open_file(self.filedes)
+            self._filesystem._close_open_file(file_des)
         else:
-            self._filesystem.open_files[self.filedes].remove(self)
+            self._filesystem.open_files.remove(self)
         if self.delete_on_close:
             self._filesystem.remove_object(self.get_object().path)
 
     @property
     def closed(self):
         """Simulate the `closed` attribute on file."""
-        return not self._is_open()
+        return self._closed_as_file or not self._is_open()
 
     def flush(self):
         """Flush file contents to 'disk'."""
         self._check_open_file()
-        if self.allow_update and not self.is_stream:
+        lock = getattr(self.file_object, '_lock', None)
+        if lock is None:
+            self._flush()
+        else:
+            # other threads may write to the same file
+            with lock:
+                self._flush()
+
+    def _flush(self):
+        if self.allow_update and not self.is_stream and self._sparse:
+            self.file_object.update_sparse_size()
+            self._file_epoch = self.file_object.epoch
+            self._flush_related_files()
+        elif (self.allow_update and not self.is_stream and
+              not self._append and not self._modified and
+              self._file_epoch != self.file_object.epoch):
+            # the file has only been changed elsewhere, e.g. via a memory map
+            self._sync_io()
+        elif self.allow_update and not self.is_stream:
+            self._modified = False
             contents = self._io.getvalue()
             if self._append:
                 self._sync_io()
@@ -4536,17 +6913,28 @@ class FakeFileWrapper(object):
         self._flush_pos = self._io.tell()
 
     def _flush_related_files(self):
-        for open_files in self._filesystem.open_files[3:]:
-            if open_files is not None:
-                for open_file in open_files:
-                    if (open_file is not self and
-                            self.file_object == open_file.file_object and
-                            not open_file._append):
-                        open_file._sync_io()
+        for open_file in self._filesystem.open_files.open_files(
+                self.file_object):
+            if open_file is not self and not open_file._append:
+                open_file._sync_io()
 
     def seek(self, offset, whence=0):
         """Move read/write pointer in 'file'."""
         self._check_open_file()
+        if whence in (SEEK_DATA, SEEK_HOLE):
+            offset = self._sparse_offset(offset, whence)
+            whence = 0
+        elif (self.allow_update and not self._append and
+              not self._sparse and not self.is_stream):
+            position = (offset if whence == 0 else
+                        offset + self._io.tell() if whence == 1 else
+                        offset + self.file_object.st_size)
+            if position - self.file_object.st_size >= _SPARSE_HOLE_SIZE:
+                # writing after the seek would fill a large hole
+                self.flush()
+                self.file_object._byte_contents = SparseContents(
+                    self.file_object.byte_contents)
+                self._use_sparse_stream()
         if not self._append:
             self._io.seek(offset, whence)
         else:
@@ -4555,6 +6943,37 @@ class FakeFileWrapper(object):
         if not self.is_stream:
             self.flush()
 
+    def _sparse_offset(self, offset, whence):
+        """Return the position of the next data (`SEEK_DATA`) or the next
+        hole (`SEEK_HOLE`) at or after `offset`, where the end of the file
+        counts as a hole.
+
+        Raises:
+            OSError: if `offset` is not inside the file, or if there is
+                no more data for `SEEK_DATA`.
+        """
+        if self._sparse:
+            contents = self.file_object._byte_contents
+            position = (contents.data_offset(offset) if whence == SEEK_DATA
+                        else contents.hole_offset(offset))
+        else:
+            # a file without holes consists of data up to the end
+            self.flush()
+            size = self.file_object.st_size
+            position = (None if offset >= size else
+                        offset if whence == SEEK_DATA else size)
+        if position is None:
+            self._filesystem.raise_os_error(errno.ENXIO, self.file_path)
+        return position
+
+    def _use_sparse_stream(self):
+        """Switch to reading and writing the sparse contents of the file
+        in place, after the file has been made sparse."""
+        position = self._io.tell()
+        self._io.replace_stream(SparseStream(self.file_object._byte_contents))
+        self._io.seek(position)
+        self._sparse = True
+
     def tell(self):
         """Return the file's current position.
 
@@ -4575,6 +6994,62 @@ class FakeFileWrapper(object):
             self._io.seek(write_seek)
         return self._read_seek
 
+    # methods of binary files only, dispatched in __getattr__
+    _binary_methods = {'readinto', 'readinto1', 'read1', 'peek'}
+
+    def _binary_read_stream(self):
+        """Prepare reading from a binary file without newline conversion,
+        and return the stream, positioned at the read position."""
+        self._check_open_file()
+        if not self._read:
+            self._raise('File is not open for reading.')
+        self._sync_io()
+        # only pending writes have to be flushed before reading
+        if self._modified and self._flushes_after_read():
+            self.flush()
+        if self._append:
+            self._io.seek(self._read_seek, self._read_whence)
+        return self._io
+
+    def _end_binary_read(self):
+        """Update the read position after reading via
+        `_binary_read_stream()`."""
+        if self._append:
+            self._read_seek = self._io.tell()
+            self._read_whence = 0
+            self._io.seek(0, 2)
+
+    def _readinto(self, buffer):
+        """Read bytes directly into the pre-allocated, writable bytes-like
+        object `buffer`, and return the number of bytes read."""
+        count = self._binary_read_stream().readinto(buffer)
+        self._end_binary_read()
+        return count
+
+    # there is no raw stream to read from, so `readinto1()` is the same
+    _readinto1 = _readinto
+
+    def _read1(self, size=-1):
+        """Read and return up to `size` bytes, or up to the default buffer
+        size if `size` is negative."""
+        stream = self._binary_read_stream()
+        if size is None or size < 0:
+            size = io.DEFAULT_BUFFER_SIZE
+        contents = stream.read(size)
+        self._end_binary_read()
+        return contents
+
+    def _peek(self, size=0):
+        """Return bytes from the current position without advancing it.
+        At least `size` bytes and up to the default buffer size are returned,
+        if available."""
+        stream = self._binary_read_stream()
+        position = stream.tell()
+        contents = stream.read(max(size, io.DEFAULT_BUFFER_SIZE))
+        stream.seek(position)
+        self._end_binary_read()
+        return contents
+
     def _flushes_after_read(self):
         return (not self.is_stream and
                 (not self._filesystem.is_windows_fs or not IS_PY2))
@@ -4588,6 +7063,12 @@ class FakeFileWrapper(object):
         if self._file_epoch == self.file_object.epoch:
             return
 
+        if self.file_object.is_large_file():
+            if not self._sparse:
+                self._use_sparse_stream()
+            self._file_epoch = self.file_object.epoch
+            return
+
         if self._io.binary:
             contents = self.file_object.byte_contents
         else:
@@ -4598,8 +7079,7 @@ class FakeFileWrapper(object):
 
     def _set_stream_contents(self, contents):
         whence = self._io.tell()
-        self._io.seek(0)
-        self._io.truncate()
+        self._io.replace_stream()
         if not self._io.binary and is_byte_string(contents):
             contents = contents.decode(self._encoding)
         self._io.putvalue(contents)
@@ -4678,13 +7158,10 @@ class FakeFileWrapper(object):
         return other_wrapper
 
     def _adapt_size_for_related_files(self, size):
-        for open_files in self._filesystem.open_files[3:]:
-            if open_files is not None:
-                for open_file in open_files:
-                    if (open_file is not self and
-                            self.file_object == open_file.file_object and
-                            open_file._append):
-                        open_file._read_seek += size
+        for open_file in self._filesystem.open_files.open_files(
+                self.file_object):
+            if open_file is not self and open_file._append:
+                open_file._read_seek += size
 
     def _truncate_wrapper(self):
         """Wrap truncate() to allow flush after truncate.
@@ -4702,6 +7179,9 @@ class FakeFileWrapper(object):
             self.flush()
             if not self.is_stream:
                 self.file_object.size = size
+                if self.file_object.is_large_file() and not self._sparse:
+                    self._use_sparse_stream()
+            if not self.is_stream and not self._sparse:
                 buffer_size = len(self._io.getvalue())
                 if buffer_size < size:
                     self._io.seek(buffer_size)
@@ -4734,13 +7214,49 @@ class FakeFileWrapper(object):
 
         return write_wrapper
 
+    def _simulated_io_wrapper(self, io_attr, reading):
+        """Wrap a read or write call to add the simulated time of the
+        operation on the device of the file."""
+        def simulated_io_wrapper(*args, **kwargs):
+            position = self._io.tell()
+            ret_value = io_attr(*args, **kwargs)
+            if reading:
+                if isinstance(ret_value, list):
+                    size = sum(len(line) for line in ret_value)
+                elif is_int_type(ret_value):
+                    # readinto() and readinto1() return the byte count
+                    size = ret_value
+                else:
+                    size = len(ret_value) if ret_value else 0
+            else:
+                size = max(self._io.tell() - position, 0)
+            self._filesystem.simulate_io(
+                self.file_object.st_dev, 'read' if reading else 'write',
+                size)
+            return ret_value
+
+        return simulated_io_wrapper
+
+    def _instrumented(self, io_attr, reading):
+        """Add the simulated device time and the operation statistics
+        to a read or write call, if enabled."""
+        if self._filesystem._device_profiles and not self.is_stream:
+            io_attr = self._simulated_io_wrapper(io_attr, reading)
+        if self._filesystem._stats is not None:
+            return self._filesystem._stats.timed(
+                'read' if reading else 'write', io_attr)
+        return io_attr
+
     def size(self):
         """Return the content size in bytes of the wrapped file."""
         return self.file_object.st_size
 
     def __getattr__(self, name):
-        if self.file_object.is_large_file():
-            raise FakeLargeFileIoException(self.file_path)
+        if name in self._binary_methods:
+            if self._binary:
+                return self._instrumented(getattr(self, '_' + name), True)
+            raise AttributeError(
+                "'TextIOWrapper' object has no attribute '%s'" % name)
 
         reading = name.startswith('read') or name == 'next'
         truncate = name == 'truncate'
@@ -4752,6 +7268,8 @@ class FakeFileWrapper(object):
             return self._read_error()
         if not self.allow_update and writing:
             return self._write_error()
+        if writing:
+            self._modified = True
 
         if reading:
             self._sync_io()
@@ -4761,13 +7279,16 @@ class FakeFileWrapper(object):
             return self._truncate_wrapper()
         if self._append:
             if reading:
-                return self._read_wrappers(name)
+                attr = self._read_wrappers(name)
             else:
-                return self._other_wrapper(name, writing)
-        if writing:
-            return self._write_wrapper(name)
-
-        return getattr(self._io, name)
+                attr = self._other_wrapper(name, writing)
+        elif writing:
+            attr = self._write_wrapper(name)
+        else:
+            attr = getattr(self._io, name)
+        if reading or writing:
+            return self._instrumented(attr, reading)
+        return attr
 
     def _read_error(self):
         def read_error(*args, **kwargs):
@@ -4791,9 +7312,7 @@ class FakeFileWrapper(object):
         return write_error
 
     def _is_open(self):
-        return (self.filedes < len(self._filesystem.open_files) and
-                self._filesystem.open_files[self.filedes] is not None and
-                self in self._filesystem.open_files[self.filedes])
+        return self._filesystem.open_files.is_open(self)
 
     def _check_open_file(self):
         if not self.is_stream and not self._is_open():
@@ -4928,6 +7447,14 @@ class FakeFileOpen(object):
                 - if permission is denied
             ValueError: for an invalid mode or mode combination
         """
+        open_fct = self._open
+        if self.filesystem._stats is not None:
+            open_fct = self.filesystem._stats.timed('open', open_fct)
+        return open_fct(file_, mode, buffering, encoding, errors, newline,
+                        closefd, opener, open_modes)
+
+    def _open(self, file_, mode, buffering, encoding, errors, newline,
+              closefd, opener, open_modes):
         binary = 'b' in mode
         newline, open_modes = self._handle_file_mode(mode, newline, open_modes)
 
@@ -4964,9 +7491,19 @@ class FakeFileOpen(object):
                          else errno.ENOENT if self.filesystem.is_macos
                          else errno.EISDIR)
                 error_fct(error, file_path)
-            file_object = self.filesystem.create_file_internally(
-                real_path, create_missing_dirs=False,
-                apply_umask=True, raw_io=self.raw_io)
+            try:
+                file_object = self.filesystem.create_file_internally(
+                    real_path, create_missing_dirs=False,
+                    apply_umask=True, raw_io=self.raw_io)
+            except OSError as exc:
+                # the file may have been created by another thread meanwhile
+                if (not self.filesystem._thread_safe or
+                        exc.errno != errno.EEXIST or
+                        open_modes.must_not_exist):
+                    raise
+                file_object = self.filesystem.resolve(real_path)
+                if open_modes.truncate and not S_ISDIR(file_object.st_mode):
+                    file_object.set_contents('')
 
         if S_ISDIR(file_object.st_mode):
             if self.filesystem.is_windows_fs:
@@ -4977,6 +7514,8 @@ class FakeFileOpen(object):
         # If you print obj.name, the argument to open() must be printed.
         # Not the abspath, not the filename, but the actual argument.
         file_object.opened_as = file_path
+        if self.filesystem._device_profiles:
+            self.filesystem.simulate_io(file_object.st_dev, 'metadata')
 
         fakefile = FakeFileWrapper(file_object,
                                    file_path,
@@ -4995,7 +7534,7 @@ class FakeFileOpen(object):
         if filedes is not None:
             fakefile.filedes = filedes
             # replace the file wrapper
-            self.filesystem.open_files[filedes].append(fakefile)
+            self.filesystem.open_files.add_to_descriptor(filedes, fakefile)
         else:
             fakefile.filedes = self.filesystem._add_open_file(fakefile)
         return fakefile
@@ -17,7 +17,7 @@
 for unit tests using the :py:class:`pyfakefs` module.
 
 `fake_filesystem_unittest.TestCase` searches `sys.modules` for modules
-that import the `os`, `io`, `path` `shutil`, and `pathlib` modules.
+that import the `os`, `io`, `path` `shutil`, `mmap`, and `pathlib` modules.
 
 The `setUpPyfakefs()` method binds these modules to the corresponding fake
 modules from `pyfakefs`.  Further, the `open()` built-in is bound to a fake
@@ -63,6 +63,7 @@ except ImportError:
 
 from pyfakefs import fake_filesystem
 from pyfakefs import fake_filesystem_shutil
+from pyfakefs import fake_mmap
 from pyfakefs import mox3_stubout
 from pyfakefs.extra_packages import pathlib, use_scandir
 
@@ -257,7 +258,8 @@ class Patcher(object):
         with Patcher():
             doStuff()
     """
-    SKIPMODULES = {None, fake_filesystem, fake_filesystem_shutil, sys}
+    SKIPMODULES = {None, fake_filesystem, fake_filesystem_shutil, fake_mmap,
+                   sys}
     '''Stub nothing that is imported within these modules.
     `sys` is included to prevent `sys.path` from being stubbed with the fake
     `os.path`.
@@ -296,6 +298,7 @@ class Patcher(object):
             'os': fake_filesystem.FakeOsModule,
             'shutil': fake_filesystem_shutil.FakeShutilModule,
             'io': fake_filesystem.FakeIoModule,
+            'mmap': fake_mmap.FakeMmapModule,
         }
         if pathlib:
             self._fake_module_classes[
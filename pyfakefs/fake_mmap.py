@@ -0,0 +1,356 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A fake mmap module implementation that uses fake_filesystem for
+unit tests.
+
+Memory maps of fake files operate directly on the contents of the
+fake file object. Anonymous maps (with a file descriptor of -1) are created
+using the real `mmap` module.
+
+:Includes:
+  FakeMmap: Provides the interface of an `mmap.mmap` object.
+  FakeMmapModule: Uses a FakeFilesystem to provide a fake replacement for the
+    mmap module.
+
+:Usage:
+  The fake implementation is automatically involved if using
+  `fake_filesystem_unittest.TestCase`, pytest fs fixture,
+  or directly `Patcher`.
+
+.. note:: Fake memory maps do not support the buffer protocol, so they
+  cannot be used with `memoryview` or the `re` module.
+"""
+
+import errno
+import mmap
+import sys
+
+from pyfakefs.helpers import IS_PY2, SparseContents
+
+ACCESS_DEFAULT = getattr(mmap, 'ACCESS_DEFAULT', 0)
+
+
+class FakeMmap(object):
+    """Emulates an `mmap.mmap` object mapping a fake file.
+
+    The map shares the contents of the fake file: writing through the map
+    changes the file contents in place, and increases the file epoch so that
+    other open handles of the file see the change. With `ACCESS_COPY`, the
+    changes are only made to a private copy of the mapped region.
+    """
+
+    def __init__(self, filesystem, fileno, length, access, offset=0):
+        """
+        Args:
+            filesystem: The fake filesystem containing the mapped file.
+            fileno: The file descriptor of the open fake file.
+            length: The length of the map, or 0 to map the whole file
+                starting at `offset`.
+            access: One of `ACCESS_READ`, `ACCESS_WRITE` and `ACCESS_COPY`.
+            offset: The offset of the map inside the file.
+
+        Raises:
+            OSError: if `fileno` is not a valid file descriptor, or if the
+                file is not open for reading, or for writing if mapped
+                with `ACCESS_WRITE`.
+            ValueError: if `length` and `offset` are not inside the file.
+        """
+        open_file = filesystem.get_open_file(fileno)
+        if (not open_file._read or
+                access == mmap.ACCESS_WRITE and not open_file.allow_update):
+            filesystem.raise_os_error(errno.EACCES, open_file.file_path)
+        if length < 0:
+            raise OverflowError('memory mapped length must be positive')
+        if offset < 0:
+            raise OverflowError('memory mapped offset must be positive')
+        self._file = open_file.get_object()
+        file_size = self._file.st_size
+        if length == 0:
+            if file_size == 0:
+                raise ValueError('cannot mmap an empty file')
+            if offset >= file_size:
+                raise ValueError('mmap offset is greater than file size')
+            length = file_size - offset
+        elif offset + length > file_size:
+            if not filesystem.is_windows_fs:
+                raise ValueError('mmap length is greater than file size')
+            # under Windows, the file is extended to the map size
+            self._file.size = offset + length
+        self._access = access
+        self._offset = offset
+        self._size = length
+        self._position = 0
+        self._private = None
+        self._written = False
+        self.closed = False
+
+    def _check_open(self):
+        if self.closed:
+            raise ValueError('mmap closed or invalid')
+
+    def _check_writable(self):
+        self._check_open()
+        if self._access == mmap.ACCESS_READ:
+            raise TypeError("mmap can't modify a readonly memory map.")
+
+    def _read(self, start, end):
+        """Return the bytes between map positions `start` and `end`."""
+        if self._private is not None:
+            return bytes(self._private[start:end])
+        return self._file.read_at(self._offset + start, end - start)
+
+    def _write(self, start, data):
+        """Write `data` at map position `start`."""
+        if self._access == mmap.ACCESS_COPY:
+            if self._private is None:
+                self._private = bytearray(self._read(0, self._size))
+            self._private[start:start + len(data)] = data
+            return
+        # the modification time is only changed on flush
+        start += self._offset
+        contents = self._file.mutable_contents()
+        if contents.__class__ is SparseContents:
+            contents.write(start, data)
+        else:
+            contents[start:start + len(data)] = data
+        self._file.epoch += 1
+        self._written = True
+
+    def _index(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('mmap index out of range')
+        return index
+
+    def _range(self, start, end):
+        """Return the map positions for the `start` and `end` arguments,
+        interpreted as in slice notation."""
+        return slice(start, end).indices(self._size)[:2]
+
+    def __len__(self):
+        self._check_open()
+        return self._size
+
+    def __getitem__(self, index):
+        self._check_open()
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._size)
+            if step == 1:
+                return self._read(start, stop)
+            return self._read(0, self._size)[index]
+        index = self._index(index)
+        byte = self._read(index, index + 1)
+        return byte if IS_PY2 else ord(byte)
+
+    def __setitem__(self, index, value):
+        self._check_writable()
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._size)
+            if step != 1:
+                contents = bytearray(self._read(0, self._size))
+                contents[index] = value
+                self._write(0, bytes(contents))
+                return
+            if len(value) != max(stop - start, 0):
+                raise IndexError('mmap slice assignment is wrong size')
+            self._write(start, bytes(value))
+            return
+        index = self._index(index)
+        self._write(index, value if IS_PY2 else bytes([value]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Close the map. Further access raises `ValueError`."""
+        if not self.closed:
+            self.flush()
+            self.closed = True
+            self._private = None
+
+    def find(self, sub, start=None, end=None):
+        """Return the lowest map position where `sub` is found
+        between `start` (the current position if not given) and `end`,
+        or -1 if not found."""
+        self._check_open()
+        start, end = self._range(
+            self._position if start is None else start, end)
+        position = self._read(start, end).find(sub)
+        return position if position < 0 else start + position
+
+    def rfind(self, sub, start=None, end=None):
+        """Return the highest map position where `sub` is found
+        between `start` (the current position if not given) and `end`,
+        or -1 if not found."""
+        self._check_open()
+        start, end = self._range(
+            self._position if start is None else start, end)
+        position = self._read(start, end).rfind(sub)
+        return position if position < 0 else start + position
+
+    def flush(self, offset=0, size=None):
+        """Flush the changes made through the map. Updates the modification
+        time of the file if it has been written."""
+        self._check_open()
+        if self._written:
+            self._written = False
+            current_time = self._file.filesystem.clock.time()
+            self._file.st_ctime = current_time
+            self._file.st_mtime = current_time
+        if sys.version_info < (3, 8):
+            return 0
+
+    def move(self, dest, src, count):
+        """Copy `count` bytes from position `src` to position `dest`."""
+        self._check_writable()
+        if (min(dest, src, count) < 0 or
+                max(dest, src) + count > self._size):
+            raise ValueError('source, destination, or count out of range')
+        self._write(dest, self._read(src, src + count))
+
+    def read(self, size=None):
+        """Read up to `size` bytes from the current position,
+        or all remaining bytes if `size` is not given or negative."""
+        self._check_open()
+        end = self._size
+        if size is not None and size >= 0:
+            end = min(self._position + size, end)
+        contents = self._read(self._position, end)
+        self._position += len(contents)
+        return contents
+
+    def read_byte(self):
+        """Read a single byte at the current position."""
+        self._check_open()
+        if self._position >= self._size:
+            raise ValueError('read byte out of range')
+        self._position += 1
+        return self[self._position - 1]
+
+    def readline(self):
+        """Read a line, including the newline, from the current position."""
+        self._check_open()
+        end = self.find(b'\n')
+        end = self._size if end < 0 else end + 1
+        contents = self._read(self._position, end)
+        self._position = end
+        return contents
+
+    def resize(self, newsize):
+        """Resize the map and the underlying file.
+
+        Raises:
+            TypeError: if the map is read-only or copy-on-write.
+        """
+        self._check_open()
+        if self._access in (mmap.ACCESS_READ, mmap.ACCESS_COPY):
+            raise TypeError("mmap can't resize a readonly or "
+                            "copy-on-write memory map.")
+        self._file.size = self._offset + newsize
+        self._size = newsize
+        self._position = min(self._position, newsize)
+
+    def seek(self, pos, whence=0):
+        """Set the current position."""
+        self._check_open()
+        if whence == 1:
+            pos += self._position
+        elif whence == 2:
+            pos += self._size
+        elif whence != 0:
+            raise ValueError('unknown seek type')
+        if not 0 <= pos <= self._size:
+            raise ValueError('seek out of range')
+        self._position = pos
+
+    def size(self):
+        """Return the size of the underlying file."""
+        self._check_open()
+        return self._file.st_size
+
+    def tell(self):
+        """Return the current position."""
+        self._check_open()
+        return self._position
+
+    def write(self, data):
+        """Write `data` at the current position.
+
+        Raises:
+            ValueError: if `data` does not fit into the map.
+        """
+        self._check_writable()
+        if self._position + len(data) > self._size:
+            raise ValueError('data out of range')
+        self._write(self._position, bytes(data))
+        self._position += len(data)
+        if sys.version_info >= (3, 6):
+            return len(data)
+
+    def write_byte(self, byte):
+        """Write a single byte at the current position."""
+        self._check_writable()
+        if self._position >= self._size:
+            raise ValueError('write byte out of range')
+        self[self._position] = byte
+        self._position += 1
+
+
+class FakeMmapModule(object):
+    """Uses a FakeFilesystem to provide a fake replacement for the
+    mmap module.
+
+    You need a fake_filesystem to use this:
+    `filesystem = fake_filesystem.FakeFilesystem()`
+    `fake_mmap_module = fake_mmap.FakeMmapModule(filesystem)`
+    """
+
+    def __init__(self, filesystem):
+        """
+        Args:
+            filesystem: FakeFilesystem used to provide file system
+                information.
+        """
+        self.filesystem = filesystem
+        self._mmap_module = mmap
+
+    def mmap(self, fileno, length, *args, **kwargs):
+        """Return a memory map of the fake file open as `fileno`.
+        Takes the same arguments as `mmap.mmap` under the current system.
+        If `fileno` is -1, an anonymous real memory map is returned.
+        """
+        if fileno == -1:
+            return self._mmap_module.mmap(fileno, length, *args, **kwargs)
+        if sys.platform == 'win32':
+            names = ('tagname', 'access', 'offset')
+        else:
+            names = ('flags', 'prot', 'access', 'offset')
+        kwargs.update(zip(names, args))
+        access = kwargs.get('access', ACCESS_DEFAULT)
+        if access == ACCESS_DEFAULT:
+            access = mmap.ACCESS_WRITE
+            prot = kwargs.get('prot')
+            if prot is not None and not prot & mmap.PROT_WRITE:
+                access = mmap.ACCESS_READ
+            elif kwargs.get('flags', 0) & getattr(mmap, 'MAP_PRIVATE', 0):
+                access = mmap.ACCESS_COPY
+        return FakeMmap(self.filesystem, fileno, length, access,
+                        kwargs.get('offset', 0))
+
+    def __getattr__(self, name):
+        """Forwards any non-faked calls to the standard mmap module."""
+        return getattr(self._mmap_module, name)
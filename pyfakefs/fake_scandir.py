@@ -90,7 +90,7 @@ class DirEntry(object):
                 file_object = self._filesystem.resolve(self.path)
                 if self._filesystem.is_windows_fs:
                     file_object.st_nlink = 0
-                self._statresult_symlink = file_object.stat_result.copy()
+                self._statresult_symlink = file_object.stat_result.snapshot()
             return self._statresult_symlink
 
         if self._statresult is None:
@@ -98,7 +98,7 @@ class DirEntry(object):
             self._inode = file_object.st_ino
             if self._filesystem.is_windows_fs:
                 file_object.st_nlink = 0
-            self._statresult = file_object.stat_result.copy()
+            self._statresult = file_object.stat_result.snapshot()
         return self._statresult
 
 
@@ -120,6 +120,10 @@ class ScanDirIter:
         contents = {}
         try:
             contents = self.filesystem.confirmdir(path).contents
+            if self.filesystem._thread_safe:
+                # the directory may be changed by other threads
+                # while iterating
+                contents = list(contents)
         except OSError:
             pass
         self.contents_iter = iter(contents)
@@ -169,6 +173,9 @@ def scandir(filesystem, path=''):
     Raises:
         OSError: if the target is not a directory.
     """
+    if filesystem._stats is not None:
+        return filesystem._stats.timed('scandir', ScanDirIter)(
+            filesystem, path)
     return ScanDirIter(filesystem, path)
 
 
@@ -11,11 +11,15 @@
 # limitations under the License.
 
 """Helper classes use for fake file system implementation."""
+import bisect
+import heapq
 import io
 import locale
 import sys
+import time
 from copy import copy
 from stat import S_IFLNK
+from timeit import default_timer
 
 import os
 
@@ -60,9 +64,11 @@ def make_string_path(dir_name):
 
 
 class FakeStatResult(object):
-    """Mimics os.stat_result for use as return type of `stat()` and similar.
+    """Holds the mutable stat values of a fake file system object.
     This is needed as `os.stat_result` has no possibility to set
     nanosecond times directly.
+    The result of `stat()` and similar is an immutable `os.stat_result`
+    created by `snapshot()`.
     """
     try:
         long_type = long  # Python 2
@@ -71,6 +77,7 @@ class FakeStatResult(object):
     _stat_float_times = sys.version_info >= (2, 5)
 
     def __init__(self, is_windows, initial_time=None):
+        self._snapshot = None
         self.use_float = self.stat_float_times
         self.st_mode = None
         self.st_ino = None
@@ -105,6 +112,56 @@ class FakeStatResult(object):
     def __ne__(self, other):
         return not self == other
 
+    def snapshot(self):
+        """Return the current values as an immutable `os.stat_result`.
+        The result is cached until a value or the float usage changes,
+        so that repeated calls return the same object.
+        """
+        # the cache is validated against the values themselves, as they
+        # may be set directly from outside
+        key = (self.st_mode, self.st_ino, self.st_dev, self.st_nlink,
+               self.st_uid, self.st_gid, self._st_size, self._st_atime_ns,
+               self._st_mtime_ns, self._st_ctime_ns, self.use_float())
+        cached = self._snapshot
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        result = self._make_stat_result(key[-1])
+        self._snapshot = (key, result)
+        return result
+
+    def _make_stat_result(self, use_float):
+        size = self.st_size
+        times = [self._st_atime_ns, self._st_mtime_ns, self._st_ctime_ns]
+        if times[0] is None:
+            seconds = int_seconds = [None] * 3
+        else:
+            seconds = [time_ns / 1e9 for time_ns in times]
+            int_seconds = [int(second) for second in seconds]
+        if not use_float:
+            seconds = int_seconds
+        # values not in the sequence are set by name; names not existing
+        # in `os.stat_result` under the current OS are ignored
+        extra_values = {
+            'st_atime': seconds[0],
+            'st_mtime': seconds[1],
+            'st_ctime': seconds[2],
+            'st_atime_ns': times[0],
+            'st_mtime_ns': times[1],
+            'st_ctime_ns': times[2],
+            'st_blksize': 4096,
+            'st_blocks': (size + 511) // 512 if size else 0,
+            'st_rdev': 0,
+            'st_flags': 0,
+            'st_gen': 0,
+            'st_birthtime': seconds[2],
+            'st_file_attributes': 0,
+            'st_reparse_tag': 0,
+        }
+        return os.stat_result(
+            (self.st_mode, self.st_ino, self.st_dev, self.st_nlink,
+             self.st_uid, self.st_gid, size) + tuple(int_seconds),
+            extra_values)
+
     def copy(self):
         """Return a copy where the float usage is hard-coded to mimic the behavior
         of the real os.stat_result.
@@ -255,20 +312,39 @@ class FileBufferIO(object):
     byte contents for files. The standard io.StringIO cannot be used
     for strings due to the slightly different handling of newline mode.
     Uses an io.BytesIO stream for the raw data and adds handling of encoding
-    and newlines.
+    and newlines. For reading only, another binary stream (e.g. a real file)
+    can be used instead.
     """
+    # chunk size used to find line endings in streams other than io.BytesIO
+    LINE_CHUNK_SIZE = 8192
+
     def __init__(self, contents=None, linesep='\n', binary=False,
-                 newline=None, encoding=None, errors='strict'):
+                 newline=None, encoding=None, errors='strict', stream=None):
         self._newline = newline
         self._encoding = encoding
         self.errors = errors
         self._linesep = linesep
         self.binary = binary
         self._bytestream = io.BytesIO()
-        if contents is not None:
+        if stream is not None:
+            self._bytestream = stream
+        elif contents is not None:
             self.putvalue(contents)
             self._bytestream.seek(0)
 
+    def replace_stream(self, stream=None):
+        """Replace the byte stream with `stream`, or with an empty
+        io.BytesIO stream if not given, closing a stream passed on creation.
+        """
+        if not isinstance(self._bytestream, io.BytesIO):
+            self._bytestream.close()
+        self._bytestream = io.BytesIO() if stream is None else stream
+
+    def close_stream(self):
+        """Close a stream passed on creation."""
+        if not isinstance(self._bytestream, io.BytesIO):
+            self._bytestream.close()
+
     def encoding(self):
         return self._encoding or locale.getpreferredencoding(False)
 
@@ -305,9 +381,47 @@ class FileBufferIO(object):
         return self.convert_newlines_after_reading(
             self.decoded_string(contents))
 
+    def _read_line_bytes(self, size):
+        """Read the bytes from the stream that contain at least the next
+        line, for streams where reading all remaining bytes is expensive.
+        """
+        if (isinstance(self._bytestream, io.BytesIO) or
+                (not self.binary and
+                 '\n'.encode(self.encoding()) != b'\n')):
+            return self._bytestream.read(size)
+        if self.binary:
+            line_ends = [b'\n']
+        elif self._newline is None or self._newline == '':
+            line_ends = [b'\n', b'\r']
+        elif self._newline == '-':
+            line_ends = [b'\n']
+        else:
+            line_ends = [self._newline.encode()]
+        byte_contents = b''
+        while size < 0 or len(byte_contents) < size:
+            chunk_size = self.LINE_CHUNK_SIZE
+            if size >= 0:
+                chunk_size = min(chunk_size, size - len(byte_contents))
+            chunk = self._bytestream.read(chunk_size)
+            if not chunk:
+                break
+            byte_contents += chunk
+            positions = [byte_contents.find(line_end) + len(line_end)
+                         for line_end in line_ends
+                         if byte_contents.find(line_end) >= 0]
+            if positions:
+                end_pos = min(positions)
+                if (len(line_ends) == 2 and
+                        byte_contents[end_pos - 1:end_pos] == b'\r'):
+                    # one more byte is needed to detect '\r\n'
+                    end_pos += 1
+                if end_pos <= len(byte_contents):
+                    return byte_contents[:end_pos]
+        return byte_contents
+
     def readline(self, size=-1):
         seek_pos = self._bytestream.tell()
-        byte_contents = self._bytestream.read(size)
+        byte_contents = self._read_line_bytes(size)
         if self.binary:
             read_contents = byte_contents
             LF = b'\n'
@@ -411,3 +525,608 @@ class NullFileBufferIO(FileBufferIO):
     """Special stream for null device. Does nothing on writing."""
     def putvalue(self, s):
         pass
+
+
+def synchronize(obj, names, lock):
+    """Make the methods `names` of `obj` hold `lock` while being called.
+    The synchronized methods are installed as instance attributes, so that
+    unsynchronized objects are not affected. Objects that are already
+    synchronized are left unchanged.
+
+    Args:
+        obj: The object to synchronize.
+        names: The names of the methods to synchronize.
+        lock: A (reentrant) lock shared by the methods.
+    """
+    if '_lock' in obj.__dict__:
+        return
+
+    def synchronized(method):
+        def synchronized_method(*args, **kwargs):
+            with lock:
+                return method(*args, **kwargs)
+
+        return synchronized_method
+
+    obj._lock = lock
+    for name in names:
+        setattr(obj, name, synchronized(getattr(obj, name)))
+
+
+FD_CLOEXEC = 1
+
+
+class FileDescriptorTable(object):
+    """Maps the file descriptors of a fake file system to the open file
+    objects, together with per-descriptor flags.
+
+    Each descriptor refers to a list of open file objects: the first one
+    has been created together with the descriptor, the others by opening
+    the descriptor again via `open()`. Duplicated descriptors (see `dup()`)
+    share the same list, so that it is only closed with the last
+    descriptor referring to it. Each open file object keeps the descriptor
+    it has been created with, even if that is closed before the others.
+
+    For backwards compatibility, the table behaves like the former list of
+    open files: the list for a descriptor can be accessed by index, which
+    returns `None` for a closed descriptor, the length of the table is one
+    more than the highest descriptor ever used, and iterating the table
+    yields the entries for all descriptors up to that length.
+    """
+
+    def __init__(self):
+        # descriptor -> list of open file objects
+        self._files = {}
+        # descriptor -> flags (FD_CLOEXEC)
+        self._flags = {}
+        # id of the list of open file objects -> referring descriptors
+        self._descriptors = {}
+        # id of an open file object -> the list of open file objects
+        # it belongs to
+        self._open = {}
+        # id of a file system object -> its open file objects
+        self._by_object = {}
+        # closed descriptors below `_next`; may contain descriptors that
+        # have been reused by `dup()`, these are skipped
+        self._free = []
+        self._next = 0
+
+    def __len__(self):
+        return self._next
+
+    def __contains__(self, file_des):
+        return file_des in self._files
+
+    def __getitem__(self, file_des):
+        if file_des < 0:
+            file_des += self._next
+        if not 0 <= file_des < self._next:
+            raise IndexError('file descriptor index out of range')
+        return self._files.get(file_des)
+
+    def __iter__(self):
+        for file_des in range(self._next):
+            yield self._files.get(file_des)
+
+    def _new_descriptor(self):
+        while self._free:
+            file_des = heapq.heappop(self._free)
+            if file_des not in self._files:
+                return file_des
+        self._next += 1
+        return self._next - 1
+
+    def _reserve(self, file_des):
+        for free_des in range(self._next, file_des):
+            heapq.heappush(self._free, free_des)
+        self._next = max(self._next, file_des + 1)
+
+    def _register(self, open_file, open_files):
+        self._open[id(open_file)] = open_files
+        self._by_object.setdefault(
+            id(open_file.get_object()), []).append(open_file)
+
+    def _unregister(self, open_file):
+        if self._open.pop(id(open_file), None) is not None:
+            object_id = id(open_file.get_object())
+            open_files = self._by_object[object_id]
+            open_files.remove(open_file)
+            if not open_files:
+                del self._by_object[object_id]
+
+    def add(self, open_file, flags=0):
+        """Add an open file object under the lowest free descriptor.
+
+        Returns:
+            The new file descriptor.
+        """
+        file_des = self._new_descriptor()
+        open_files = [open_file]
+        self._files[file_des] = open_files
+        self._flags[file_des] = flags
+        self._descriptors[id(open_files)] = [file_des]
+        self._register(open_file, open_files)
+        return file_des
+
+    def add_to_descriptor(self, file_des, open_file):
+        """Add an open file object created for the existing descriptor
+        `file_des`."""
+        open_files = self._files[file_des]
+        open_files.append(open_file)
+        self._register(open_file, open_files)
+
+    def get(self, file_des):
+        """Return the first open file object for `file_des`, or `None` if
+        the descriptor is not open."""
+        open_files = self._files.get(file_des)
+        return open_files[0] if open_files else None
+
+    def is_open(self, open_file):
+        """Return `True` if `open_file` has not been closed."""
+        return id(open_file) in self._open
+
+    def refers_to(self, file_des, open_file):
+        """Return `True` if the descriptor `file_des` is open and refers
+        to `open_file`."""
+        return any(entry is open_file
+                   for entry in self._files.get(file_des, ()))
+
+    def has_object(self, file_object):
+        """Return `True` if the file system object `file_object` is open."""
+        return id(file_object) in self._by_object
+
+    def open_files(self, file_object=None):
+        """Return a list of all open file objects, or of the open file
+        objects of the file system object `file_object`."""
+        if file_object is not None:
+            return list(self._by_object.get(id(file_object), ()))
+        return [open_file for open_files in self._by_object.values()
+                for open_file in open_files]
+
+    def is_shared(self, file_des):
+        """Return `True` if other descriptors refer to the same open files
+        as `file_des`."""
+        return len(self._descriptors[id(self._files[file_des])]) > 1
+
+    def close(self, file_des):
+        """Close the descriptor `file_des`. The open file objects are only
+        closed if no other descriptor refers to them."""
+        open_files = self._files.pop(file_des)
+        del self._flags[file_des]
+        descriptors = self._descriptors[id(open_files)]
+        descriptors.remove(file_des)
+        if not descriptors:
+            del self._descriptors[id(open_files)]
+            for open_file in open_files:
+                self._unregister(open_file)
+        heapq.heappush(self._free, file_des)
+
+    def remove(self, open_file):
+        """Close a single open file object without closing its
+        descriptor."""
+        open_files = self._open.get(id(open_file))
+        self._unregister(open_file)
+        if open_files is not None:
+            open_files.remove(open_file)
+
+    def dup(self, file_des, new_des=None, flags=0):
+        """Create a descriptor referring to the same open files as
+        `file_des`.
+
+        Args:
+            file_des: An open file descriptor.
+            new_des: The new descriptor, which must not be open. If `None`,
+                the lowest free descriptor is used.
+            flags: The flags of the new descriptor.
+
+        Returns:
+            The new file descriptor.
+        """
+        open_files = self._files[file_des]
+        if new_des is None:
+            new_des = self._new_descriptor()
+        else:
+            self._reserve(new_des)
+        self._files[new_des] = open_files
+        self._flags[new_des] = flags
+        self._descriptors[id(open_files)].append(new_des)
+        return new_des
+
+    def get_flags(self, file_des):
+        """Return the flags of the open descriptor `file_des`."""
+        return self._flags[file_des]
+
+    def set_flags(self, file_des, flags):
+        """Set the flags of the open descriptor `file_des`."""
+        self._flags[file_des] = flags
+
+
+class ContentStore(object):
+    """Interns the byte contents of fake files, so that files with identical
+    contents share the same bytes object. The references to each content
+    are counted, and contents are dropped as soon as no file uses them.
+    As bytes objects are immutable, changing a file replaces its contents
+    with another (interned) object, so that other files are not affected.
+    """
+
+    def __init__(self):
+        # maps the contents to a list of the shared contents object
+        # and its reference count
+        self._contents = {}
+
+    def intern(self, contents):
+        """Add a reference to `contents` and return the shared object
+        with the same value."""
+        entry = self._contents.get(contents)
+        if entry is None:
+            entry = [contents, 0]
+            self._contents[contents] = entry
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, contents):
+        """Remove a reference to `contents`."""
+        entry = self._contents.get(contents)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._contents[contents]
+
+    def clear(self):
+        """Remove all contents."""
+        self._contents = {}
+
+    def stats(self):
+        """Return a dict with statistics about the stored contents:
+        the number of distinct contents (`blobs`) and of references to them
+        (`references`), their size in bytes as stored (`stored_size`) and as
+        seen by the files (`referenced_size`), and the resulting
+        deduplication ratio (`dedup_ratio`).
+        """
+        stored_size = 0
+        referenced_size = 0
+        references = 0
+        for contents, count in self._contents.values():
+            stored_size += len(contents)
+            referenced_size += len(contents) * count
+            references += count
+        return {
+            'blobs': len(self._contents),
+            'references': references,
+            'stored_size': stored_size,
+            'referenced_size': referenced_size,
+            'dedup_ratio': (float(referenced_size) / stored_size
+                            if stored_size else 1.0)
+        }
+
+
+class OperationStats(object):
+    """Collects the number of calls and the cumulative wall time of fake
+    file system operations, together with some internal counters.
+    Used by :py:meth:`pyfakefs.fake_filesystem.FakeFilesystem.enable_stats`.
+
+    The times of nested operations are included in the times of the
+    calling operations, for example a `stat` includes the time needed to
+    `resolve` the path.
+
+    Attributes:
+        counts: Maps the operation names to the number of calls.
+        times: Maps the operation names to the cumulative time in seconds.
+        tree_steps: The number of directory entries looked up while
+            walking the file system tree to resolve paths.
+        symlink_hops: The number of followed symbolic links.
+        cache_hits: The number of accesses to file contents held in memory
+            if a content pager (compression or memory budget) is used.
+        cache_misses: The number of accesses to paged out file contents.
+    """
+
+    OPERATIONS = ('stat', 'open', 'read', 'write', 'listdir', 'scandir',
+                  'rename', 'resolve')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Reset all statistics."""
+        self.counts = dict.fromkeys(self.OPERATIONS, 0)
+        self.times = dict.fromkeys(self.OPERATIONS, 0.0)
+        self.tree_steps = 0
+        self.symlink_hops = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def timed(self, operation, func):
+        """Return a function calling `func` that counts and times each call
+        as `operation`."""
+        def timed_func(*args, **kwargs):
+            start = default_timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.counts[operation] += 1
+                self.times[operation] += default_timer() - start
+
+        return timed_func
+
+    def as_dict(self):
+        """Return the statistics as a dict, with the count and time of
+        each operation under the operation name, and the other counters
+        under their attribute names."""
+        result = dict((operation, {'count': self.counts[operation],
+                                   'time': self.times[operation]})
+                      for operation in self.OPERATIONS)
+        result.update(tree_steps=self.tree_steps,
+                      symlink_hops=self.symlink_hops,
+                      cache_hits=self.cache_hits,
+                      cache_misses=self.cache_misses)
+        return result
+
+    def top(self, count=5):
+        """Return up to `count` `(operation, calls, time)` tuples for the
+        called operations with the highest cumulative time."""
+        operations = sorted((operation for operation in self.OPERATIONS
+                             if self.counts[operation]),
+                            key=lambda operation: -self.times[operation])
+        return [(operation, self.counts[operation], self.times[operation])
+                for operation in operations[:count]]
+
+    def report(self, count=5):
+        """Return a printable report of the `count` operations with the
+        highest cumulative time and of the other counters."""
+        lines = ['%-10s %8s %10s' % ('operation', 'calls', 'time (s)')]
+        for operation, calls, total_time in self.top(count):
+            lines.append('%-10s %8d %10.4f' % (operation, calls, total_time))
+        lines.append('tree steps: %d, symlink hops: %d, '
+                     'cache hits: %d, cache misses: %d' %
+                     (self.tree_steps, self.symlink_hops,
+                      self.cache_hits, self.cache_misses))
+        return '\n'.join(lines)
+
+
+class RealClock(object):
+    """The default clock of the fake file system, which returns the real
+    current time for file timestamps."""
+
+    def time(self):
+        """Return the current time in seconds since the epoch."""
+        # looked up on each call to respect patched versions of
+        # `time.time`, as used by freezegun or in tests
+        return time.time()
+
+
+class FrozenClock(object):
+    """A clock that always returns the same time.
+
+    Attributes:
+        timestamp: The returned time in seconds since the epoch.
+    """
+
+    def __init__(self, timestamp=None):
+        """
+        Args:
+            timestamp: The time to return in seconds since the epoch.
+                Defaults to the current time.
+        """
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def time(self):
+        """Return the frozen time."""
+        return self.timestamp
+
+
+class ManualClock(FrozenClock):
+    """A clock that only changes its time if advanced by the test."""
+
+    def advance(self, seconds):
+        """Advance the clock by the given number of seconds."""
+        self.timestamp += seconds
+
+    def set(self, timestamp):
+        """Set the clock to the given time in seconds since the epoch."""
+        self.timestamp = timestamp
+
+
+class CounterClock(object):
+    """A clock that advances by a fixed step each time it is read.
+    Timestamps are strictly increasing and reproducible, and no system
+    call is needed to get them.
+
+    Attributes:
+        timestamp: The time returned by the last call.
+        step: The amount by which the time is increased with each call.
+    """
+
+    def __init__(self, start=0.0, step=1.0):
+        """
+        Args:
+            start: The time in seconds since the epoch returned by the
+                first call.
+            step: The increment in seconds for each following call.
+        """
+        self.timestamp = start - step
+        self.step = step
+
+    def time(self):
+        """Advance the clock by one step and return the new time."""
+        self.timestamp += self.step
+        return self.timestamp
+
+
+class SparseContents(object):
+    """Contents of a sparse file. Only the written data is stored as a
+    sorted list of non-adjacent extents; all other bytes up to `size` are
+    holes that read as null bytes.
+    """
+
+    def __init__(self, contents=b'', size=None):
+        """
+        Args:
+            contents: The initial byte contents.
+            size: The size of the contents, if larger than `contents`.
+        """
+        self._offsets = []
+        self._extents = []
+        self.size = 0
+        self.write(0, contents)
+        if size is not None:
+            self.truncate(size)
+
+    def read(self, offset, size=-1):
+        """Return up to `size` bytes starting at `offset`, or all bytes
+        up to the end if `size` is negative."""
+        end = self.size if size < 0 else min(offset + size, self.size)
+        chunks = []
+        position = offset
+        index = max(bisect.bisect_right(self._offsets, offset) - 1, 0)
+        while index < len(self._offsets) and self._offsets[index] < end:
+            start = self._offsets[index]
+            extent = self._extents[index]
+            extent_end = start + len(extent)
+            if extent_end > position:
+                if start > position:
+                    chunks.append(b'\0' * (start - position))
+                    position = start
+                chunk_end = min(extent_end, end)
+                chunks.append(
+                    bytes(extent[position - start:chunk_end - start]))
+                position = chunk_end
+            index += 1
+        if position < end:
+            chunks.append(b'\0' * (end - position))
+        return b''.join(chunks)
+
+    def write(self, offset, data):
+        """Write `data` at `offset`, merging it with overlapping or
+        adjacent extents."""
+        if not data:
+            return
+        offsets = self._offsets
+        extents = self._extents
+        end = offset + len(data)
+        low = bisect.bisect_right(offsets, offset) - 1
+        if low < 0 or offsets[low] + len(extents[low]) < offset:
+            low += 1
+        high = bisect.bisect_right(offsets, end)
+        if low < high and offsets[low] <= offset:
+            start = offsets[low]
+            extent = extents[low]
+            extent[offset - start:end - start] = data
+            merged = low + 1
+        else:
+            start = offset
+            extent = bytearray(data)
+            merged = low
+        for index in range(merged, high):
+            extent += extents[index][end - offsets[index]:]
+        offsets[low:high] = [start]
+        extents[low:high] = [extent]
+        self.size = max(self.size, end)
+
+    def truncate(self, size):
+        """Change the size to `size`, dropping the data behind it
+        or adding a hole at the end."""
+        if size < self.size:
+            index = bisect.bisect_left(self._offsets, size)
+            del self._offsets[index:]
+            del self._extents[index:]
+            if self._extents:
+                del self._extents[-1][size - self._offsets[-1]:]
+        self.size = size
+
+    def data_offset(self, offset):
+        """Return the offset of the next data at or after `offset`,
+        or `None` if there is no more data."""
+        if offset >= self.size:
+            return None
+        index = bisect.bisect_right(self._offsets, offset) - 1
+        if (index >= 0 and
+                self._offsets[index] + len(self._extents[index]) > offset):
+            return offset
+        if index + 1 < len(self._offsets):
+            return self._offsets[index + 1]
+        return None
+
+    def hole_offset(self, offset):
+        """Return the offset of the next hole at or after `offset`, where
+        the end of the contents counts as a hole, or `None` if `offset`
+        is behind the end."""
+        if offset >= self.size:
+            return None
+        index = bisect.bisect_right(self._offsets, offset) - 1
+        if index >= 0:
+            extent_end = self._offsets[index] + len(self._extents[index])
+            if extent_end > offset:
+                return extent_end
+        return offset
+
+    def extents(self):
+        """Return a list of (offset, bytes) tuples for the stored data."""
+        return [(offset, bytes(extent))
+                for offset, extent in zip(self._offsets, self._extents)]
+
+    @property
+    def data_size(self):
+        """The number of stored data bytes."""
+        return sum(len(extent) for extent in self._extents)
+
+
+class SparseStream(io.RawIOBase):
+    """Binary stream that reads and writes sparse contents in place."""
+
+    def __init__(self, contents):
+        """
+        Args:
+            contents: The `SparseContents` object of the file.
+        """
+        super(SparseStream, self).__init__()
+        self._contents = contents
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        contents = self._contents.read(self._position, size)
+        self._position += len(contents)
+        return contents
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, buffer):
+        contents = self.read(len(buffer))
+        buffer[:len(contents)] = contents
+        return len(contents)
+
+    def write(self, data):
+        data = bytes(data)
+        self._contents.write(self._position, data)
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self._contents.size
+        if offset < 0:
+            raise ValueError('negative seek value %d' % offset)
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+    def truncate(self, size=None):
+        if size is None:
+            size = self._position
+        self._contents.truncate(size)
+        return size
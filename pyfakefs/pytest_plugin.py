@@ -32,10 +32,61 @@ Patcher.SKIPMODULES.add(linecache)
 linecache.open = builtins.open
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        '--fs-stats', action='store_true', default=False,
+        help='collect statistics of the fake file system operations in '
+             'tests using the fs fixture, and report the top consumers')
+    parser.addoption(
+        '--fs-memory', type=int, default=0, metavar='N',
+        help='report the memory used by the fake file system at the end of '
+             'tests using the fs fixture, with the N largest subtrees '
+             'and files')
+
+
+def pytest_configure(config):
+    config.fs_stats_reports = []
+    config.fs_memory_reports = []
+
+
 @pytest.fixture
 def fs(request):
     """ Fake filesystem. """
     patcher = Patcher()
     patcher.setUp()
     request.addfinalizer(patcher.tearDown)
+    config = request.config
+    if config.getoption('fs_stats'):
+        stats = patcher.fs.enable_stats()
+
+        def add_stats_report():
+            config.fs_stats_reports.append(
+                (request.node.nodeid, stats.report()))
+
+        request.addfinalizer(add_stats_report)
+    memory_count = config.getoption('fs_memory')
+    if memory_count:
+        def add_memory_report():
+            config.fs_memory_reports.append(
+                (request.node.nodeid,
+                 patcher.fs.memory_report().format(memory_count)))
+
+        request.addfinalizer(add_memory_report)
     return patcher.fs
+
+
+def _write_reports(terminalreporter, title, reports):
+    if reports:
+        terminalreporter.section(title)
+        for nodeid, report in reports:
+            terminalreporter.write_line(nodeid)
+            for line in report.splitlines():
+                terminalreporter.write_line('    ' + line)
+
+
+def pytest_terminal_summary(terminalreporter):
+    config = terminalreporter.config
+    _write_reports(terminalreporter, 'top fake-fs consumers',
+                   getattr(config, 'fs_stats_reports', None))
+    _write_reports(terminalreporter, 'fake-fs memory usage',
+                   getattr(config, 'fs_memory_reports', None))
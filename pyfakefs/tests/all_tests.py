@@ -20,6 +20,7 @@ import sys
 import unittest
 
 from pyfakefs.extra_packages import pathlib
+from pyfakefs.tests import benchmarks_test
 from pyfakefs.tests import dynamic_patch_test
 from pyfakefs.tests import fake_open_test
 from pyfakefs.tests import fake_os_test
@@ -30,7 +31,9 @@ from pyfakefs.tests import fake_filesystem_test
 from pyfakefs.tests import fake_filesystem_unittest_test
 from pyfakefs.tests import fake_tempfile_test
 from pyfakefs.tests import fake_filesystem_vs_real_test
+from pyfakefs.tests import fake_mmap_test
 from pyfakefs.tests import mox3_stubout_test
+from pyfakefs.tests import tracing_test
 
 if pathlib:
     from pyfakefs.tests import fake_pathlib_test
@@ -49,10 +52,13 @@ class AllTests(unittest.TestSuite):
             loader.loadTestsFromModule(fake_open_test),
             loader.loadTestsFromModule(fake_tempfile_test),
             loader.loadTestsFromModule(fake_filesystem_vs_real_test),
+            loader.loadTestsFromModule(fake_mmap_test),
             loader.loadTestsFromModule(fake_filesystem_unittest_test),
             loader.loadTestsFromModule(example_test),
             loader.loadTestsFromModule(mox3_stubout_test),
             loader.loadTestsFromModule(dynamic_patch_test),
+            loader.loadTestsFromModule(tracing_test),
+            loader.loadTestsFromModule(benchmarks_test),
         ])
         if pathlib:
             self.addTests([
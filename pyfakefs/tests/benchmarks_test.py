@@ -0,0 +1,113 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the benchmark runner."""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from pyfakefs.benchmarks import runner
+
+try:
+    from StringIO import StringIO  # Python 2
+except ImportError:
+    from io import StringIO
+
+
+def results(**values):
+    """Return benchmark results with the given (fake min, ratio) values
+    per benchmark name."""
+    benchmarks = {}
+    for name, (fake_min, ratio) in values.items():
+        benchmarks[name] = {
+            'fake': {'min': fake_min, 'mean': fake_min},
+            'real': None if ratio is None else {'min': fake_min / ratio,
+                                                'mean': fake_min / ratio},
+            'ratio': ratio
+        }
+    return {'environment': {}, 'benchmarks': benchmarks}
+
+
+class FindRegressionsTest(unittest.TestCase):
+    def test_ratios_are_compared(self):
+        baseline = results(foo=(1.0, 2.0), bar=(1.0, 2.0))
+        new_results = results(foo=(10.0, 2.4), bar=(1.0, 2.6))
+        self.assertEqual([('bar', 2.0, 2.6)],
+                         runner.find_regressions(new_results, baseline))
+
+    def test_times_are_compared_without_ratio(self):
+        baseline = results(foo=(1.0, 2.0), bar=(1.0, None))
+        new_results = results(foo=(1.3, None), bar=(1.2, None))
+        self.assertEqual([('foo', 1.0, 1.3)],
+                         runner.find_regressions(new_results, baseline))
+
+    def test_threshold(self):
+        baseline = results(foo=(1.0, None))
+        new_results = results(foo=(1.2, None))
+        self.assertEqual([], runner.find_regressions(new_results, baseline))
+        self.assertEqual([('foo', 1.0, 1.2)], runner.find_regressions(
+            new_results, baseline, threshold=1.1))
+
+    def test_new_benchmarks_are_ignored(self):
+        baseline = results(foo=(1.0, None))
+        new_results = results(foo=(1.0, None), bar=(100.0, None))
+        self.assertEqual([], runner.find_regressions(new_results, baseline))
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.json_path = os.path.join(self.temp_dir, 'results.json')
+        self.baseline_path = os.path.join(self.temp_dir, 'baseline.json')
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.temp_dir)
+
+    def run_main(self, *args):
+        return runner.main(['small_files', '--rounds', '1', '--no-real',
+                            '--json', self.json_path] + list(args))
+
+    def write_baseline(self, fake_min):
+        with open(self.baseline_path, 'w') as f:
+            json.dump(results(small_files=(fake_min, None)), f)
+
+    def test_json_output(self):
+        self.assertEqual(0, self.run_main())
+        with open(self.json_path) as f:
+            output = json.load(f)
+        self.assertEqual(['small_files'], list(output['benchmarks']))
+        self.assertEqual(1, output['environment']['rounds'])
+        self.assertIn('small_files', sys.stdout.getvalue())
+
+    def test_no_regression_against_baseline(self):
+        self.write_baseline(1000.0)
+        self.assertEqual(0, self.run_main('--baseline', self.baseline_path))
+        self.assertNotIn('REGRESSION', sys.stdout.getvalue())
+
+    def test_regression_against_baseline(self):
+        self.write_baseline(1e-9)
+        self.assertEqual(1, self.run_main('--baseline', self.baseline_path))
+        self.assertIn('REGRESSION small_files', sys.stdout.getvalue())
+
+    def test_unknown_benchmark(self):
+        self.assertRaises(ValueError, runner.run_benchmarks, ['unknown'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,13 +17,19 @@
 """Unittest for fake_filesystem module."""
 
 import errno
+import io
 import os
+import shutil
 import stat
 import sys
+import tarfile
+import tempfile
+import threading
 import time
 import unittest
+import zipfile
 
-from pyfakefs import fake_filesystem
+from pyfakefs import fake_filesystem, fake_scandir, helpers
 from pyfakefs.tests.test_utils import DummyTime, TestCase
 
 
@@ -1783,6 +1789,42 @@ class MountPointTest(TestCase):
         self.assertEqual(6, self.filesystem.get_object('e:!foo').st_dev)
         self.assertEqual(6, self.filesystem.get_object('E:!Foo!Baz').st_dev)
 
+    def test_mount_point_for_path_matches_whole_components(self):
+        self.filesystem.set_disk_usage(50, '!foo')
+        self.assertEqual(50, self.filesystem.get_disk_usage('!foo').total)
+        self.assertEqual(50,
+                         self.filesystem.get_disk_usage('!foo!bar').total)
+        self.assertEqual(100,
+                         self.filesystem.get_disk_usage('!foo1!bar').total)
+        self.assertEqual(100, self.filesystem.get_disk_usage('!').total)
+
+    def test_deepest_mount_point_is_used(self):
+        self.filesystem.set_disk_usage(50, '!foo!baz')
+        self.assertEqual(
+            50, self.filesystem.get_disk_usage('!foo!baz!bar').total)
+        self.assertNotEqual(
+            50, self.filesystem.get_disk_usage('!foo!bar').total)
+
+    def test_mount_point_for_path_case_insensitive(self):
+        self.filesystem.is_case_sensitive = False
+        self.filesystem.add_mount_point('!Tenant', total_size=20)
+        self.assertEqual(
+            20, self.filesystem.get_disk_usage('!tenant!data').total)
+
+    def test_disk_usage_is_counted_per_mount_point(self):
+        for i in range(100):
+            self.filesystem.add_mount_point('!tenants!%d' % i,
+                                            total_size=10)
+        self.filesystem.create_file('!tenants!42!data', contents='x' * 8)
+        self.assertEqual(
+            8, self.filesystem.get_disk_usage('!tenants!42').used)
+        self.assertEqual(
+            0, self.filesystem.get_disk_usage('!tenants!41').used)
+        self.assertEqual(0, self.filesystem.get_disk_usage().used)
+        self.assert_raises_io_error(
+            errno.ENOSPC, self.filesystem.create_file,
+            '!tenants!42!more', contents='x' * 3)
+
     @unittest.skipIf(sys.version_info < (2, 7, 8),
                      'UNC path support since Python 2.7.8')
     def test_that_unc_paths_are_auto_mounted(self):
@@ -1980,6 +2022,27 @@ class RealFileSystemAccessTest(TestCase):
         self.assertGreater(disk_size,
                            self.filesystem.get_disk_usage(real_dir_path).free)
 
+    def test_lazy_real_directory_reads_single_entries(self):
+        self.filesystem.is_case_sensitive = True
+        real_dir_path = os.path.join(self.root_path, 'pyfakefs')
+        self.filesystem.add_real_directory(real_dir_path)
+        fake_dir = self.filesystem.resolve(real_dir_path)
+        self.assertTrue(self.filesystem.exists(
+            os.path.join(real_dir_path, 'fake_filesystem.py')))
+        self.assertFalse(self.filesystem.exists(
+            os.path.join(real_dir_path, 'nonexisting')))
+        self.assertFalse(fake_dir.contents_read)
+        self.assertEqual(['fake_filesystem.py'], list(fake_dir.byte_contents))
+
+        self.filesystem.remove_object(
+            os.path.join(real_dir_path, 'fake_filesystem.py'))
+        self.filesystem.create_file(os.path.join(real_dir_path, 'nonexisting'))
+        entries = self.filesystem.listdir(real_dir_path)
+        self.assertTrue(fake_dir.contents_read)
+        self.assertNotIn('fake_filesystem.py', entries)
+        self.assertIn('nonexisting', entries)
+        self.assertIn('helpers.py', entries)
+
     def test_add_existing_real_directory_not_lazily(self):
         disk_size = 1024 * 1024 * 1024
         self.filesystem.set_disk_usage(disk_size, self.pyfakefs_path)
@@ -1990,6 +2053,33 @@ class RealFileSystemAccessTest(TestCase):
         self.assertGreater(disk_size, self.filesystem.get_disk_usage(
             self.pyfakefs_path).free)
 
+    def test_add_real_directory_tree_not_lazily(self):
+        real_dir = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(real_dir, 'sub', 'empty'))
+            for name in ('foo.txt', os.path.join('sub', 'bar.txt')):
+                with open(os.path.join(real_dir, name), 'w') as f:
+                    f.write('contents')
+            os.chmod(os.path.join(real_dir, 'sub'), 0o750)
+            if not self.is_windows:
+                os.symlink(os.path.join(real_dir, 'sub'),
+                           os.path.join(real_dir, 'dir_link'))
+            self.filesystem.add_real_directory(real_dir, lazy_read=False)
+            for name in ('foo.txt', os.path.join('sub', 'bar.txt')):
+                path = os.path.join(real_dir, name)
+                fake_file = self.filesystem.resolve(path)
+                self.check_fake_file_stat(fake_file, path)
+                self.check_read_only_file(fake_file, path)
+            self.assertTrue(self.filesystem.isdir(
+                os.path.join(real_dir, 'sub', 'empty')))
+            self.assertEqual(
+                os.stat(os.path.join(real_dir, 'sub')).st_mode,
+                self.filesystem.stat(os.path.join(real_dir, 'sub')).st_mode)
+            self.assertFalse(self.filesystem.exists(
+                os.path.join(real_dir, 'dir_link')))
+        finally:
+            shutil.rmtree(real_dir)
+
     def test_add_existing_real_directory_read_write(self):
         self.filesystem.add_real_directory(self.pyfakefs_path, read_only=False)
         self.assertTrue(self.filesystem.exists(self.pyfakefs_path))
@@ -2035,5 +2125,1438 @@ class RealFileSystemAccessTest(TestCase):
         self.check_writable_file(fake_file, real_file_path)
 
 
+class RealFileStreamTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem()
+        self.open = fake_filesystem.FakeFileOpen(self.filesystem, use_io=True)
+        self.real_dir = tempfile.mkdtemp()
+        self.real_path = os.path.join(self.real_dir, 'foo.txt')
+        with open(self.real_path, 'wb') as f:
+            f.write(b'line 1\r\nline 2\rline 3\nlonger line 4\r\n')
+        self.fake_file = self.filesystem.add_real_file(self.real_path)
+        self.chunk_size = helpers.FileBufferIO.LINE_CHUNK_SIZE
+        helpers.FileBufferIO.LINE_CHUNK_SIZE = 4
+
+    def tearDown(self):
+        helpers.FileBufferIO.LINE_CHUNK_SIZE = self.chunk_size
+        shutil.rmtree(self.real_dir)
+
+    def test_read_does_not_load_contents(self):
+        with self.open(self.real_path, 'rb') as f:
+            f.seek(8)
+            self.assertEqual(b'line 2', f.read(6))
+        self.assertFalse(self.fake_file.contents_read)
+
+    def test_readlines(self):
+        with self.open(self.real_path, newline=None) as f:
+            self.assertEqual(['line 1\n', 'line 2\n', 'line 3\n',
+                              'longer line 4\n'], f.readlines())
+        if not fake_filesystem.IS_PY2:
+            with self.open(self.real_path, newline='') as f:
+                self.assertEqual(['line 1\r\n', 'line 2\r', 'line 3\n',
+                                  'longer line 4\r\n'], list(f))
+        with self.open(self.real_path, 'rb') as f:
+            self.assertEqual(b'line 1\r\n', f.readline())
+            self.assertEqual(b'line 2\rline 3\n', f.readline())
+            self.assertEqual(b'longer', f.readline(6))
+        self.assertFalse(self.fake_file.contents_read)
+
+    def test_readline_multibyte_characters(self):
+        path = os.path.join(self.real_dir, 'utf8.txt')
+        with open(path, 'wb') as f:
+            f.write(b'abc\n\xc3\xa9\n')
+        self.filesystem.add_real_file(path)
+        with self.open(path, encoding='utf-8') as f:
+            self.assertEqual(u'abc\n', f.readline())
+            self.assertEqual(u'\xe9\n', f.readline())
+            self.assertEqual(u'', f.readline())
+
+    def test_read_after_change(self):
+        self.filesystem.is_read_only = False
+        with self.open(self.real_path, 'rb') as f:
+            self.assertEqual(b'line 1', f.read(6))
+            fake_file = self.filesystem.resolve(self.real_path)
+            fake_file.st_mode |= stat.S_IWUSR
+            with self.open(self.real_path, 'r+b') as f_write:
+                f_write.write(b'LINE 1\r\nLINE 2')
+            self.assertEqual(b'\r\nLINE 2', f.read(8))
+        with open(self.real_path, 'rb') as f:
+            self.assertEqual(b'line 1', f.read(6))
+
+
+class RealFileSystemCacheTest(TestCase):
+    def setUp(self):
+        self.real_dir = tempfile.mkdtemp()
+        self.real_file = os.path.join(self.real_dir, 'foo.txt')
+        self.write_real_file(b'foo')
+        fake_filesystem.real_fs_cache.enabled = True
+
+    def tearDown(self):
+        fake_filesystem.real_fs_cache.enabled = False
+        fake_filesystem.real_fs_cache.clear()
+        shutil.rmtree(self.real_dir)
+
+    def write_real_file(self, contents):
+        with open(self.real_file, 'wb') as f:
+            f.write(contents)
+
+    def filesystem_contents(self, lazy_read=True):
+        filesystem = fake_filesystem.FakeFilesystem()
+        filesystem.add_real_directory(self.real_dir, read_only=False,
+                                      lazy_read=lazy_read)
+        filesystem.listdir(self.real_dir)
+        return filesystem, filesystem.resolve(self.real_file).byte_contents
+
+    def test_real_contents_are_read_once(self):
+        filesystem1, contents1 = self.filesystem_contents()
+        self.write_real_file(b'changed')
+        os.mkdir(os.path.join(self.real_dir, 'bar'))
+        filesystem2, contents2 = self.filesystem_contents(lazy_read=False)
+        self.assertEqual(b'foo', contents1)
+        self.assertIs(contents1, contents2)
+        self.assertFalse(filesystem2.exists(
+            os.path.join(self.real_dir, 'bar')))
+
+    def test_changes_are_not_shared(self):
+        filesystem1, _ = self.filesystem_contents()
+        fake_open = fake_filesystem.FakeFileOpen(filesystem1)
+        with fake_open(self.real_file, 'ab') as f:
+            f.write(b'bar')
+        filesystem1.create_file(os.path.join(self.real_dir, 'baz'))
+        filesystem2, contents2 = self.filesystem_contents()
+        self.assertEqual(b'foobar',
+                         filesystem1.resolve(self.real_file).byte_contents)
+        self.assertEqual(b'foo', contents2)
+        self.assertFalse(filesystem2.exists(
+            os.path.join(self.real_dir, 'baz')))
+
+    def test_clear_cache(self):
+        self.filesystem_contents()
+        self.write_real_file(b'changed')
+        fake_filesystem.real_fs_cache.clear()
+        self.assertEqual(b'changed', self.filesystem_contents()[1])
+
+    def test_missing_files_are_cached(self):
+        cache = fake_filesystem.real_fs_cache
+        missing_path = os.path.join(self.real_dir, 'bar')
+        self.assert_raises_os_error(errno.ENOENT, cache.stat, missing_path)
+        self.write_real_file(b'changed')
+        os.mkdir(missing_path)
+        self.assert_raises_os_error(errno.ENOENT, cache.stat, missing_path)
+        self.assert_raises_os_error(errno.ENOTDIR, cache.stat,
+                                    os.path.join(self.real_file, 'bar'))
+
+    @unittest.skipIf(sys.platform == 'win32', 'POSIX specific')
+    def test_other_errors_are_not_cached(self):
+        cache = fake_filesystem.real_fs_cache
+        link_path = os.path.join(self.real_dir, 'link')
+        os.symlink(link_path, link_path)
+        self.assert_raises_os_error(errno.ELOOP, cache.stat, link_path)
+        os.remove(link_path)
+        os.symlink(self.real_file, link_path)
+        self.assertEqual(3, cache.stat(link_path).st_size)
+
+
+class OverlayMountTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem()
+        self.filesystem.is_case_sensitive = True
+        self.os = fake_filesystem.FakeOsModule(self.filesystem)
+        self.open = fake_filesystem.FakeFileOpen(self.filesystem)
+        self.real_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.real_dir, 'sub'))
+        for name in ('foo.txt', 'bar.txt', os.path.join('sub', 'baz.txt')):
+            with open(os.path.join(self.real_dir, name), 'w') as f:
+                f.write(name)
+        self.filesystem.add_overlay_mount(self.real_dir, '/overlay')
+
+    def tearDown(self):
+        shutil.rmtree(self.real_dir)
+
+    def real_contents(self, name):
+        with open(os.path.join(self.real_dir, name)) as f:
+            return f.read()
+
+    def test_read_real_file(self):
+        with self.open('/overlay/foo.txt') as f:
+            self.assertEqual('foo.txt', f.read())
+        overlay_dir = self.filesystem.resolve('/overlay')
+        self.assertFalse(overlay_dir.contents_read)
+        self.assertEqual(['foo.txt'], list(overlay_dir.byte_contents))
+
+    def test_overlay_is_mount_point(self):
+        self.assertNotEqual(self.os.stat('/').st_dev,
+                            self.os.stat('/overlay/sub/baz.txt').st_dev)
+        self.assertEqual(self.os.stat('/overlay').st_dev,
+                         self.os.stat('/overlay/sub/baz.txt').st_dev)
+        self.assert_raises_os_error(errno.EEXIST,
+                                    self.filesystem.add_overlay_mount,
+                                    self.real_dir, '/overlay')
+
+    def test_write_does_not_change_real_file(self):
+        with self.open('/overlay/foo.txt', 'a') as f:
+            f.write('-changed')
+        with self.open('/overlay/new.txt', 'w') as f:
+            f.write('new')
+        with self.open('/overlay/foo.txt') as f:
+            self.assertEqual('foo.txt-changed', f.read())
+        self.assertEqual('foo.txt', self.real_contents('foo.txt'))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.real_dir, 'new.txt')))
+        self.assertEqual(['bar.txt', 'foo.txt', 'new.txt', 'sub'],
+                         sorted(self.os.listdir('/overlay')))
+
+    def test_remove_and_rename(self):
+        self.os.remove('/overlay/foo.txt')
+        self.os.rename('/overlay/bar.txt', '/overlay/sub/bar.txt')
+        self.filesystem.remove_object('/overlay/sub/baz.txt')
+        self.assertEqual(['sub'], self.os.listdir('/overlay'))
+        self.assertEqual(['bar.txt'], self.os.listdir('/overlay/sub'))
+        self.assertEqual(['bar.txt', 'foo.txt', 'sub'],
+                         sorted(os.listdir(self.real_dir)))
+        self.assertEqual('bar.txt', self.real_contents('bar.txt'))
+
+    def test_remove_unread_directory(self):
+        self.filesystem.remove_object('/overlay/sub')
+        self.assertFalse(self.filesystem.exists('/overlay/sub'))
+        self.assertTrue(os.path.exists(os.path.join(self.real_dir, 'sub')))
+
+    def test_rename_out_of_overlay_raises(self):
+        self.assert_raises_os_error(errno.EXDEV, self.os.rename,
+                                    '/overlay/foo.txt', '/foo.txt')
+
+    def test_non_existing_source_raises(self):
+        self.assert_raises_os_error(
+            errno.ENOENT, self.filesystem.add_overlay_mount,
+            os.path.join(self.real_dir, 'nonexisting'), '/other')
+
+
+class ContentStoreTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        self.open = fake_filesystem.FakeFileOpen(self.filesystem)
+        self.filesystem.create_file('/foo/existing', contents=b'license')
+        self.store = self.filesystem.enable_content_store()
+
+    def contents(self, path):
+        return self.filesystem.get_object(path).byte_contents
+
+    def test_identical_contents_are_shared(self):
+        for i in range(5):
+            self.filesystem.create_file('/foo/file%d' % i,
+                                        contents=b'license')
+        self.filesystem.create_file('/foo/other', contents=b'other')
+        self.assertIs(self.contents('/foo/existing'),
+                      self.contents('/foo/file4'))
+        stats = self.store.stats()
+        self.assertEqual(2, stats['blobs'])
+        self.assertEqual(7, stats['references'])
+        self.assertEqual(12, stats['stored_size'])
+        self.assertEqual(47, stats['referenced_size'])
+        self.assertAlmostEqual(47 / 12.0, stats['dedup_ratio'])
+
+    def test_change_does_not_affect_other_files(self):
+        self.filesystem.create_file('/foo/bar', contents=b'license')
+        with self.open('/foo/bar', 'ab') as f:
+            f.write(b' changed')
+        self.assertEqual(b'license', self.contents('/foo/existing'))
+        self.assertEqual(b'license changed', self.contents('/foo/bar'))
+        self.assertEqual(2, self.store.stats()['blobs'])
+        with self.open('/foo/bar', 'wb') as f:
+            f.write(b'license')
+        self.assertIs(self.contents('/foo/existing'),
+                      self.contents('/foo/bar'))
+        self.assertEqual(1, self.store.stats()['blobs'])
+
+    def test_removed_contents_are_released(self):
+        self.filesystem.create_file('/foo/bar', contents=b'bar')
+        self.filesystem.link('/foo/bar', '/foo/baz')
+        self.filesystem.remove_object('/foo/bar')
+        self.assertEqual(2, self.store.stats()['blobs'])
+        self.filesystem.remove_object('/foo')
+        self.assertEqual(0, self.store.stats()['blobs'])
+        self.assertEqual(1.0, self.store.stats()['dedup_ratio'])
+
+    def test_renamed_contents_stay_shared(self):
+        self.filesystem.create_file('/foo/bar', contents=b'license')
+        self.filesystem.rename('/foo/bar', '/foo/baz')
+        self.assertEqual(2, self.store.stats()['references'])
+        self.filesystem.remove_object('/foo/existing')
+        self.assertEqual(1, self.store.stats()['blobs'])
+        self.assertEqual(b'license', self.contents('/foo/baz'))
+        self.filesystem.remove_object('/foo/baz')
+        self.assertEqual(0, self.store.stats()['blobs'])
+
+
+class CompressionTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        self.open = fake_filesystem.FakeFileOpen(self.filesystem)
+        self.filesystem.create_file('/foo/existing', contents=b'x' * 1000)
+        self.filesystem.create_file('/foo/small', contents=b'y' * 10)
+        self.filesystem.enable_compression(min_size=100, max_uncompressed=1)
+
+    def is_compressed(self, path):
+        return isinstance(self.filesystem.get_object(path)._byte_contents,
+                          fake_filesystem._PagedOutContents)
+
+    def test_least_recently_used_files_are_compressed(self):
+        self.assertFalse(self.is_compressed('/foo/existing'))
+        self.filesystem.create_file('/foo/bar', contents=b'bar' * 100)
+        self.assertTrue(self.is_compressed('/foo/existing'))
+        self.assertFalse(self.is_compressed('/foo/bar'))
+        self.assertFalse(self.is_compressed('/foo/small'))
+        self.assertLess(len(self.filesystem.get_object(
+            '/foo/existing')._byte_contents.data), 100)
+
+        with self.open('/foo/existing', 'rb') as f:
+            self.assertEqual(b'x' * 1000, f.read())
+        self.assertFalse(self.is_compressed('/foo/existing'))
+        self.assertTrue(self.is_compressed('/foo/bar'))
+        self.assertEqual(1000, self.filesystem.stat('/foo/existing').st_size)
+
+    def test_open_files_are_not_compressed(self):
+        with self.open('/foo/existing', 'ab') as f:
+            self.filesystem.create_file('/foo/bar', contents=b'bar' * 100)
+            f.write(b'z')
+            f.flush()
+            self.filesystem.create_file('/foo/baz', contents=b'baz' * 100)
+            self.assertFalse(self.is_compressed('/foo/existing'))
+            self.assertTrue(self.is_compressed('/foo/bar'))
+        self.filesystem.get_object('/foo/bar').byte_contents
+        self.assertTrue(self.is_compressed('/foo/existing'))
+        file_object = self.filesystem.get_object('/foo/existing')
+        self.assertEqual(b'x' * 1000 + b'z', file_object.byte_contents)
+
+    def test_truncate_compressed_file(self):
+        self.filesystem.create_file('/foo/bar', contents=b'bar' * 100)
+        with self.open('/foo/existing', 'r+b') as f:
+            f.truncate(10)
+        file_object = self.filesystem.get_object('/foo/existing')
+        self.assertEqual(b'x' * 10, file_object.byte_contents)
+
+    def test_no_uncompressed_files(self):
+        self.filesystem.enable_compression(min_size=10, max_uncompressed=0)
+        self.filesystem.create_file('/foo/bar', contents=b'bar' * 100)
+        self.assertTrue(self.is_compressed('/foo/existing'))
+        with self.open('/foo/existing', 'w'):
+            pass
+        file_object = self.filesystem.get_object('/foo/existing')
+        self.assertEqual(b'', file_object.byte_contents)
+        file_object.set_contents(b'abc')
+        self.assertEqual(b'abc', file_object.byte_contents)
+        file_object.size = 20
+        self.assertEqual(b'abc' + b'\0' * 17, file_object.byte_contents)
+        self.assertTrue(self.is_compressed('/foo/bar'))
+
+    def test_invalid_method_raises(self):
+        self.assertRaises(ValueError, self.filesystem.enable_compression,
+                          method='invalid')
+
+
+class MemoryBudgetTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem(
+            path_separator='/', total_size=10000, memory_budget=250)
+        self.open = fake_filesystem.FakeFileOpen(self.filesystem)
+        self.filesystem.create_dir('/foo')
+        self.spiller = self.filesystem.content_pager
+
+    def is_spilled(self, path):
+        return isinstance(self.filesystem.get_object(path)._byte_contents,
+                          fake_filesystem._PagedOutContents)
+
+    def test_least_recently_used_files_are_spilled(self):
+        for i in range(3):
+            self.filesystem.create_file('/foo/bar%d' % i,
+                                        contents=str(i) * 100)
+        self.assertTrue(self.is_spilled('/foo/bar0'))
+        self.assertFalse(self.is_spilled('/foo/bar1'))
+        self.assertEqual(200, self.spiller.memory_size)
+        self.assertEqual(300, self.filesystem.get_disk_usage().used)
+
+        with self.open('/foo/bar0') as f:
+            self.assertEqual('0' * 100, f.read())
+        self.assertFalse(self.is_spilled('/foo/bar0'))
+        self.assertTrue(self.is_spilled('/foo/bar1'))
+        self.assertEqual('1' * 100,
+                         self.filesystem.get_object('/foo/bar1').contents)
+        self.assertEqual(300, self.filesystem.get_disk_usage().used)
+
+    def test_spill_file_space_is_reused(self):
+        self.filesystem.create_file('/foo/bar', contents='a' * 200)
+        self.filesystem.create_file('/foo/baz', contents='b' * 200)
+        self.filesystem.create_file('/foo/baz2', contents='c' * 100)
+        self.filesystem.remove_object('/foo/bar')
+        self.filesystem.get_object('/foo/baz').contents
+        self.filesystem.create_file('/foo/new', contents='d' * 150)
+        self.assertTrue(self.is_spilled('/foo/baz2'))
+        self.assertTrue(self.is_spilled('/foo/baz'))
+        # the spill file has not grown
+        self.assertEqual(400, self.spiller._spill_size)
+        self.assertEqual('c' * 100,
+                         self.filesystem.get_object('/foo/baz2').contents)
+
+    def test_written_file_is_spilled_after_close(self):
+        with self.open('/foo/bar', 'w') as f:
+            f.write('a' * 300)
+            f.flush()
+            self.filesystem.create_file('/foo/baz', contents='b' * 10)
+            self.assertFalse(self.is_spilled('/foo/bar'))
+        self.filesystem.create_file('/foo/baz2', contents='c' * 10)
+        self.assertTrue(self.is_spilled('/foo/bar'))
+        self.assertEqual('a' * 300,
+                         self.filesystem.get_object('/foo/bar').contents)
+
+    def test_rename_spilled_file(self):
+        self.filesystem.create_file('/foo/bar', contents='a' * 200)
+        self.filesystem.create_file('/foo/baz', contents='b' * 200)
+        self.assertTrue(self.is_spilled('/foo/bar'))
+        self.filesystem.rename('/foo/bar', '/foo/moved')
+        self.assertTrue(self.is_spilled('/foo/moved'))
+        self.filesystem.create_file('/foo/new', contents='c' * 200)
+        self.assertTrue(self.is_spilled('/foo/baz'))
+        self.assertEqual('a' * 200,
+                         self.filesystem.get_object('/foo/moved').contents)
+        self.assertEqual('b' * 200,
+                         self.filesystem.get_object('/foo/baz').contents)
+
+    def test_change_file_larger_than_budget(self):
+        file_object = self.filesystem.create_file('/foo/bar',
+                                                  contents=b'x' * 300)
+        self.filesystem.create_file('/foo/baz', contents=b'y' * 10)
+        self.assertTrue(self.is_spilled('/foo/bar'))
+        file_object.size = 20
+        self.assertEqual(b'x' * 20, file_object.byte_contents)
+
+        file_object.set_contents(b'z' * 300)
+        self.filesystem.create_file('/foo/baz2', contents=b'y' * 10)
+        self.assertTrue(self.is_spilled('/foo/bar'))
+        file_object.set_contents(b'abc')
+        self.assertEqual(b'abc', file_object.byte_contents)
+
+        file_object.set_contents(b'z' * 300)
+        self.filesystem.create_file('/foo/baz3', contents=b'y' * 10)
+        self.assertTrue(self.is_spilled('/foo/bar'))
+        self.open('/foo/bar', 'w').close()
+        self.assertEqual(b'', file_object.byte_contents)
+
+    def test_truncated_spill_file(self):
+        self.filesystem.create_file('/foo/bar', contents='a' * 200)
+        self.filesystem.create_file('/foo/baz', contents='b' * 200)
+        self.assertTrue(self.is_spilled('/foo/bar'))
+        os.ftruncate(self.spiller._spill_fd, 100)
+        self.assertRaises(IOError, getattr,
+                          self.filesystem.get_object('/foo/bar'), 'contents')
+
+
+class SparseFileTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        self.open = fake_filesystem.FakeFileOpen(self.filesystem)
+        self.filesystem.create_dir('/foo')
+        self.size = 100 * 1024 ** 3
+
+    def stored_size(self, path):
+        return self.filesystem.get_object(path)._byte_contents.data_size
+
+    def test_read_and_write_large_file(self):
+        self.filesystem.create_file('/foo/bar', st_size=self.size)
+        with self.open('/foo/bar', 'r+b') as f:
+            self.assertEqual(b'\0' * 10, f.read(10))
+            f.seek(self.size // 2)
+            f.write(b'data')
+            f.seek(self.size // 2 - 2)
+            self.assertEqual(b'\0\0data\0\0', f.read(8))
+        file_object = self.filesystem.get_object('/foo/bar')
+        self.assertTrue(file_object.is_large_file())
+        self.assertIsNone(file_object.contents)
+        self.assertEqual(self.size, file_object.st_size)
+        self.assertEqual(4, self.stored_size('/foo/bar'))
+
+    def test_write_after_end_of_large_file(self):
+        self.filesystem.create_file('/foo/bar', st_size=self.size)
+        with self.open('/foo/bar', 'ab') as f:
+            f.write(b'data')
+        self.assertEqual(self.size + 4,
+                         self.filesystem.stat('/foo/bar').st_size)
+        with self.open('/foo/bar', 'rb') as f:
+            f.seek(-6, os.SEEK_END)
+            self.assertEqual(b'\0\0data', f.read())
+
+    def test_seek_past_end_makes_file_sparse(self):
+        with self.open('/foo/bar', 'wb') as f:
+            f.write(b'abc')
+            f.seek(self.size)
+            f.write(b'def')
+        self.assertEqual(self.size + 3,
+                         self.filesystem.stat('/foo/bar').st_size)
+        self.assertEqual(6, self.stored_size('/foo/bar'))
+        with self.open('/foo/bar', 'rb') as f:
+            self.assertEqual(b'abc\0', f.read(4))
+
+    def test_small_gap_is_filled(self):
+        with self.open('/foo/bar', 'wb') as f:
+            f.write(b'abc')
+            f.seek(10)
+            f.write(b'def')
+        file_object = self.filesystem.get_object('/foo/bar')
+        self.assertFalse(file_object.is_large_file())
+        self.assertEqual(b'abc' + b'\0' * 7 + b'def',
+                         file_object.byte_contents)
+
+    def test_truncate_makes_file_sparse(self):
+        with self.open('/foo/bar', 'w') as f:
+            f.write('abc')
+            f.truncate(self.size)
+            f.seek(0, os.SEEK_END)
+            f.write('def')
+        self.assertEqual(self.size + 3,
+                         self.filesystem.stat('/foo/bar').st_size)
+        self.assertEqual(6, self.stored_size('/foo/bar'))
+        with self.open('/foo/bar') as f:
+            self.assertEqual('abc\0\0', f.read(5))
+        with self.open('/foo/bar', 'r+') as f:
+            f.truncate(2)
+        self.assertEqual(2, self.filesystem.stat('/foo/bar').st_size)
+        self.assertEqual(2, self.stored_size('/foo/bar'))
+
+    def test_resize_makes_file_sparse(self):
+        file_object = self.filesystem.create_file('/foo/bar', contents='abc')
+        file_object.size = self.size
+        self.assertTrue(file_object.is_large_file())
+        self.assertEqual(3, self.stored_size('/foo/bar'))
+
+    def test_seek_data_and_hole(self):
+        self.filesystem.create_file('/foo/bar', st_size=self.size)
+        with self.open('/foo/bar', 'r+b') as f:
+            f.seek(1000)
+            f.write(b'data')
+            f.seek(0, fake_filesystem.SEEK_DATA)
+            self.assertEqual(1000, f.tell())
+            f.seek(1002, fake_filesystem.SEEK_DATA)
+            self.assertEqual(1002, f.tell())
+            f.seek(1000, fake_filesystem.SEEK_HOLE)
+            self.assertEqual(1004, f.tell())
+            f.seek(0, fake_filesystem.SEEK_HOLE)
+            self.assertEqual(0, f.tell())
+            self.assertRaises(OSError, f.seek, 1004,
+                              fake_filesystem.SEEK_DATA)
+            self.assertRaises(OSError, f.seek, self.size,
+                              fake_filesystem.SEEK_HOLE)
+
+    def test_seek_data_and_hole_in_regular_file(self):
+        self.filesystem.create_file('/foo/bar', contents='abc')
+        with self.open('/foo/bar', 'rb') as f:
+            f.seek(1, fake_filesystem.SEEK_DATA)
+            self.assertEqual(1, f.tell())
+            f.seek(1, fake_filesystem.SEEK_HOLE)
+            self.assertEqual(3, f.tell())
+            self.assertRaises(OSError, f.seek, 3,
+                              fake_filesystem.SEEK_DATA)
+
+    def test_disk_usage_is_checked(self):
+        filesystem = fake_filesystem.FakeFilesystem(path_separator='/',
+                                                    total_size=100)
+        filesystem.create_file('/foo/bar', st_size=90)
+        with fake_filesystem.FakeFileOpen(filesystem)('/foo/bar', 'ab') as f:
+            f.write(b'a' * 20)
+            self.assertRaises(IOError, f.flush)
+        self.assertEqual(90, filesystem.stat('/foo/bar').st_size)
+        self.assertEqual(90, filesystem.get_disk_usage().used)
+
+
+class OperationStatsTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        self.os = fake_filesystem.FakeOsModule(self.filesystem)
+        self.open = fake_filesystem.FakeFileOpen(self.filesystem)
+        self.filesystem.create_file('/foo/bar/baz', contents=b'test')
+        self.filesystem.create_symlink('/foo/link', '/foo/bar')
+
+    def test_no_stats_by_default(self):
+        self.assertIsNone(self.filesystem.stats())
+        self.assertNotIn('stat', self.filesystem.__dict__)
+        self.assertIsNone(self.filesystem.disable_stats())
+
+    def test_operations_are_counted(self):
+        stats = self.filesystem.enable_stats()
+        self.assertIs(stats, self.filesystem.enable_stats())
+        self.os.stat('/foo/bar/baz')
+        self.os.listdir('/foo')
+        with self.open('/foo/bar/baz', 'rb') as f:
+            f.read()
+        with self.open('/foo/new', 'w') as f:
+            f.write('new')
+            f.write('contents')
+        self.os.rename('/foo/new', '/foo/renamed')
+        self.assertRaises(OSError, self.os.stat, '/foo/missing')
+        result = self.filesystem.stats()
+        self.assertEqual(2, result['stat']['count'])
+        self.assertEqual(1, result['listdir']['count'])
+        self.assertEqual(2, result['open']['count'])
+        self.assertEqual(1, result['read']['count'])
+        self.assertEqual(2, result['write']['count'])
+        self.assertEqual(1, result['rename']['count'])
+        self.assertGreater(result['resolve']['count'], 0)
+        self.assertGreater(result['tree_steps'], 0)
+        self.assertGreaterEqual(result['stat']['time'], 0)
+        self.assertEqual(0, result['symlink_hops'])
+
+        self.assertIs(stats, self.filesystem.disable_stats())
+        self.assertIsNone(self.filesystem.stats())
+        self.os.stat('/foo/bar/baz')
+        self.assertEqual(2, stats.counts['stat'])
+
+    def test_symlink_hops(self):
+        with self.filesystem.collect_stats() as stats:
+            self.os.stat('/foo/link/baz')
+        self.assertEqual(1, stats.symlink_hops)
+        self.assertEqual(1, stats.counts['stat'])
+        self.assertIsNone(self.filesystem.stats())
+
+    def test_collect_stats_restores_enabled_stats(self):
+        stats = self.filesystem.enable_stats()
+        with self.filesystem.collect_stats() as inner_stats:
+            self.os.stat('/foo/bar/baz')
+        self.os.stat('/foo/bar/baz')
+        self.assertEqual(1, inner_stats.counts['stat'])
+        self.assertEqual(1, stats.counts['stat'])
+        self.assertIs(stats, self.filesystem.disable_stats())
+
+    def test_content_pager_cache_hits(self):
+        self.filesystem.create_file('/foo/large1', contents=b'x' * 1000)
+        self.filesystem.create_file('/foo/large2', contents=b'y' * 1000)
+        self.filesystem.enable_compression(min_size=100, max_uncompressed=1)
+        with self.filesystem.collect_stats() as stats:
+            self.filesystem.get_object('/foo/large1').byte_contents
+            self.filesystem.get_object('/foo/large1').byte_contents
+        self.assertEqual(1, stats.cache_misses)
+        self.assertEqual(1, stats.cache_hits)
+
+    def test_report(self):
+        with self.filesystem.collect_stats() as stats:
+            for _ in range(3):
+                self.os.stat('/foo/bar/baz')
+        top = stats.top(2)
+        self.assertEqual(2, len(top))
+        self.assertIn('stat', [operation for operation, _, _ in top])
+        self.assertIn(('stat', 3), [entry[:2] for entry in top])
+        report = stats.report()
+        self.assertIn('stat', report)
+        self.assertIn('symlink hops: 0', report)
+
+
+class MemoryReportTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        self.open = fake_filesystem.FakeFileOpen(self.filesystem)
+        self.filesystem.create_file('/foo/bar/large', contents=b'x' * 100000)
+        self.filesystem.create_file('/foo/small', contents=b'y')
+        self.filesystem.create_file('/baz/medium', contents=b'z' * 1000)
+
+    def test_totals(self):
+        report = self.filesystem.memory_report()
+        self.assertGreater(report.totals['contents'], 101000)
+        self.assertLess(report.totals['contents'], 102000)
+        self.assertGreater(report.totals['nodes'], 0)
+        self.assertGreater(report.totals['stat'], 0)
+        self.assertGreater(report.totals['xattr'], 0)
+        self.assertEqual(0, report.totals['buffers'])
+        self.assertEqual(sum(report.totals.values()), report.total)
+        self.assertEqual(report.total, report.subtrees['/'])
+
+    def test_largest_subtrees_and_files(self):
+        report = self.filesystem.memory_report()
+        self.assertEqual(['/', '/foo', '/foo/bar'],
+                         [path for path, _ in report.largest_subtrees(3)])
+        self.assertEqual(['/foo/bar/large', '/baz/medium'],
+                         [path for path, _ in report.largest_files(2)])
+        self.assertGreater(report.subtrees['/foo'],
+                           report.subtrees['/foo/bar'] +
+                           report.files['/foo/small'])
+
+    def test_subtree(self):
+        report = self.filesystem.memory_report('/foo/bar')
+        self.assertEqual(['/foo/bar'], list(report.subtrees))
+        self.assertEqual(['/foo/bar/large'], list(report.files))
+        self.assertRaises(OSError, self.filesystem.memory_report,
+                          '/foo/small')
+
+    def test_open_buffers_are_counted(self):
+        with self.open('/foo/bar/large', 'rb'):
+            report = self.filesystem.memory_report()
+        self.assertGreater(report.totals['buffers'], 100000)
+        self.assertGreater(report.files['/foo/bar/large'], 200000)
+
+    def test_shared_contents_are_counted_once(self):
+        self.filesystem.enable_content_store()
+        self.filesystem.create_file('/foo/copy', contents=b'x' * 100000)
+        report = self.filesystem.memory_report()
+        self.assertLess(report.totals['contents'], 102000)
+
+    def test_format(self):
+        text = self.filesystem.memory_report().format(2)
+        self.assertIn('contents: ', text)
+        self.assertIn('/foo/bar/large', text)
+        self.assertNotIn('/foo/small', text)
+
+
+class DeviceProfileTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        self.os = fake_filesystem.FakeOsModule(self.filesystem)
+        self.open = fake_filesystem.FakeFileOpen(self.filesystem)
+        self.profile = fake_filesystem.DeviceProfile(
+            latency=0.01, read_bandwidth=1000, write_bandwidth=500,
+            fsync_latency=1)
+        self.filesystem.add_mount_point('/slow', profile=self.profile)
+        self.filesystem.create_file('/slow/data', contents=b'x' * 1000)
+        self.filesystem.create_file('/fast/data', contents=b'x' * 1000)
+
+    def test_cost(self):
+        self.assertAlmostEqual(0.01, self.profile.cost('metadata'))
+        self.assertAlmostEqual(1.01, self.profile.cost('read', 1000))
+        self.assertAlmostEqual(2.01, self.profile.cost('write', 1000))
+        self.assertAlmostEqual(1.01, self.profile.cost('fsync'))
+        profile = fake_filesystem.DeviceProfile(latency=0.001, iops=100)
+        self.assertAlmostEqual(0.01, profile.cost('read', 1000))
+
+    def test_no_io_time_without_profile(self):
+        with self.open('/fast/data', 'rb') as f:
+            f.read()
+        self.os.stat('/fast/data')
+        self.assertEqual(0, self.filesystem.io_time)
+
+    def test_metadata_operations(self):
+        self.os.stat('/slow/data')
+        self.os.listdir('/slow')
+        self.os.mkdir('/slow/dir')
+        self.os.rename('/slow/data', '/slow/renamed')
+        self.os.remove('/slow/renamed')
+        self.assertAlmostEqual(0.05, self.filesystem.io_time)
+
+    def test_read_and_write(self):
+        with self.open('/slow/data', 'rb') as f:
+            self.assertAlmostEqual(0.01, self.filesystem.io_time)
+            f.read(500)
+            self.assertAlmostEqual(0.52, self.filesystem.io_time)
+            f.read()
+            self.assertAlmostEqual(1.03, self.filesystem.io_time)
+        self.filesystem.io_time = 0
+        with self.open('/slow/new', 'w') as f:
+            f.write('x' * 500)
+            self.assertAlmostEqual(1.02, self.filesystem.io_time)
+
+    @unittest.skipIf(sys.version_info < (3, ), 'Python 3 specific')
+    def test_readinto(self):
+        stats = self.filesystem.enable_stats()
+        with self.open('/slow/data', 'rb') as f:
+            self.assertEqual(500, f.readinto(bytearray(500)))
+            self.assertAlmostEqual(0.52, self.filesystem.io_time)
+            f.read1(100)
+            self.assertAlmostEqual(0.63, self.filesystem.io_time)
+        self.assertEqual(2, stats.counts['read'])
+
+    def test_fsync(self):
+        fd = self.os.open('/slow/data', os.O_RDWR)
+        self.os.fsync(fd)
+        self.os.close(fd)
+        self.assertAlmostEqual(1.02, self.filesystem.io_time)
+
+    @unittest.skipIf(sys.version_info < (3, 3), 'New in Python 3.3')
+    def test_positional_read_and_write(self):
+        fd = self.os.open('/slow/data', os.O_RDWR)
+        self.os.pread(fd, 100, 0)
+        self.os.pwrite(fd, b'y' * 100, 0)
+        self.os.close(fd)
+        self.assertAlmostEqual(0.33, self.filesystem.io_time)
+
+    def test_set_device_profile(self):
+        self.filesystem.set_device_profile('/fast/data', self.profile)
+        self.os.stat('/fast/data')
+        self.assertAlmostEqual(0.01, self.filesystem.io_time)
+        self.filesystem.set_device_profile('/slow', None)
+        self.os.stat('/slow/data')
+        self.assertAlmostEqual(0.01, self.filesystem.io_time)
+
+    def test_sleep(self):
+        self.profile.sleep = True
+        start = time.time()
+        self.os.stat('/slow/data')
+        self.assertGreaterEqual(time.time() - start, 0.009)
+
+
+class FileDescriptorTableTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        self.open = fake_filesystem.FakeFileOpen(self.filesystem,
+                                                 use_io=True)
+        self.table = self.filesystem.open_files
+        self.filesystem.create_file('/foo', contents='foo')
+
+    def test_standard_streams(self):
+        self.assertEqual(3, len(self.table))
+        self.assertEqual(sys.stdout,
+                         self.filesystem.get_open_file(1).get_object())
+
+    def test_lowest_free_descriptor_is_used(self):
+        files = [self.open('/foo') for _ in range(3)]
+        self.assertEqual([3, 4, 5], [f.fileno() for f in files])
+        files[1].close()
+        files[0].close()
+        self.assertIsNone(self.table[3])
+        self.assertEqual(3, self.open('/foo').fileno())
+        self.assertEqual(4, self.open('/foo').fileno())
+        self.assertEqual(6, self.open('/foo').fileno())
+
+    def test_list_compatibility(self):
+        f = self.open('/foo')
+        self.open('/foo').close()
+        entries = list(self.table)
+        self.assertEqual(5, len(entries))
+        self.assertEqual([f], entries[3])
+        self.assertIsNone(entries[4])
+        self.assertEqual([f], self.table[-2])
+        self.assertRaises(IndexError, self.table.__getitem__, 5)
+
+    def test_dup_to_higher_descriptor(self):
+        fd = self.open('/foo').fileno()
+        self.assertEqual(10, self.table.dup(fd, 10))
+        self.assertEqual(11, len(self.table))
+        self.assertEqual(4, self.table.dup(fd))
+        self.assertEqual(5, self.open('/foo').fileno())
+
+    def test_close_shared_descriptor(self):
+        file_object = self.open('/foo')
+        fd = file_object.fileno()
+        fd2 = self.table.dup(fd)
+        self.assertTrue(self.table.is_shared(fd))
+        self.table.close(fd)
+        self.assertTrue(self.table.is_open(file_object))
+        self.assertEqual(fd, file_object.fileno())
+        self.assertFalse(self.table.refers_to(fd, file_object))
+        self.assertTrue(self.table.refers_to(fd2, file_object))
+        self.assertFalse(self.table.is_shared(fd2))
+        self.assertRaises(IOError, file_object.close)
+        self.assertTrue(self.table.is_open(file_object))
+        self.table.close(fd2)
+        self.assertFalse(self.table.is_open(file_object))
+        self.assertNotIn(fd2, self.table)
+
+    def test_open_files_of_object(self):
+        file_object = self.filesystem.get_object('/foo')
+        self.assertFalse(self.filesystem.has_open_file(file_object))
+        with self.open('/foo') as f1:
+            with self.open(f1.fileno(), closefd=False) as f2:
+                self.assertEqual([f1, f2],
+                                 self.table.open_files(file_object))
+            self.assertEqual([f1], self.table.open_files(file_object))
+            self.assertTrue(self.filesystem.has_open_file(file_object))
+        self.assertFalse(self.filesystem.has_open_file(file_object))
+        self.assertEqual(3, len(self.table.open_files()))
+
+
+class StatSnapshotTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        self.os = fake_filesystem.FakeOsModule(self.filesystem)
+        self.file_object = self.filesystem.create_file(
+            '/foo/bar', contents='test')
+
+    def tearDown(self):
+        fake_filesystem.FakeOsModule.stat_float_times(True)
+
+    def test_stat_returns_os_stat_result(self):
+        stat_result = self.os.stat('/foo/bar')
+        self.assertIsInstance(stat_result, os.stat_result)
+        self.assertEqual(4, stat_result.st_size)
+        self.assertEqual(self.file_object.st_mtime, stat_result.st_mtime)
+        self.assertEqual(int(self.file_object.st_mtime),
+                         stat_result[stat.ST_MTIME])
+        self.assertRaises((AttributeError, TypeError), setattr, stat_result,
+                          'st_size', 10)
+
+    def test_repeated_stat_returns_cached_result(self):
+        stat_result = self.os.stat('/foo/bar')
+        self.assertIs(stat_result, self.os.stat('/foo/bar'))
+        self.assertIs(stat_result, self.os.lstat('/foo/bar'))
+
+    def test_change_invalidates_cached_result(self):
+        stat_result = self.os.stat('/foo/bar')
+        self.os.chmod('/foo/bar', 0o600)
+        self.assertIsNot(stat_result, self.os.stat('/foo/bar'))
+        self.assertEqual(0o600, stat.S_IMODE(self.os.stat('/foo/bar').st_mode))
+        self.os.utime('/foo/bar', (100, 200))
+        self.assertEqual(200, self.os.stat('/foo/bar').st_mtime)
+        self.file_object.set_contents('changed contents')
+        self.assertEqual(16, self.os.stat('/foo/bar').st_size)
+        # the old result does not change
+        self.assertEqual(4, stat_result.st_size)
+
+    def test_direct_change_invalidates_cached_result(self):
+        self.os.stat('/foo/bar')
+        self.file_object.stat_result.st_mode = stat.S_IFREG | 0o600
+        self.assertEqual(stat.S_IFREG | 0o600,
+                         self.os.stat('/foo/bar').st_mode)
+        self.file_object.stat_result.st_nlink = 3
+        self.assertEqual(3, self.os.stat('/foo/bar').st_nlink)
+
+    def test_float_times_change_invalidates_cached_result(self):
+        self.os.utime('/foo/bar', (100.5, 200.5))
+        self.assertEqual(200.5, self.os.stat('/foo/bar').st_mtime)
+        self.os.stat_float_times(False)
+        self.assertEqual(200, self.os.stat('/foo/bar').st_mtime)
+
+    def test_scandir_entry_stat(self):
+        entry = next(iter(fake_scandir.scandir(self.filesystem, '/foo')))
+        self.assertIs(self.os.stat('/foo/bar'), entry.stat())
+
+
+class ClockTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        self.os = fake_filesystem.FakeOsModule(self.filesystem)
+        self.open = fake_filesystem.FakeFileOpen(self.filesystem)
+
+    def test_real_clock_is_default(self):
+        self.assertIsInstance(self.filesystem.clock, helpers.RealClock)
+        start = time.time()
+        file_object = self.filesystem.create_file('/foo')
+        self.assertLessEqual(start, file_object.st_mtime)
+        self.assertLessEqual(file_object.st_mtime, time.time())
+
+    def test_frozen_clock(self):
+        self.filesystem.clock = helpers.FrozenClock(1000)
+        file_object = self.filesystem.create_file('/foo')
+        with self.open('/foo', 'w') as f:
+            f.write('bar')
+        self.os.utime('/foo')
+        self.assertEqual(1000, file_object.st_ctime)
+        self.assertEqual(1000, file_object.st_mtime)
+        self.assertEqual(1000, file_object.st_atime)
+
+    def test_manual_clock(self):
+        clock = helpers.ManualClock(1000)
+        self.filesystem.clock = clock
+        file_object = self.filesystem.create_file('/foo')
+        clock.advance(10)
+        file_object.set_contents('bar')
+        self.assertEqual(1000, file_object.st_atime)
+        self.assertEqual(1010, file_object.st_mtime)
+        clock.set(2000)
+        self.os.chmod('/foo', 0o600)
+        self.assertEqual(2000, self.os.stat('/foo').st_ctime)
+        self.assertEqual(1010, self.os.stat('/foo').st_mtime)
+
+    def test_counter_clock(self):
+        self.filesystem.clock = helpers.CounterClock(start=100, step=2)
+        first = self.filesystem.create_file('/foo')
+        second = self.filesystem.create_file('/bar')
+        self.assertEqual(100, first.st_mtime)
+        self.assertEqual(102, second.st_mtime)
+        with self.open('/foo', 'a') as f:
+            f.write('baz')
+        self.assertGreater(first.st_mtime, second.st_mtime)
+
+    def test_clock_is_kept_on_reset(self):
+        self.filesystem.clock = helpers.FrozenClock(1000)
+        self.filesystem.reset()
+        self.assertEqual(1000, self.filesystem.create_file('/foo').st_mtime)
+
+
+class ThreadSafetyTest(TestCase):
+    def setUp(self):
+        self.create_filesystem()
+        # switch threads as often as possible to provoke races
+        if hasattr(sys, 'setswitchinterval'):
+            self.switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+        else:
+            self.check_interval = sys.getcheckinterval()
+            sys.setcheckinterval(1)
+
+    def tearDown(self):
+        if hasattr(sys, 'setswitchinterval'):
+            sys.setswitchinterval(self.switch_interval)
+        else:
+            sys.setcheckinterval(self.check_interval)
+
+    def create_filesystem(self, **kwargs):
+        self.filesystem = fake_filesystem.FakeFilesystem(
+            path_separator='/', total_size=1000000, **kwargs)
+        self.os = fake_filesystem.FakeOsModule(self.filesystem)
+        self.open = fake_filesystem.FakeFileOpen(self.filesystem)
+        self.filesystem.create_file('/foo/bar')
+        self.filesystem.enable_thread_safety()
+
+    def run_threads(self, target, count=8):
+        errors = []
+
+        def run(index):
+            try:
+                target(index)
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=run, args=(i,))
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+
+    def test_locks(self):
+        filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        file_object = filesystem.create_file('/foo/bar')
+        self.assertIsNone(file_object._lock)
+        filesystem.enable_thread_safety()
+        self.assertIsNotNone(file_object._lock)
+        self.assertIsNotNone(filesystem.root._lock)
+        self.assertIsNot(file_object._lock, filesystem.root._lock)
+        self.assertIsNotNone(filesystem.create_file('/foo/baz')._lock)
+        self.assertIsNotNone(filesystem.open_files._lock)
+
+    def test_create_parent_dirs(self):
+        def create(index):
+            for i in range(20):
+                self.os.makedirs('/base/sub%d/%d/%d' % (i, i, index))
+
+        self.run_threads(create)
+        for i in range(20):
+            self.assertEqual(8, len(self.os.listdir(
+                '/base/sub%d/%d' % (i, i))))
+
+    def test_create_and_remove_files(self):
+        def create(index):
+            for i in range(50):
+                path = '/foo/%d-%d' % (index, i)
+                with self.open(path, 'w') as f:
+                    f.write('x' * index)
+                with self.open(path) as f:
+                    self.assertEqual('x' * index, f.read())
+                if i % 2:
+                    self.os.remove(path)
+
+        self.run_threads(create)
+        names = self.os.listdir('/foo')
+        self.assertEqual(8 * 25 + 1, len(names))
+        inodes = set(self.os.stat('/foo/' + name).st_ino for name in names)
+        self.assertEqual(len(names), len(inodes))
+        self.assertEqual(25 * sum(range(8)),
+                         self.filesystem.get_disk_usage().used)
+
+    def test_open_same_new_file(self):
+        def create(index):
+            for i in range(20):
+                with self.open('/foo/%d' % i, 'a') as f:
+                    f.write('%d\n' % index)
+
+        self.run_threads(create)
+        for i in range(20):
+            with self.open('/foo/%d' % i) as f:
+                self.assertEqual(8, len(f.readlines()))
+
+    def test_rename(self):
+        self.os.mkdir('/src')
+        self.os.mkdir('/dst')
+        for i in range(200):
+            self.filesystem.create_file('/src/%d' % i, contents=str(i))
+
+        def rename(index):
+            for i in range(index, 200, 8):
+                self.os.rename('/src/%d' % i, '/dst/%d' % i)
+                self.os.rename('/foo/bar', '/foo/bar')
+
+        self.run_threads(rename)
+        self.assertEqual([], self.os.listdir('/src'))
+        self.assertEqual(200, len(self.os.listdir('/dst')))
+        self.assertEqual(sum(len(str(i)) for i in range(200)),
+                         self.filesystem.get_disk_usage().used)
+
+    def test_file_descriptors(self):
+        def open_and_close(index):
+            for i in range(50):
+                fd = self.os.open('/foo/bar', os.O_RDONLY)
+                fd2 = self.os.dup(fd)
+                self.os.close(fd)
+                self.assertEqual(b'', self.os.read(fd2, 10))
+                self.os.close(fd2)
+
+        self.run_threads(open_and_close)
+        # only the standard streams are left open
+        self.assertEqual(3, len(self.filesystem.open_files.open_files()))
+
+    def check_paged_contents(self):
+        def contents(index, i):
+            return chr(ord('A') + index) * (100 + i)
+
+        def write_and_read(index):
+            for i in range(30):
+                path = '/foo/%d-%d' % (index, i)
+                with self.open(path, 'w') as f:
+                    f.write(contents(index, i))
+                self.os.rename(path, path + 'r')
+                with self.open(path + 'r') as f:
+                    self.assertEqual(contents(index, i), f.read())
+
+        self.run_threads(write_and_read)
+        for index in range(8):
+            for i in range(30):
+                file_object = self.filesystem.get_object(
+                    '/foo/%d-%dr' % (index, i))
+                self.assertEqual(contents(index, i), file_object.contents)
+
+    def test_memory_budget(self):
+        self.create_filesystem(memory_budget=5000)
+        self.check_paged_contents()
+
+    def test_compression(self):
+        self.filesystem.enable_compression(min_size=100, max_uncompressed=4)
+        self.check_paged_contents()
+
+
+class FilesystemImageTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem(path_separator='/',
+                                                         total_size=1000)
+        self.os = fake_filesystem.FakeOsModule(self.filesystem)
+        self.temp_dir = tempfile.mkdtemp()
+        self.image_path = os.path.join(self.temp_dir, 'fs.img')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def loaded_filesystem(self, lazy_read=True):
+        self.filesystem.save_image(self.image_path)
+        filesystem = fake_filesystem.FakeFilesystem()
+        filesystem.load_image(self.image_path, lazy_read=lazy_read)
+        return filesystem
+
+    def check_loaded_tree(self, lazy_read):
+        self.filesystem.create_file('/foo/bar', contents=b'bar contents',
+                                    st_mode=stat.S_IFREG | 0o640)
+        self.filesystem.create_file('/foo/baz', contents=u'baz')
+        self.filesystem.create_file('/foo/large', st_size=100)
+        self.filesystem.create_dir('/empty', perm_bits=0o700)
+        self.filesystem.create_symlink('/link', '/foo/bar')
+        self.filesystem.utime('/foo/bar', (20, 30))
+        filesystem = self.loaded_filesystem(lazy_read)
+
+        self.assertEqual('/', filesystem.path_separator)
+        bar = filesystem.get_object('/foo/bar')
+        self.assertEqual(b'bar contents', bar.byte_contents)
+        self.assertEqual(stat.S_IFREG | 0o640, bar.st_mode)
+        self.assertEqual(20, bar.st_atime)
+        self.assertEqual(30, bar.st_mtime)
+        self.assertEqual(u'baz', filesystem.get_object('/foo/baz').contents)
+        large_file = filesystem.get_object('/foo/large')
+        self.assertTrue(large_file.is_large_file())
+        self.assertEqual(100, large_file.st_size)
+        self.assertEqual(stat.S_IFDIR | 0o700,
+                         filesystem.get_object('/empty').st_mode)
+        self.assertEqual('/foo/bar', filesystem.readlink('/link'))
+        self.assertEqual(bar, filesystem.resolve('/link'))
+        self.assertEqual(self.filesystem.stat('/foo').st_ino,
+                         filesystem.stat('/foo').st_ino)
+        self.assertEqual(self.filesystem.stat('/foo').st_nlink,
+                         filesystem.stat('/foo').st_nlink)
+        self.assertEqual(self.filesystem.get_disk_usage(),
+                         filesystem.get_disk_usage())
+
+    def test_load_image_lazily(self):
+        self.check_loaded_tree(lazy_read=True)
+
+    def test_load_image_eagerly(self):
+        self.check_loaded_tree(lazy_read=False)
+
+    def test_sparse_file_extents_are_saved(self):
+        filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        filesystem.create_file('/foo/bar', st_size=2 ** 40)
+        with fake_filesystem.FakeFileOpen(filesystem)('/foo/bar', 'r+b') as f:
+            f.seek(2 ** 30)
+            f.write(b'data')
+        self.filesystem = filesystem
+        file_object = self.loaded_filesystem().get_object('/foo/bar')
+        self.assertLess(os.path.getsize(self.image_path), 1000)
+        self.assertTrue(file_object.is_large_file())
+        self.assertEqual(2 ** 40, file_object.st_size)
+        self.assertEqual([(2 ** 30, b'data')],
+                         file_object._byte_contents.extents())
+
+    def test_lazily_loaded_contents_are_read_on_demand(self):
+        self.filesystem.create_file('/foo/bar', contents=b'bar contents')
+        filesystem = self.loaded_filesystem()
+        file_object = filesystem.get_object('/foo/bar')
+        self.assertIsInstance(file_object, fake_filesystem.FakeFileFromImage)
+        self.assertFalse(file_object.contents_read)
+        fake_open = fake_filesystem.FakeFileOpen(filesystem)
+        with fake_open('/foo/bar', 'rb') as f:
+            self.assertEqual(b'bar contents', f.read())
+        self.assertTrue(file_object.contents_read)
+
+    def test_changing_loaded_file(self):
+        self.filesystem.create_file('/foo/bar', contents=b'bar contents')
+        filesystem = self.loaded_filesystem()
+        fake_open = fake_filesystem.FakeFileOpen(filesystem)
+        with fake_open('/foo/bar', 'ab') as f:
+            f.write(b' and more')
+        self.assertEqual(b'bar contents and more',
+                         filesystem.get_object('/foo/bar').byte_contents)
+        filesystem.get_object('/foo/bar').size = 3
+        self.assertEqual(b'bar',
+                         filesystem.get_object('/foo/bar').byte_contents)
+
+    @unittest.skipIf(TestCase.is_windows and sys.version_info < (3, 3),
+                     'Links are not supported under Windows before Python 3.3')
+    def test_hard_links_are_preserved(self):
+        self.filesystem.create_file('/foo/bar', contents=b'test')
+        self.os.link('/foo/bar', '/foo/baz')
+        filesystem = self.loaded_filesystem()
+        self.assertIs(filesystem.get_object('/foo/bar'),
+                      filesystem.get_object('/foo/baz'))
+        self.assertEqual(2, filesystem.stat('/foo/bar').st_nlink)
+        self.assertEqual(4, filesystem.get_disk_usage().used)
+
+    def test_mount_points_are_preserved(self):
+        self.filesystem.add_mount_point('/mnt', total_size=50)
+        self.filesystem.create_file('/mnt/foo', contents=b'test')
+        filesystem = self.loaded_filesystem()
+        self.assertEqual(self.filesystem.stat('/mnt/foo').st_dev,
+                         filesystem.stat('/mnt/foo').st_dev)
+        self.assertNotEqual(filesystem.stat('/').st_dev,
+                            filesystem.stat('/mnt').st_dev)
+        self.assertEqual((50, 4, 46), filesystem.get_disk_usage('/mnt'))
+        self.assertEqual(3, filesystem.add_mount_point('/mnt2')['idev'])
+
+    def test_xattr_is_preserved(self):
+        file_object = self.filesystem.create_file('/foo/bar')
+        file_object.xattr['user.test'] = b'value'
+        filesystem = self.loaded_filesystem()
+        self.assertEqual({'user.test': b'value'},
+                         filesystem.get_object('/foo/bar').xattr)
+
+    def test_load_invalid_image_raises(self):
+        with open(self.image_path, 'wb') as f:
+            f.write(b'no image')
+        self.assertRaises(ValueError, self.filesystem.load_image,
+                          self.image_path)
+
+
+class CreateFilesTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem(path_separator='!',
+                                                         total_size=100)
+
+    def test_create_files_from_dict(self):
+        files = self.filesystem.create_files({
+            '!foo!bar': 'bar',
+            '!foo!baz': None,
+            '!foo!sub!bar': b'sub',
+        })
+        self.assertEqual(3, len(files))
+        self.assertEqual('bar',
+                         self.filesystem.get_object('!foo!bar').contents)
+        self.assertEqual(b'', self.filesystem.get_object(
+            '!foo!baz').byte_contents)
+        self.assertEqual(b'sub', self.filesystem.get_object(
+            '!foo!sub!bar').byte_contents)
+        self.assertEqual(6, self.filesystem.get_disk_usage().used)
+
+    def test_create_files_returns_files_in_input_order(self):
+        paths = ['!foo!a', '!bar!b', '!foo!c', 'd']
+        files = self.filesystem.create_files(paths)
+        self.assertEqual(['a', 'b', 'c', 'd'], [f.name for f in files])
+        self.assertEqual(paths[:3], [f.path for f in files[:3]])
+        self.assertEqual(4, len(set(f.st_ino for f in files)))
+
+    def test_create_files_with_specification(self):
+        self.filesystem.create_files([
+            ('!foo!bar', {'contents': 'test', 'st_mode': 0o100444,
+                          'st_mtime': 42}),
+            ('!foo!large', {'st_size': 50}),
+        ])
+        file_object = self.filesystem.get_object('!foo!bar')
+        self.assertEqual(0o100444, file_object.st_mode)
+        self.assertEqual(42, file_object.st_mtime)
+        self.assertTrue(
+            self.filesystem.get_object('!foo!large').is_large_file())
+        self.assertEqual(54, self.filesystem.get_disk_usage().used)
+
+    def test_create_files_with_umask(self):
+        self.filesystem.umask = 0o022
+        file_object = self.filesystem.create_files(
+            ['!foo!bar'], apply_umask=True)[0]
+        self.assertEqual(0o100644, file_object.st_mode)
+
+    def test_create_existing_file_raises(self):
+        self.filesystem.create_file('!foo!bar')
+        self.assert_raises_os_error(errno.EEXIST,
+                                    self.filesystem.create_files,
+                                    ['!foo!baz', '!foo!bar'])
+
+    def test_create_files_in_missing_directory_raises(self):
+        self.assert_raises_io_error(errno.ENOENT,
+                                    self.filesystem.create_files,
+                                    ['!foo!bar'], create_missing_dirs=False)
+
+    def test_create_files_below_file_raises(self):
+        self.filesystem.create_file('!foo')
+        self.assert_raises_os_error(errno.ENOTDIR,
+                                    self.filesystem.create_files,
+                                    ['!foo!bar'])
+
+    def test_create_files_through_symlink(self):
+        self.filesystem.create_dir('!foo')
+        self.filesystem.create_symlink('!link', '!foo')
+        self.filesystem.create_files(['!link!bar'])
+        self.assertTrue(self.filesystem.exists('!foo!bar'))
+
+    def test_create_too_large_file_raises(self):
+        self.assert_raises_io_error(errno.ENOSPC,
+                                    self.filesystem.create_files,
+                                    {'!foo!bar': 'a' * 101})
+        self.assertFalse(self.filesystem.exists('!foo!bar'))
+
+
+class AddArchiveTest(TestCase):
+    def setUp(self):
+        self.filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        self.filesystem.set_disk_usage(1000)
+        self.temp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.temp_dir, 'source')
+        os.makedirs(os.path.join(self.source_dir, 'sub'))
+        self.create_real_file('foo.txt', b'foo contents', 0o640, 1000000000)
+        self.create_real_file('sub/bar.bin', b'bar' * 100, 0o755, 1000002000)
+        os.chmod(os.path.join(self.source_dir, 'sub'), 0o750)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def create_real_file(self, name, contents, mode, mtime):
+        path = os.path.join(self.source_dir, name)
+        with open(path, 'wb') as f:
+            f.write(contents)
+        os.chmod(path, mode)
+        os.utime(path, (mtime, mtime))
+
+    def create_tar(self, mode='w', add_links=False):
+        archive_path = os.path.join(self.temp_dir, 'archive.tar')
+        archive = tarfile.open(archive_path, mode)
+        archive.add(self.source_dir, arcname='source')
+        if add_links:
+            link = tarfile.TarInfo('source/link')
+            link.type = tarfile.SYMTYPE
+            link.linkname = 'foo.txt'
+            archive.addfile(link)
+            hard_link = tarfile.TarInfo('source/hardlink')
+            hard_link.type = tarfile.LNKTYPE
+            hard_link.linkname = 'source/foo.txt'
+            archive.addfile(hard_link)
+            outside = tarfile.TarInfo('../outside')
+            archive.addfile(outside, io.BytesIO(b''))
+        archive.close()
+        return archive_path
+
+    def create_zip(self):
+        archive_path = os.path.join(self.temp_dir, 'archive.zip')
+        archive = zipfile.ZipFile(archive_path, 'w')
+        archive.write(self.source_dir, 'source')
+        archive.write(os.path.join(self.source_dir, 'foo.txt'),
+                      'source/foo.txt')
+        archive.write(os.path.join(self.source_dir, 'sub'), 'source/sub')
+        archive.write(os.path.join(self.source_dir, 'sub', 'bar.bin'),
+                      'source/sub/bar.bin')
+        archive.close()
+        return archive_path
+
+    def check_contents(self, zip_mtimes=False):
+        foo = self.filesystem.resolve('/target/source/foo.txt')
+        self.assertEqual(b'foo contents', foo.byte_contents)
+        self.assertEqual(stat.S_IFREG | 0o640, foo.st_mode)
+        bar = self.filesystem.resolve('/target/source/sub/bar.bin')
+        self.assertEqual(b'bar' * 100, bar.byte_contents)
+        self.assertEqual(stat.S_IFREG | 0o755, bar.st_mode)
+        if zip_mtimes:
+            # zip archives store local time with 2 seconds resolution
+            self.assertAlmostEqual(1000000000, foo.st_mtime, delta=2)
+        else:
+            self.assertEqual(1000000000, foo.st_mtime)
+            self.assertEqual(1000002000, bar.st_mtime)
+        self.assertEqual(stat.S_IFDIR | 0o750,
+                         self.filesystem.resolve('/target/source/sub').st_mode)
+        self.assertEqual(312, self.filesystem.get_disk_usage().used)
+
+    def test_add_tar_archive(self):
+        self.filesystem.add_archive(self.create_tar(), '/target')
+        self.check_contents()
+
+    def test_add_compressed_tar_archive(self):
+        self.filesystem.add_archive(self.create_tar('w:gz'), '/target')
+        self.check_contents()
+
+    def test_add_tar_archive_lazily(self):
+        self.filesystem.add_archive(self.create_tar(), '/target',
+                                    lazy_read=True)
+        foo = self.filesystem.resolve('/target/source/foo.txt')
+        self.assertIsInstance(foo, fake_filesystem.FakeFileFromArchive)
+        self.assertFalse(foo.contents_read)
+        self.check_contents()
+
+    def test_add_compressed_tar_archive_lazily(self):
+        self.filesystem.add_archive(self.create_tar('w:bz2'), '/target',
+                                    lazy_read=True)
+        self.check_contents()
+
+    @unittest.skipIf(TestCase.is_windows and sys.version_info < (3, 3),
+                     'Links are not supported under Windows before Python 3.3')
+    def test_tar_links(self):
+        self.filesystem.add_archive(self.create_tar(add_links=True),
+                                    '/target')
+        self.assertEqual('foo.txt',
+                         self.filesystem.readlink('/target/source/link'))
+        self.assertIs(self.filesystem.resolve('/target/source/foo.txt'),
+                      self.filesystem.resolve('/target/source/link'))
+        self.assertIs(self.filesystem.resolve('/target/source/foo.txt'),
+                      self.filesystem.resolve('/target/source/hardlink'))
+        self.assertFalse(self.filesystem.exists('/outside'))
+
+    def test_add_zip_archive(self):
+        self.filesystem.add_archive(self.create_zip(), '/target')
+        self.check_contents(zip_mtimes=True)
+
+    def test_add_zip_archive_lazily(self):
+        self.filesystem.add_archive(self.create_zip(), '/target',
+                                    lazy_read=True)
+        self.assertFalse(self.filesystem.resolve(
+            '/target/source/foo.txt').contents_read)
+        self.check_contents(zip_mtimes=True)
+
+    def test_add_archive_to_cwd(self):
+        self.filesystem.create_dir('/target')
+        self.filesystem.cwd = '/target'
+        self.filesystem.add_archive(self.create_tar())
+        self.check_contents()
+
+    def test_add_existing_member_raises(self):
+        self.filesystem.create_file('/target/source/foo.txt')
+        self.assert_raises_os_error(errno.EEXIST,
+                                    self.filesystem.add_archive,
+                                    self.create_tar(), '/target')
+
+    def test_add_non_existing_archive_raises(self):
+        self.assert_raises_os_error(
+            errno.ENOENT, self.filesystem.add_archive,
+            os.path.join(self.temp_dir, 'nonexisting'), '/target')
+
+    def test_add_invalid_archive_raises(self):
+        path = os.path.join(self.temp_dir, 'foo.txt')
+        with open(path, 'wb') as f:
+            f.write(b'no archive')
+        self.assertRaises(ValueError, self.filesystem.add_archive,
+                          path, '/target')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -170,6 +170,7 @@ class TestAttributesWithFakeModuleNames(TestPyfakefsUnittestBase):
         self.assertEqual(module_with_attributes.shutil,
                          'shutil attribute value')
         self.assertEqual(module_with_attributes.io, 'io attribute value')
+        self.assertEqual(module_with_attributes.mmap, 'mmap attribute value')
 
 
 import math as path  # noqa: E402 wanted import not at top
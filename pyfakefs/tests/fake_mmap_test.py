@@ -0,0 +1,146 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `fake_mmap` if used in `fake_filesystem_unittest.TestCase`.
+The same tests are run with the real `mmap` module in the real file system.
+"""
+import mmap
+import os
+import shutil
+import sys
+import unittest
+
+from pyfakefs import fake_filesystem_unittest, fake_mmap
+from pyfakefs.tests.test_utils import RealFsTestMixin
+
+is_windows = sys.platform == 'win32'
+
+
+class RealFsTestCase(fake_filesystem_unittest.TestCase, RealFsTestMixin):
+    def __init__(self, methodName='runTest'):
+        fake_filesystem_unittest.TestCase.__init__(self, methodName)
+        RealFsTestMixin.__init__(self)
+
+    def setUp(self):
+        if not self.use_real_fs():
+            self.setUpPyfakefs()
+            self.filesystem = self.fs
+            self.os = os
+            self.open = open
+            self.create_basepath()
+        self.file_path = self.make_path('data.bin')
+        self.create_file(self.file_path, contents=b'hello\nworld\n')
+
+    def tearDown(self):
+        if self.use_real_fs():
+            shutil.rmtree(self.base_path, ignore_errors=True)
+
+
+class FakeMmapModuleTest(RealFsTestCase):
+    def test_mmap_is_faked(self):
+        if not self.use_real_fs():
+            self.assertIsInstance(mmap, fake_mmap.FakeMmapModule)
+
+    def test_read_access(self):
+        with open(self.file_path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.assertEqual(12, len(m))
+            self.assertEqual(12, m.size())
+            self.assertEqual(b'world', m[6:11])
+            self.assertEqual(b'h'[0], m[0])
+            self.assertEqual(b'\n'[0], m[-1])
+            self.assertEqual(4, m.find(b'o'))
+            self.assertEqual(7, m.rfind(b'o'))
+            self.assertEqual(b'hello\n', m.readline())
+            self.assertEqual(6, m.tell())
+            self.assertEqual(-1, m.find(b'h'))
+            self.assertEqual(b'wo', m.read(2))
+            self.assertEqual(b'rld\n', m.read(10))
+            self.assertRaises(ValueError, m.read_byte)
+            self.assertRaises(TypeError, m.write, b'x')
+            self.assertRaises(IndexError, lambda: m[12])
+            self.assertRaises(ValueError, m.seek, 13)
+            m.close()
+
+    def test_write_is_visible_in_file(self):
+        with open(self.file_path, 'r+b') as f:
+            m = mmap.mmap(f.fileno(), 0)
+            m[0:5] = b'HELLO'
+            m.seek(6)
+            m.write(b'WORLD')
+            self.assertRaises(IndexError, m.__setitem__,
+                              slice(0, 2), b'abc')
+            self.assertRaises(ValueError, m.write, b'too long')
+            m.flush()
+            f.seek(0)
+            self.assertEqual(b'HELLO\nWORLD\n', f.read())
+            m.close()
+        with open(self.file_path, 'rb') as f:
+            self.assertEqual(b'HELLO\nWORLD\n', f.read())
+
+    def test_copy_access_does_not_change_file(self):
+        with open(self.file_path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            m[0:5] = b'HELLO'
+            self.assertEqual(b'HELLO\n', m.readline())
+            self.assertRaises(TypeError, m.resize, 20)
+            m.close()
+        with open(self.file_path, 'rb') as f:
+            self.assertEqual(b'hello\nworld\n', f.read())
+
+    def test_write_access_needs_writable_file(self):
+        with open(self.file_path, 'rb') as f:
+            self.assertRaises(EnvironmentError, mmap.mmap, f.fileno(), 0)
+
+    def test_invalid_length(self):
+        with open(self.file_path, 'r+b') as f:
+            if not is_windows:
+                self.assertRaises(ValueError, mmap.mmap, f.fileno(), 20)
+        empty_path = self.make_path('empty')
+        self.create_file(empty_path)
+        with open(empty_path, 'r+b') as f:
+            self.assertRaises(ValueError, mmap.mmap, f.fileno(), 0)
+
+    def test_resize(self):
+        with open(self.file_path, 'r+b') as f:
+            m = mmap.mmap(f.fileno(), 0)
+            m.resize(20)
+            m[12:20] = b'appended'
+            self.assertEqual(20, m.size())
+            m.resize(5)
+            self.assertEqual(b'hello', m[:])
+            m.close()
+            self.assertRaises(ValueError, m.read, 1)
+        self.assertEqual(5, os.path.getsize(self.file_path))
+
+    def test_move(self):
+        with open(self.file_path, 'r+b') as f:
+            m = mmap.mmap(f.fileno(), 0)
+            m.move(0, 6, 5)
+            self.assertEqual(b'world\nworld\n', m[:])
+            self.assertRaises(ValueError, m.move, 10, 0, 5)
+            m.close()
+
+    def test_anonymous_map(self):
+        m = mmap.mmap(-1, 10)
+        m[0:3] = b'abc'
+        self.assertEqual(b'abc', m[:3])
+        m.close()
+
+
+class RealMmapModuleTest(FakeMmapModuleTest):
+    def use_real_fs(self):
+        return True
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -971,6 +971,55 @@ class FakeFileOpenTest(FakeFileOpenTestBase):
         with self.open(file_path, 'rb') as f:
             self.assertEqual(b'test', f.read())
 
+    @unittest.skipIf(sys.version_info < (3, ),
+                     'buffered binary file interface new in Python 3')
+    def test_readinto(self):
+        file_path = self.make_path('foo')
+        self.create_file(file_path, contents=b'0123456789')
+        with self.open(file_path, 'rb') as f:
+            buffer = bytearray(4)
+            self.assertEqual(4, f.readinto(buffer))
+            self.assertEqual(b'0123', buffer)
+            self.assertEqual(4, f.readinto1(memoryview(buffer)))
+            self.assertEqual(b'4567', buffer)
+            self.assertEqual(2, f.readinto(buffer))
+            self.assertEqual(b'8967', buffer)
+            self.assertEqual(0, f.readinto(buffer))
+
+    @unittest.skipIf(sys.version_info < (3, ),
+                     'buffered binary file interface new in Python 3')
+    def test_peek_and_read1(self):
+        file_path = self.make_path('foo')
+        self.create_file(file_path, contents=b'0123456789')
+        with self.open(file_path, 'rb') as f:
+            self.assertEqual(b'012', f.read1(3))
+            self.assertEqual(b'3456789', f.peek(2))
+            self.assertEqual(3, f.tell())
+            # the size argument is optional only since Python 3.7
+            self.assertEqual(b'3456789', f.read1(100))
+            self.assertEqual(b'', f.peek())
+
+    @unittest.skipIf(sys.version_info < (3, ),
+                     'buffered binary file interface new in Python 3')
+    def test_readinto_after_write(self):
+        file_path = self.make_path('foo')
+        self.create_file(file_path, contents=b'0123456789')
+        with self.open(file_path, 'r+b') as f:
+            f.write(b'ab')
+            buffer = bytearray(3)
+            self.assertEqual(3, f.readinto(buffer))
+            self.assertEqual(b'234', buffer)
+        self.check_contents(file_path, b'ab23456789')
+
+    @unittest.skipIf(sys.version_info < (3, ),
+                     'buffered binary file interface new in Python 3')
+    def test_no_readinto_in_text_mode(self):
+        file_path = self.make_path('foo')
+        self.create_file(file_path, contents='test')
+        with self.open(file_path) as f:
+            self.assertRaises(AttributeError, getattr, f, 'readinto')
+            self.assertRaises(AttributeError, getattr, f, 'peek')
+
     def test_write_devnull(self):
         for mode in ('r+', 'w', 'w+', 'a', 'a+'):
             with self.open(self.os.devnull, mode) as f:
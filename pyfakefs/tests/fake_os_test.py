@@ -213,6 +213,98 @@ class FakeOsModuleTest(FakeOsModuleTestBase):
             self.assertFalse(f is fake_file3)
         self.assert_raises_os_error(errno.EBADF, self.os.fdopen, fileno2)
 
+    def test_dup(self):
+        file_path = self.make_path('some_file')
+        self.create_file(file_path, contents='contents')
+        fd = self.os.open(file_path, os.O_RDONLY)
+        fd2 = self.os.dup(fd)
+        self.assertNotEqual(fd, fd2)
+        # both descriptors share the file position
+        self.assertEqual(b'con', self.os.read(fd, 3))
+        self.assertEqual(b'tents', self.os.read(fd2, 5))
+        self.os.close(fd)
+        self.assert_raises_os_error(errno.EBADF, self.os.read, fd, 1)
+        self.os.lseek(fd2, 0, 0)
+        self.assertEqual(b'contents', self.os.read(fd2, 8))
+        self.os.close(fd2)
+        self.assert_raises_os_error(errno.EBADF, self.os.read, fd2, 1)
+
+    def test_dup_closed_file_descriptor(self):
+        file_path = self.make_path('some_file')
+        self.create_file(file_path)
+        fd = self.os.open(file_path, os.O_RDONLY)
+        self.os.close(fd)
+        self.assert_raises_os_error(errno.EBADF, self.os.dup, fd)
+        self.assert_raises_os_error(errno.EBADF, self.os.dup2, fd, fd + 1)
+
+    def test_dup2(self):
+        file_path1 = self.make_path('some_file1')
+        file_path2 = self.make_path('some_file2')
+        self.create_file(file_path1, contents='contents1')
+        self.create_file(file_path2, contents='contents2')
+        fd1 = self.os.open(file_path1, os.O_RDONLY)
+        fd2 = self.os.open(file_path2, os.O_RDONLY)
+        self.os.dup2(fd1, fd2)
+        self.assertEqual(b'contents1', self.os.read(fd2, 9))
+        self.os.close(fd1)
+        self.os.lseek(fd2, 0, 0)
+        self.assertEqual(b'contents1', self.os.read(fd2, 9))
+        self.os.close(fd2)
+
+    def test_dup2_writes_to_new_descriptor(self):
+        file_path = self.make_path('some_file')
+        fd = self.os.open(file_path, os.O_CREAT | os.O_WRONLY)
+        fd2 = self.os.dup(fd)
+        self.os.write(fd2, b'written')
+        self.os.close(fd2)
+        self.os.write(fd, b' twice')
+        self.os.close(fd)
+        self.check_contents(file_path, b'written twice')
+
+    def test_dup_keeps_closed_file_object_open(self):
+        file_path = self.make_path('some_file')
+        self.create_file(file_path, contents='contents')
+        f = self.open(file_path, 'rb')
+        fd2 = self.os.dup(f.fileno())
+        f.close()
+        self.assertTrue(f.closed)
+        self.assertEqual(b'conte', self.os.read(fd2, 5))
+        self.os.close(fd2)
+        self.assert_raises_os_error(errno.EBADF, self.os.read, fd2, 1)
+
+    def test_dup_after_closing_file_descriptor(self):
+        file_path = self.make_path('some_file')
+        self.create_file(file_path, contents='contents')
+        f = self.open(file_path, 'rb')
+        fd = f.fileno()
+        fd2 = self.os.dup(fd)
+        self.os.close(fd)
+        self.assertEqual(fd, f.fileno())
+        # the file object fails to close its own descriptor
+        self.assert_raises_io_error(errno.EBADF, f.close)
+        self.assertEqual(b'conte', self.os.read(fd2, 5))
+        self.os.close(fd2)
+        self.assert_raises_os_error(errno.EBADF, self.os.read, fd2, 1)
+
+    @unittest.skipIf(sys.version_info < (3, 4),
+                     'inheritable file descriptors new in Python 3.4')
+    def test_inheritable(self):
+        file_path = self.make_path('some_file')
+        self.create_file(file_path)
+        fd = self.os.open(file_path, os.O_RDONLY)
+        self.assertFalse(self.os.get_inheritable(fd))
+        self.os.set_inheritable(fd, True)
+        self.assertTrue(self.os.get_inheritable(fd))
+        fd2 = self.os.dup(fd)
+        self.assertFalse(self.os.get_inheritable(fd2))
+        self.os.dup2(fd, fd2)
+        self.assertTrue(self.os.get_inheritable(fd2))
+        self.os.dup2(fd, fd2, inheritable=False)
+        self.assertFalse(self.os.get_inheritable(fd2))
+        self.os.close(fd)
+        self.os.close(fd2)
+        self.assert_raises_os_error(errno.EBADF, self.os.get_inheritable, fd)
+
     def test_fdopen_mode(self):
         self.skip_real_fs()
         file_path1 = self.make_path('some_file1')
@@ -4156,6 +4248,111 @@ class FakeOsModuleLowLevelFileOpTest(FakeOsModuleTestBase):
         self.os.close(fd2)
         self.os.close(fd3)
 
+    def test_lseek(self):
+        file_path = self.make_path('baz')
+        self.create_file(file_path, contents=b'0123456789')
+        fd = self.os.open(file_path, os.O_RDWR)
+        self.assertEqual(4, self.os.lseek(fd, 4, os.SEEK_SET))
+        self.assertEqual(b'45', self.os.read(fd, 2))
+        self.assertEqual(8, self.os.lseek(fd, 2, os.SEEK_CUR))
+        self.assertEqual(7, self.os.lseek(fd, -3, os.SEEK_END))
+        self.os.write(fd, b'x')
+        self.assertEqual(8, self.os.lseek(fd, 0, os.SEEK_CUR))
+        self.assert_raises_os_error(errno.EINVAL,
+                                    self.os.lseek, fd, -1, os.SEEK_SET)
+        self.os.close(fd)
+        self.check_contents(file_path, b'0123456x89')
+
+    @unittest.skipIf(sys.version_info < (3, 3),
+                     'pread/pwrite new in Python 3.3')
+    def test_pread_and_pwrite(self):
+        self.check_posix_only()
+        file_path = self.make_path('baz')
+        self.create_file(file_path, contents=b'0123456789')
+        fd = self.os.open(file_path, os.O_RDWR)
+        self.assertEqual(b'01', self.os.read(fd, 2))
+        self.assertEqual(b'567', self.os.pread(fd, 3, 5))
+        self.assertEqual(b'89', self.os.pread(fd, 5, 8))
+        self.assertEqual(b'', self.os.pread(fd, 5, 20))
+        self.assertEqual(3, self.os.pwrite(fd, b'abc', 4))
+        self.assertEqual(2, self.os.pwrite(fd, b'yz', 12))
+        self.assertEqual(b'23', self.os.read(fd, 2))
+        self.assertEqual(4, self.os.lseek(fd, 0, os.SEEK_CUR))
+        self.assertEqual(b'abc', self.os.read(fd, 3))
+        self.os.close(fd)
+        self.check_contents(file_path, b'0123abc789\0\0yz')
+        self.assertEqual(14, self.os.path.getsize(file_path))
+
+    @unittest.skipIf(sys.version_info < (3, 3),
+                     'pread/pwrite new in Python 3.3')
+    def test_pread_and_pwrite_check_access(self):
+        self.check_posix_only()
+        file_path = self.make_path('baz')
+        self.create_file(file_path, contents=b'0123456789')
+        fd = self.os.open(file_path, os.O_RDONLY)
+        self.assert_raises_os_error(errno.EBADF,
+                                    self.os.pwrite, fd, b'abc', 0)
+        self.os.close(fd)
+        fd = self.os.open(file_path, os.O_WRONLY)
+        self.assert_raises_os_error(errno.EBADF, self.os.pread, fd, 3, 0)
+        self.os.close(fd)
+
+    @unittest.skipIf(sys.version_info < (3, 3),
+                     'readv/writev new in Python 3.3')
+    def test_readv_and_writev(self):
+        self.check_posix_only()
+        file_path = self.make_path('baz')
+        fd = self.os.open(file_path, os.O_CREAT | os.O_RDWR)
+        self.assertEqual(9, self.os.writev(fd, [b'abc', bytearray(b'de'),
+                                                memoryview(b'fghi')]))
+        self.os.lseek(fd, 1, os.SEEK_SET)
+        buffers = [bytearray(3), bytearray(4), bytearray(5)]
+        self.assertEqual(8, self.os.readv(fd, buffers))
+        self.assertEqual([b'bcd', b'efgh', b'i\0\0\0\0'],
+                         [bytes(buf) for buf in buffers])
+        self.os.close(fd)
+        self.check_contents(file_path, b'abcdefghi')
+
+    @unittest.skipIf(sys.version_info < (3, 3),
+                     'sendfile new in Python 3.3')
+    def test_sendfile(self):
+        self.check_linux_only()
+        src_path = self.make_path('src')
+        self.create_file(src_path, contents=b'0123456789')
+        dst_path = self.make_path('dst')
+        self.create_file(dst_path, contents=b'abc')
+        in_fd = self.os.open(src_path, os.O_RDONLY)
+        out_fd = self.os.open(dst_path, os.O_RDWR)
+        self.os.lseek(out_fd, 1, os.SEEK_SET)
+        self.assertEqual(4, self.os.sendfile(out_fd, in_fd, 2, 4))
+        self.assertEqual(0, self.os.lseek(in_fd, 0, os.SEEK_CUR))
+        self.assertEqual(5, self.os.lseek(out_fd, 0, os.SEEK_CUR))
+        self.assertEqual(3, self.os.sendfile(out_fd, in_fd, None, 3))
+        self.assertEqual(3, self.os.lseek(in_fd, 0, os.SEEK_CUR))
+        self.assertEqual(b'3', self.os.read(in_fd, 1))
+        self.os.write(out_fd, b'!')
+        self.os.close(in_fd)
+        self.os.close(out_fd)
+        self.check_contents(dst_path, b'a2345012!')
+
+    @unittest.skipIf(sys.version_info < (3, 8),
+                     'copy_file_range new in Python 3.8')
+    def test_copy_file_range(self):
+        self.check_linux_only()
+        src_path = self.make_path('src')
+        self.create_file(src_path, contents=b'0123456789')
+        dst_path = self.make_path('dst')
+        in_fd = self.os.open(src_path, os.O_RDONLY)
+        out_fd = self.os.open(dst_path, os.O_CREAT | os.O_WRONLY)
+        self.assertEqual(5, self.os.copy_file_range(in_fd, out_fd, 5))
+        self.assertEqual(3, self.os.copy_file_range(in_fd, out_fd, 3,
+                                                    offset_src=0))
+        self.assertEqual(5, self.os.lseek(in_fd, 0, os.SEEK_CUR))
+        self.assertEqual(8, self.os.lseek(out_fd, 0, os.SEEK_CUR))
+        self.os.close(in_fd)
+        self.os.close(out_fd)
+        self.check_contents(dst_path, b'01234012')
+
     def test_devnull_posix(self):
         self.check_posix_only()
         self.assertTrue(self.os.path.exists(self.os.devnull))
@@ -4554,9 +4751,12 @@ class StatPropagationTest(TestCase):
         original_size = len(original_content)
         self.filesystem.create_file(file_path, st_size=original_size)
         added_content = 'foo bar'
-        fh = self.open(file_path, 'a')
-        self.assertRaises(fake_filesystem.FakeLargeFileIoException,
-                          lambda: fh.write(added_content))
+        with self.open(file_path, 'a') as fh:
+            fh.write(added_content)
+        self.assertEqual(original_size + len(added_content),
+                         self.os.stat(file_path).st_size)
+        with self.open(file_path, 'rb') as fh:
+            self.assertEqual(b'\0' * original_size + b'foo bar', fh.read())
 
     def test_file_size_updated_via_flush(self):
         """test that file size gets updated via flush()."""
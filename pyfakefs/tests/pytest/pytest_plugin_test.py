@@ -5,3 +5,19 @@ import os
 def test_fs_fixture(fs):
     fs.create_file('/var/data/xx1.txt')
     assert os.path.exists('/var/data/xx1.txt')
+
+
+def test_fs_stats_option(fs, request):
+    """Statistics are only collected with the --fs-stats option."""
+    os.stat('/')
+    stats = fs.stats()
+    if request.config.getoption('fs_stats'):
+        assert stats['stat']['count'] == 1
+    else:
+        assert stats is None
+
+
+def test_fs_memory_report(fs):
+    fs.create_file('/foo/bar', contents='x' * 1000)
+    report = fs.memory_report()
+    assert report.largest_files(1)[0][0] == '/foo/bar'
@@ -0,0 +1,178 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for recording and replaying file system traces."""
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyfakefs import fake_filesystem, tracing
+from pyfakefs.fake_filesystem_unittest import Patcher
+from pyfakefs.helpers import IS_PY2
+
+
+def encoded(string):
+    """Return a native string as encoded in a trace."""
+    return {'b': string.decode('latin-1')} if IS_PY2 else string
+
+
+def scenario():
+    os.makedirs('/foo/bar')
+    with open('/foo/bar/baz.txt', 'w') as f:
+        f.write('hello\n')
+        f.write('world\n')
+    with open('/foo/bar/baz.txt') as f:
+        lines = [line for line in f]
+    fd = os.open('/foo/data', os.O_CREAT | os.O_WRONLY)
+    os.write(fd, b'x' * 5000)
+    os.close(fd)
+    os.rename('/foo/data', '/foo/renamed')
+    try:
+        os.stat('/foo/missing')
+    except OSError:
+        pass
+    return lines, os.path.exists('/foo/bar')
+
+
+class TraceRecorderTest(unittest.TestCase):
+    def record_scenario(self):
+        with Patcher() as patcher:
+            with tracing.TraceRecorder(patcher) as recorder:
+                result = scenario()
+            self.assertEqual((['hello\n', 'world\n'], True), result)
+            os.path.exists('/foo')
+        return recorder.trace
+
+    def test_calls_are_recorded(self):
+        trace = self.record_scenario()
+        calls = [(record[2], record[3]) for record in trace.records]
+        self.assertEqual(('os', 'makedirs'), calls[0])
+        self.assertEqual(('open', 'open'), calls[1])
+        self.assertEqual([(1, 'write'), (1, 'write'), (1, 'close')],
+                         calls[2:5])
+        self.assertIn(('os', 'rename'), calls)
+        self.assertEqual(('path', 'exists'), calls[-1])
+        # calls after stopping the recorder are not recorded
+        self.assertEqual(1, calls.count(('path', 'exists')))
+
+    def test_arguments_and_results(self):
+        records = self.record_scenario().records
+        self.assertEqual([encoded('/foo/bar/baz.txt'), encoded('w')],
+                         records[1][4][:2])
+        self.assertEqual({'h': 1}, records[1][6])
+        write_record = [record for record in records
+                        if record[3] == 'write' and record[2] == 'os'][0]
+        self.assertEqual([{'fd': write_record[4][0]['fd']}, {'n': 5000}],
+                         write_record[4])
+        stat_record = [record for record in records
+                       if record[3] == 'stat'][0]
+        self.assertEqual({'e': errno.ENOENT}, stat_record[6])
+        for record in records:
+            self.assertGreaterEqual(record[1], 0)
+
+    def test_iteration_is_recorded(self):
+        with Patcher() as patcher:
+            os.makedirs('/foo/bar/baz')
+            with tracing.TraceRecorder(patcher) as recorder:
+                walk = os.walk('/foo')
+                duration = recorder.trace.records[0][1]
+                roots = [root for root, _, _ in walk]
+        self.assertEqual(3, len(roots))
+        # the calls made while iterating belong to the walk() call
+        self.assertEqual(1, len(recorder.trace))
+        self.assertEqual('walk', recorder.trace.records[0][3])
+        self.assertGreater(recorder.trace.records[0][1], duration)
+
+        filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        filesystem.create_dir('/foo/bar/baz')
+        with filesystem.collect_stats() as stats:
+            result = tracing.replay(recorder.trace, filesystem)
+        self.assertEqual([], result.mismatches)
+        # the replayed walk() has been iterated
+        self.assertEqual(3, stats.counts['listdir'])
+
+    def test_invalid_object(self):
+        self.assertRaises(TypeError, tracing.TraceRecorder, [object()])
+
+    def test_stop_restores_functions(self):
+        filesystem = fake_filesystem.FakeFilesystem(path_separator='/')
+        os_module = fake_filesystem.FakeOsModule(filesystem)
+        fdopen = os_module.fdopen
+        recorder = tracing.TraceRecorder([os_module])
+        self.assertIn('listdir', os_module.__dict__)
+        recorder.stop()
+        self.assertNotIn('listdir', os_module.__dict__)
+        self.assertEqual(fdopen, os_module.fdopen)
+        os_module.listdir('/')
+        self.assertEqual(0, len(recorder.trace))
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        with Patcher() as patcher:
+            with tracing.TraceRecorder(patcher) as recorder:
+                scenario()
+        self.trace = recorder.trace
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_save_and_load(self):
+        path = os.path.join(self.temp_dir, 'scenario.trace')
+        self.trace.save(path)
+        trace = tracing.Trace.load(path)
+        self.assertEqual(self.trace.records, trace.records)
+        self.assertEqual(self.trace.path_separator, trace.path_separator)
+        self.assertAlmostEqual(self.trace.elapsed, trace.elapsed)
+
+    def test_replay_in_fake_filesystem(self):
+        filesystem = fake_filesystem.FakeFilesystem()
+        result = tracing.replay(self.trace, filesystem)
+        self.assertEqual([], result.mismatches)
+        self.assertEqual(len(self.trace), result.calls)
+        self.assertGreater(result.elapsed, 0)
+        self.assertEqual(self.trace.elapsed, result.recorded_elapsed)
+        self.assertEqual(5000, filesystem.stat('/foo/renamed').st_size)
+        self.assertEqual('hello\nworld\n',
+                         filesystem.get_object('/foo/bar/baz.txt').contents)
+
+    def test_replay_saved_trace_in_new_filesystem(self):
+        path = os.path.join(self.temp_dir, 'scenario.trace')
+        self.trace.save(path)
+        self.assertEqual([], tracing.replay(path).mismatches)
+
+    def test_replay_in_real_filesystem(self):
+        result = tracing.replay(self.trace, real_root=self.temp_dir)
+        self.assertEqual([], result.mismatches)
+        self.assertEqual(5000, os.path.getsize(
+            os.path.join(self.temp_dir, 'foo', 'renamed')))
+        with open(os.path.join(self.temp_dir, 'foo', 'bar', 'baz.txt')) as f:
+            self.assertEqual('hello\nworld\n', f.read())
+
+    def test_mismatches(self):
+        filesystem = fake_filesystem.FakeFilesystem()
+        filesystem.create_dir('/foo/bar')
+        result = tracing.replay(self.trace, filesystem)
+        self.assertEqual([(0, 'makedirs', None, errno.EEXIST)],
+                         result.mismatches)
+
+    def test_fake_and_real_filesystem(self):
+        self.assertRaises(ValueError, tracing.replay, self.trace,
+                          fake_filesystem.FakeFilesystem(), self.temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,515 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Recording and replaying of file system operation traces.
+
+A trace records the calls of the fake `os`, `os.path` and `open` functions,
+and of the methods of the files opened by them, together with their
+arguments, results and timing. It can be saved to a compact trace file,
+and replayed against a fresh fake file system, or against a directory in
+the real file system, for example to compare the performance of the same
+I/O pattern in both.
+
+:Includes:
+  Trace: The recorded calls, with methods to save and load them.
+  TraceRecorder: Records the calls made to fake modules into a `Trace`.
+  ReplayResult: The result of `replay()`.
+  replay: Re-executes a trace.
+
+:Usage:
+
+>>> from pyfakefs.fake_filesystem_unittest import Patcher
+>>> from pyfakefs import tracing
+>>> with Patcher() as patcher:
+...     with tracing.TraceRecorder(patcher) as recorder:
+...         run_my_scenario()
+>>> recorder.trace.save('scenario.trace')
+>>> trace = tracing.Trace.load('scenario.trace')
+>>> print(tracing.replay(trace).elapsed)
+>>> print(tracing.replay(trace, real_root=tempfile.mkdtemp()).elapsed)
+"""
+
+import gzip
+import inspect
+import json
+import os
+from timeit import default_timer
+
+from pyfakefs import fake_filesystem
+from pyfakefs.fake_filesystem_unittest import Patcher
+from pyfakefs.helpers import is_int_type, is_byte_string, is_unicode_string
+
+TRACE_VERSION = 1
+
+# os functions returning new file descriptors
+_FD_RESULT_FUNCTIONS = {'open', 'dup', 'dup2', 'fileno'}
+# os functions whose arguments are data and never paths
+_DATA_FUNCTIONS = {'write', 'pwrite', 'writev'}
+
+
+class Trace(object):
+    """A recorded sequence of file system calls.
+
+    Each record is a list
+    `[start, duration, target, name, args, kwargs, result]`, where `start`
+    is the offset in seconds from the start of the recording, `target` is
+    one of `'os'`, `'path'` and `'open'`, or the handle number of an open
+    file, and `name` is the called function or method name. The arguments
+    and the result are encoded as JSON values. Strings and bytes longer than
+    the maximum data size of the recorder are only stored with their size.
+    A raised exception is stored as result `{'e': errno}`, or as
+    `{'e': exception class name}` if it has no error number.
+    Other results are stored as `{'r': type name}`; if such a result is
+    an iterator, as returned by `os.walk()`, the time spent iterating it is
+    added to the duration of the call.
+
+    Attributes:
+        records: The list of records.
+        path_separator: The path separator of the recorded file system.
+    """
+
+    def __init__(self, records=None, path_separator=os.sep):
+        self.records = records if records is not None else []
+        self.path_separator = path_separator
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def elapsed(self):
+        """The cumulative time in seconds of the recorded calls."""
+        return sum(record[1] for record in self.records)
+
+    def save(self, path):
+        """Save the trace as gzipped JSON lines to the real file `path`."""
+        header = {'version': TRACE_VERSION,
+                  'pyfakefs': fake_filesystem.__version__,
+                  'path_separator': self.path_separator}
+        with gzip.open(path, 'wb') as f:
+            f.write(json.dumps(header).encode('utf8') + b'\n')
+            for record in self.records:
+                f.write(json.dumps(record, separators=(',', ':'))
+                        .encode('utf8') + b'\n')
+
+    @classmethod
+    def load(cls, path):
+        """Load a trace saved with `save()` from the real file `path`.
+
+        Raises:
+            ValueError: if the file has been saved by an incompatible
+                version.
+        """
+        with gzip.open(path, 'rb') as f:
+            lines = f.read().decode('utf8').splitlines()
+        header = json.loads(lines[0])
+        if header.get('version') != TRACE_VERSION:
+            raise ValueError('Unsupported trace version: %s' %
+                             header.get('version'))
+        return cls([json.loads(line) for line in lines[1:]],
+                   header['path_separator'])
+
+
+class _TracedFile(object):
+    """Proxy for a fake file object recording the calls of its methods."""
+
+    def __init__(self, recorder, handle, file_object):
+        self._recorder = recorder
+        self._handle = handle
+        self._file_object = file_object
+
+    def __getattr__(self, name):
+        attr = getattr(self._file_object, name)
+        if callable(attr):
+            return self._recorder._traced(self._handle, name, attr)
+        return attr
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    # satisfy both Python 2 and 3
+    next = __next__
+
+
+class _TracedIterator(object):
+    """Proxy for an iterator returned by a recorded call, as by `os.walk()`
+    or `os.scandir()`, adding the time of the iteration to the duration of
+    the call."""
+
+    def __init__(self, recorder, record, iterator):
+        self._recorder = recorder
+        self._record = record
+        self._iterator = iterator
+
+    def __getattr__(self, name):
+        return getattr(self._iterator, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if hasattr(self._iterator, 'close'):
+            self._iterator.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # calls made by the iterator belong to the recorded call
+        self._recorder._depth += 1
+        start = default_timer()
+        try:
+            return next(self._iterator)
+        finally:
+            self._recorder._depth -= 1
+            self._record[1] = round(
+                self._record[1] + default_timer() - start, 6)
+
+    # satisfy both Python 2 and 3
+    next = __next__
+
+
+def _is_iterator(value):
+    return hasattr(value, '__next__') or hasattr(value, 'next')
+
+
+class TraceRecorder(object):
+    """Records the calls of fake `os`, `os.path` and `open` functions and
+    of the files opened by them into a :py:class:`Trace`.
+
+    The functions are replaced by recording functions in the given fake
+    objects, so the recorder has to be created after the fake modules,
+    for example after `Patcher.setUp()`. Only the outermost call is
+    recorded if a fake function calls other fake functions.
+    Can be used as a context manager, which stops recording on exit.
+
+    Attributes:
+        trace: The recorded :py:class:`Trace`.
+    """
+
+    def __init__(self, fake_objects, max_data_size=1024):
+        """
+        Args:
+            fake_objects: A :py:class:`Patcher` after setup, to record
+                the calls to its fake `os`, `os.path` and `open`, or a list
+                of :py:class:`FakeOsModule`, :py:class:`FakePathModule`
+                and :py:class:`FakeFileOpen` objects.
+            max_data_size: The maximum length of strings and bytes
+                stored in the trace; only the length is stored for longer
+                values.
+
+        Raises:
+            TypeError: if any of `fake_objects` cannot be recorded.
+        """
+        if isinstance(fake_objects, Patcher):
+            fake_os = fake_objects.fake_modules['os']
+            fake_objects = [fake_os, fake_os.path, fake_objects.fake_open]
+        self.max_data_size = max_data_size
+        self._depth = 0
+        self._handles = 0
+        self._fds = set()
+        self._start = default_timer()
+        # list of (object, name, original instance attribute or None)
+        self._replaced = []
+        separator = os.sep
+        for fake_object in fake_objects:
+            target = self._target(fake_object)
+            separator = fake_object.filesystem.path_separator
+            if target == 'open':
+                # the method handling the open() arguments as passed
+                names = ['call' if fake_object._use_io else '_call_ver2']
+            else:
+                names = [name for name in dir(fake_object)
+                         if not name.startswith('_') and
+                         inspect.isroutine(getattr(fake_object, name))]
+            for name in names:
+                self._replaced.append(
+                    (fake_object, name, fake_object.__dict__.get(name)))
+                setattr(fake_object, name, self._traced(
+                    target, 'open' if target == 'open' else name,
+                    getattr(fake_object, name)))
+        self.trace = Trace(path_separator=separator)
+
+    @staticmethod
+    def _target(fake_object):
+        if isinstance(fake_object, fake_filesystem.FakeOsModule):
+            return 'os'
+        if isinstance(fake_object, fake_filesystem.FakePathModule):
+            return 'path'
+        if isinstance(fake_object, fake_filesystem.FakeFileOpen):
+            return 'open'
+        raise TypeError('Cannot record calls of %s' %
+                        type(fake_object).__name__)
+
+    def stop(self):
+        """Stop recording and restore the original functions."""
+        for fake_object, name, attr in reversed(self._replaced):
+            if attr is None:
+                delattr(fake_object, name)
+            else:
+                setattr(fake_object, name, attr)
+        self._replaced = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _traced(self, target, name, func):
+        """Return a function calling `func` and recording the call."""
+        def traced_func(*args, **kwargs):
+            if self._depth:
+                return func(*args, **kwargs)
+            self._depth += 1
+            start = default_timer()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as exc:
+                error = getattr(exc, 'errno', None) or type(exc).__name__
+                self._record(target, name, args, kwargs, start,
+                             default_timer() - start, {'e': error})
+                raise
+            finally:
+                self._depth -= 1
+            duration = default_timer() - start
+            if isinstance(result, fake_filesystem.FakeFileWrapper):
+                self._handles += 1
+                result = _TracedFile(self, self._handles, result)
+                encoded_result = {'h': self._handles}
+            elif (target != 'path' and name in _FD_RESULT_FUNCTIONS and
+                  is_int_type(result)):
+                self._fds.add(result)
+                encoded_result = {'fd': result}
+            else:
+                encoded_result = self._encode(result)
+            record = self._record(target, name, args, kwargs, start,
+                                  duration, encoded_result)
+            if _is_iterator(result) and not isinstance(result, _TracedFile):
+                result = _TracedIterator(self, record, result)
+            return result
+
+        return traced_func
+
+    def _record(self, target, name, args, kwargs, start, duration, result):
+        encoded_args = []
+        for i, arg in enumerate(args):
+            # the file descriptor arguments of os functions
+            if (target == 'os' and (i == 0 or i == 1 and name == 'dup2') and
+                    is_int_type(arg) and arg in self._fds):
+                encoded_args.append({'fd': arg})
+            else:
+                encoded_args.append(self._encode(arg))
+        encoded_kwargs = dict((key, self._encode(value))
+                              for key, value in kwargs.items())
+        record = [round(start - self._start, 6), round(duration, 6), target,
+                  name, encoded_args, encoded_kwargs, result]
+        self.trace.records.append(record)
+        return record
+
+    def _encode(self, value):
+        if value is None or isinstance(value, (bool, float)):
+            return value
+        if is_int_type(value):
+            return value
+        if isinstance(value, _TracedFile):
+            return {'h': value._handle}
+        if hasattr(value, '__fspath__'):
+            value = value.__fspath__()
+        if is_unicode_string(value):
+            if len(value) > self.max_data_size:
+                return {'n': len(value), 't': 1}
+            return value
+        if is_byte_string(value) and isinstance(value, bytes):
+            if len(value) > self.max_data_size:
+                return {'n': len(value)}
+            return {'b': value.decode('latin-1')}
+        if isinstance(value, (list, tuple)):
+            return [self._encode(item) for item in value]
+        if isinstance(value, dict):
+            return dict((str(key), self._encode(item))
+                        for key, item in value.items())
+        return {'r': type(value).__name__}
+
+
+class ReplayResult(object):
+    """The result of :py:func:`replay`.
+
+    Attributes:
+        calls: The number of replayed calls.
+        elapsed: The cumulative time in seconds of the replayed calls.
+        recorded_elapsed: The cumulative time in seconds of the calls
+            while recording.
+        mismatches: A list of `(index, name, recorded error, replay error)`
+            tuples for calls that failed either while recording or in the
+            replay, but not both with the same error; an error is `None`
+            for a successful call.
+    """
+
+    def __init__(self, trace):
+        self.calls = 0
+        self.elapsed = 0.0
+        self.recorded_elapsed = trace.elapsed
+        self.mismatches = []
+
+
+class _Replayer(object):
+    def __init__(self, trace, os_module, open_function, real_root):
+        self.trace = trace
+        self.os_module = os_module
+        self.open_function = open_function
+        self.real_root = real_root
+        self.handles = {}
+        self.fds = {}
+
+    def run(self):
+        result = ReplayResult(self.trace)
+        for index, record in enumerate(self.trace.records):
+            _, _, target, name, args, kwargs, recorded = record
+            recorded_error = (recorded.get('e')
+                              if isinstance(recorded, dict) else None)
+            rebase = (self.real_root is not None and
+                      not is_int_type(target) and
+                      name not in _DATA_FUNCTIONS)
+            args = [self._decode(arg, rebase) for arg in args]
+            kwargs = dict((str(key), self._decode(value, rebase))
+                          for key, value in kwargs.items())
+            replay_error = None
+            start = default_timer()
+            try:
+                value = self._function(target, name)(*args, **kwargs)
+                if isinstance(recorded, dict) and 'r' in recorded and (
+                        _is_iterator(value)):
+                    # the recorded iteration time is part of the call
+                    value = list(value)
+            except Exception as exc:
+                result.elapsed += default_timer() - start
+                replay_error = (getattr(exc, 'errno', None) or
+                                type(exc).__name__)
+            else:
+                result.elapsed += default_timer() - start
+                self._register(recorded, value)
+            result.calls += 1
+            if replay_error != recorded_error:
+                result.mismatches.append(
+                    (index, name, recorded_error, replay_error))
+        return result
+
+    def _function(self, target, name):
+        if target == 'open':
+            return self.open_function
+        if target == 'os':
+            return getattr(self.os_module, name)
+        if target == 'path':
+            return getattr(self.os_module.path, name)
+        if target not in self.handles:
+            raise ValueError('File handle %d is not open' % target)
+        return getattr(self.handles[target], name)
+
+    def _register(self, recorded, value):
+        """Map the recorded handles and file descriptors to the objects
+        returned in the replay."""
+        if isinstance(recorded, dict):
+            if 'h' in recorded:
+                self.handles[recorded['h']] = value
+            elif 'fd' in recorded:
+                self.fds[recorded['fd']] = value
+
+    def _decode(self, value, rebase):
+        if isinstance(value, list):
+            return [self._decode(item, rebase) for item in value]
+        if isinstance(value, dict):
+            if 'fd' in value:
+                return self.fds.get(value['fd'], value['fd'])
+            if 'h' in value:
+                return self.handles.get(value['h'])
+            if 'n' in value:
+                return 'x' * value['n'] if value.get('t') else (
+                    b'\0' * value['n'])
+            if 'b' in value:
+                return self._rebase(value['b'].encode('latin-1'), rebase)
+            if 'r' in value:
+                return None
+            return dict((str(key), self._decode(item, rebase))
+                        for key, item in value.items())
+        if is_unicode_string(value):
+            return self._rebase(value, rebase)
+        return value
+
+    def _rebase(self, path, rebase):
+        """Move an absolute recorded path below the real root directory."""
+        if not rebase:
+            return path
+        separator = self.trace.path_separator
+        if is_byte_string(path):
+            separator = separator.encode('latin-1')
+            root = self.real_root.encode('latin-1') if is_unicode_string(
+                self.real_root) else self.real_root
+        else:
+            root = self.real_root
+        if path.startswith(separator):
+            return os.path.join(root, path.lstrip(separator))
+        return path
+
+
+def replay(trace, filesystem=None, real_root=None):
+    """Re-execute the calls recorded in `trace`.
+
+    The calls are replayed against `filesystem`, or against a new
+    :py:class:`FakeFilesystem` if not given, or - if `real_root` is set -
+    against the real file system. In the latter case, the recorded absolute
+    paths are moved below `real_root`. Note that only the recorded calls are
+    replayed, so any files existing before the recording started have to be
+    created before the replay.
+    Iterators returned by calls like `os.walk()` and `os.scandir()` are
+    consumed completely in the replay, regardless of how far they have been
+    iterated while recording. Calls of the yielded objects, like
+    `DirEntry.stat()`, are not recorded.
+
+    Args:
+        trace: A :py:class:`Trace`, or the path of a saved trace file.
+        filesystem: The fake file system to use.
+        real_root: An existing real directory used as root for the
+            replayed calls.
+
+    Returns:
+        A :py:class:`ReplayResult` with the timing of the replayed calls.
+
+    Raises:
+        ValueError: if both `filesystem` and `real_root` are given.
+    """
+    if not isinstance(trace, Trace):
+        trace = Trace.load(trace)
+    if real_root is not None:
+        if filesystem is not None:
+            raise ValueError('Cannot replay against a fake file system '
+                             'and the real file system at the same time')
+        os_module = os
+        open_function = open
+    else:
+        if filesystem is None:
+            filesystem = fake_filesystem.FakeFilesystem(
+                path_separator=trace.path_separator)
+        os_module = fake_filesystem.FakeOsModule(filesystem)
+        open_function = fake_filesystem.FakeFileOpen(filesystem)
+    return _Replayer(trace, os_module, open_function, real_root).run()